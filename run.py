@@ -1,14 +1,15 @@
 import argparse
+import contextlib
 import json
 import logging
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-from tqdb import __version__ as tqdb_version
-from tqdb import main, storage
+from tqdb import main, output, storage
 from tqdb.constants import paths
 from tqdb.utils import images
-from tqdb.utils.text import texts
 
 # Disable any DEBUG logging from PIL:
 logging.getLogger("PIL").setLevel(logging.WARNING)
@@ -17,29 +18,98 @@ logging.getLogger("PIL").setLevel(logging.WARNING)
 LANGUAGES = ["cs", "de", "en", "es", "fr", "it", "ja", "ko", "pl", "ru", "uk", "zh"]
 
 
-def tqdb_language(language):
+def tqdb_language(language, writer, bitmaps, max_entries=storage.ParseCache.MAX_ENTRIES, overlays=(), workers=1):
     """
-    Run the parser for a specific language.
+    Run the parser for a specific language, in its own parse session.
+
+    With overlays (of a mod), the language is parsed again with the overlays
+    on top of the database, which reuses all records the overlays don't affect.
+
+    :param bitmaps: the converters for the item bitmaps, shared by all
+        languages, keyed by the name of the overlays (None for the database).
 
     """
-    # Prepare the texts based on the language:
-    logging.info(f"Parsing locale: {language}")
-    texts.load_locale(language)
+    # The session prepares the texts based on the language. With overlays, it
+    # keeps the parsed files for the session with the overlays:
+    session = storage.ParseSession(language, max_entries, workers=workers, keep_files=bool(overlays))
+    writer.write_texts(language, session.texts.texts)
 
-    data = {
-        "affixes": main.parse_affixes(),
-        "creatures": main.parse_creatures(),
-        "equipment": main.parse_equipment(),
-        "quests": main.parse_quests(),
-        "sets": main.parse_sets(),
-        "skills": main.parse_skills(),
-    }
+    session.run(parse_language, language, writer, bitmaps[None])
+    logging.info(f"{language}: {session.diagnostics.summary()}")
+
+    if overlays:
+        name = overlay_name(overlays)
+        forked = session.fork(overlays)
+        forked.run(parse_language, language, writer, bitmaps[name], name)
+        logging.info(f"{language} with {name}: {forked.diagnostics.summary()}")
+
+
+def overlay_name(overlays):
+    """
+    Name the overlays after their directories, or None without overlays.
+
+    """
+    return "+".join(Path(overlay).name for overlay in overlays) or None
+
+
+def graphics(name=None):
+    """
+    Return the directory the icons are converted to, for the overlays with a name.
+
+    The icons of overlays are kept apart from those of the database, and get
+    a sprite sheet of their own.
+
+    """
+    return paths.GRAPHICS if name is None else paths.OUTPUT / f"graphics.{name}"
+
+
+def positive_float(value):
+    """
+    Parse a command line argument as a number above zero.
+
+    """
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+
+    return number
+
+
+def parse_language(language, writer, bitmaps, name=None):
+    """
+    Parse all data for a specific language.
+
+    Each category is written as soon as it's parsed. Only the creatures and
+    quests are kept until the loot is indexed.
+
+    :param bitmaps: the converter for the item bitmaps.
+    :param name: name of the overlays that are parsed, if any.
+
+    """
+    logging.info(f"Parsing locale: {language}" + (f" with {name}" if name else ""))
+
+    # The overlays are written as a variant of the locale:
+    locale = f"{language.lower()}.{name}" if name else language.lower()
+
+    writer.write(locale, "affixes", main.parse_affixes())
 
-    logging.info("Writing output to files...")
+    creatures = main.parse_creatures()
+    writer.write(locale, "creatures", creatures)
 
-    output_name = paths.OUTPUT / f"tqdb.{language.lower()}.{tqdb_version}.json"
-    with open(output_name, "w", encoding="utf8") as data_file:
-        json.dump(data, data_file, ensure_ascii=False, sort_keys=True)
+    writer.write(locale, "equipment", main.parse_equipment(bitmaps))
+
+    quests = main.parse_quests()
+    writer.write(locale, "quests", quests)
+
+    writer.write(locale, "sets", main.parse_sets())
+
+    # The skills are stored while parsing all of the above:
+    writer.write(locale, "skills", main.parse_skills())
+
+    # Index the item sources from the creatures and quests:
+    writer.write(locale, "loot", main.parse_loot(creatures, quests))
+
+    writer.end_locale(locale)
 
 
 def tqdb_parse():
@@ -105,6 +175,70 @@ def tqdb():
     argparser.add_argument("-f", "--force", action="store", default=False, dest="force_parsing")
     argparser.add_argument("-a", "--all-languages", action="store_true", default=False, dest="all_languages")
 
+    argparser.add_argument(
+        "--cache-size",
+        help=f"Number of parsed records to keep in memory (default: {storage.ParseCache.MAX_ENTRIES})",
+        action="store",
+        type=int,
+        default=storage.ParseCache.MAX_ENTRIES,
+        dest="cache_size",
+    )
+    argparser.add_argument(
+        "--overlay",
+        help="Directories with (mod) records to parse on top of the database, after parsing it",
+        nargs="+",
+        default=[],
+        dest="overlays",
+    )
+    argparser.add_argument(
+        "--parallel",
+        help="Number of languages to parse at the same time, with --all-languages (default: 1)",
+        action="store",
+        type=int,
+        default=1,
+        dest="parallel",
+    )
+    argparser.add_argument(
+        "--workers",
+        help="Number of threads that parse the records of a language (default: 1), "
+        "more than 1 can change the suffixes of duplicate skill tags between runs",
+        action="store",
+        type=int,
+        default=1,
+        dest="workers",
+    )
+    argparser.add_argument(
+        "--output",
+        help="Formats to write the parsed data in (default: json)",
+        nargs="+",
+        choices=list(output.FORMATS),
+        default=["json"],
+        dest="output_formats",
+    )
+    argparser.add_argument(
+        "--sprite-categories",
+        help="Create a sprite sheet per equipment category",
+        action="store_true",
+        default=False,
+        dest="sprite_categories",
+    )
+    argparser.add_argument(
+        "--sprite-formats",
+        help="Image formats to save the sprite sheets in (default: png)",
+        nargs="+",
+        choices=["png", "webp"],
+        default=["png"],
+        dest="sprite_formats",
+    )
+    argparser.add_argument(
+        "--sprite-scales",
+        help="Additional scales to save the sprite sheets in, like 2 or 0.5",
+        nargs="+",
+        type=positive_float,
+        default=[],
+        dest="sprite_scales",
+    )
+
     argparser.add_argument(
         "-d",
         "--debug",
@@ -119,10 +253,20 @@ def tqdb():
     args = argparser.parse_args()
     logging.basicConfig(level=args.loglevel, format="%(asctime)s %(levelname)s %(message)s", datefmt="%H:%M:%S")
 
+    # The icons of the database, and of the overlays if there are any:
+    names = list(dict.fromkeys([None, overlay_name(args.overlays)]))
+
     def create_sprite_sheet():
-        start_time = time.time()
-        images.SpriteCreator()
-        logging.info(f"Sprite sheet took {time.time() - start_time:.2f}s")
+        for name in names:
+            start_time = time.time()
+            images.SpriteCreator(
+                per_category=args.sprite_categories,
+                formats=args.sprite_formats,
+                scales=args.sprite_scales,
+                graphics=graphics(name),
+                name=f"sprite.{name}" if name else "sprite",
+            )
+            logging.info(f"Sprite sheet took {time.time() - start_time:.2f}s")
 
     # Ensure required directories exist:
     if not os.path.exists(paths.GRAPHICS):
@@ -132,9 +276,14 @@ def tqdb():
     # if args.force_parsing or not os.path.exists(paths.CACHE):
     #     tqdb_parse()
 
+    writer = output.create(args.output_formats)
+
     if not args.all_languages:
-        # Parse the specified language:
-        tqdb_language(args.locale)
+        # Parse the specified language, the bitmaps are converted before the sprite sheet is created:
+        with contextlib.ExitStack() as stack:
+            bitmaps = {name: stack.enter_context(images.BitmapConverter(graphics(name))) for name in names}
+            tqdb_language(args.locale, writer, bitmaps, args.cache_size, args.overlays, args.workers)
+        writer.close()
 
         # Create the sprite sheet for a single language
         create_sprite_sheet()
@@ -142,10 +291,31 @@ def tqdb():
         # Stop here
         return
 
-    # Parse all languages:
-    for language in LANGUAGES:
-        tqdb_language(language)
-        storage.reset()
+    # The structure is compared to the reference locale as the other locales
+    # are written, so that one is parsed before the others:
+    languages = list(LANGUAGES)
+    if "structure" in args.output_formats:
+        languages.remove(output.StructureWriter.REFERENCE)
+        first = [output.StructureWriter.REFERENCE]
+    else:
+        first = []
+
+    # Parse all languages, each in its own session. The sessions share the
+    # converters, so each bitmap is only converted once for all of them:
+    with contextlib.ExitStack() as stack:
+        bitmaps = {name: stack.enter_context(images.BitmapConverter(graphics(name))) for name in names}
+        for language in first:
+            tqdb_language(language, writer, bitmaps, args.cache_size, args.overlays, args.workers)
+
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers=args.parallel))
+        futures = [
+            executor.submit(tqdb_language, language, writer, bitmaps, args.cache_size, args.overlays, args.workers)
+            for language in languages
+        ]
+        for future in futures:
+            future.result()
+
+    writer.close()
 
     # Create the sprite sheet after all languages have been parsed:
     create_sprite_sheet()
@@ -8,8 +8,11 @@ from pathlib import Path
 DATA = Path("data")
 DB = DATA / "database"
 RES = DATA / "resources"
+TEXTURES = DATA / "textures"
 
 OUTPUT = Path("output")
 GRAPHICS = OUTPUT / "graphics"
 CACHE = OUTPUT / "cache"
+# Converted icons, kept between runs:
+ICONS = CACHE / "icons"
 PARSING = OUTPUT / "parsing"
@@ -0,0 +1,336 @@
+"""
+Index of the files in the extracted game database and textures.
+
+Walking the huge `data/database/records` tree is slow, so it's walked once
+and all resource patterns are matched against this index instead. The index
+also answers whether referenced records and textures exist, without a stat
+call for each reference.
+
+The records can come from multiple sources: the database, with the overlays
+of a mod on top of it. The sources of the current parse session are
+available as `database`.
+
+"""
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+from tqdb.constants import paths
+from tqdb.session import session_attribute
+
+
+class FileIndex:
+    """
+    FileIndex class.
+
+    Index of all files in a directory tree. The tree is walked once, with
+    os.scandir, the first time the index is used. The index is saved between
+    runs along with the modification times of all directories, and is only
+    walked again when any of those have changed.
+
+    """
+
+    def __init__(self, root: Path, cache: Path):
+        self.root = root
+        self.cache = cache
+
+        # Sorted list of all file paths, relative to the root (with slashes):
+        self.files = None
+
+        # Lowercase relative paths, mapped to the actual path of the file:
+        self.lookup = {}
+
+        # Sessions can use the index from multiple threads, but it's loaded once:
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the index from the cache, or walk the tree if it's outdated.
+
+        """
+        if self.files is not None:
+            return
+
+        with self.lock:
+            if self.files is not None:
+                return
+
+            if not os.path.isdir(self.root):
+                logging.warning(f"No directory found for {self.root}.")
+                self.files = []
+                return
+
+            index = self.read_cache()
+            if index is None:
+                index = self.scan()
+                self.write_cache(index)
+
+            # The lookup is published before the files, which mark the index as loaded:
+            files = index["files"]
+            self.lookup = {file.lower(): file for file in files}
+            self.files = files
+
+    def scan(self):
+        """
+        Walk the tree and index all files and directories.
+
+        """
+        directories = {}
+        files = []
+
+        remaining = [""]
+        while remaining:
+            relative = remaining.pop()
+            directory = os.path.join(self.root, relative)
+
+            # The modification time of a directory changes with its entries:
+            directories[relative] = os.stat(directory).st_mtime_ns
+
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    path = f"{relative}/{entry.name}" if relative else entry.name
+                    if entry.is_dir():
+                        remaining.append(path)
+                    else:
+                        files.append(path)
+
+        files.sort()
+        logging.info(f"Indexed {len(files)} files in {self.root}.")
+
+        return {"directories": directories, "files": files}
+
+    def read_cache(self):
+        """
+        Read the saved index, if none of its directories were changed.
+
+        """
+        if not os.path.isfile(self.cache):
+            return None
+
+        with open(self.cache, encoding="utf8") as cache_file:
+            index = json.load(cache_file)
+
+        if index.get("root") != str(self.root):
+            return None
+
+        for relative, mtime in index["directories"].items():
+            try:
+                if os.stat(os.path.join(self.root, relative)).st_mtime_ns != mtime:
+                    return None
+            except FileNotFoundError:
+                return None
+
+        return index
+
+    def write_cache(self, index):
+        """
+        Save the index so it can be reused in the next run.
+
+        """
+        os.makedirs(self.cache.parent, exist_ok=True)
+
+        with open(self.cache, "w", encoding="utf8") as cache_file:
+            json.dump({"root": str(self.root), **index}, cache_file)
+
+    def glob(self, pattern):
+        """
+        Find all indexed files matching a glob pattern.
+
+        The pattern is relative to the root, and supports '*', '?' and '**'
+        just like a recursive glob.
+
+        :return: sorted list of matching paths, prefixed with the root.
+
+        """
+        return [self.root / file for file in self.match(pattern)]
+
+    def match(self, pattern):
+        """
+        Find all indexed files matching a glob pattern.
+
+        :return: sorted list of matching paths, relative to the root.
+
+        """
+        self.load()
+
+        regex = self.compile(pattern)
+        return [file for file in self.files if regex.match(file)]
+
+    def resolve(self, path):
+        """
+        Find the actual path of an indexed file, ignoring case.
+
+        References in the database use backslashes and don't always match
+        the case of the files, so both are normalized before the lookup.
+
+        :param path: path of the file, either relative to the root or
+            prefixed with it.
+        :return: path of the file, prefixed with the root, or None if the file
+            doesn't exist.
+
+        """
+        file = self.find(self.relative(path))
+        return self.root / file if file else None
+
+    def relative(self, path):
+        """
+        Normalize a path to a path relative to the root, with slashes.
+
+        """
+        relative = str(path).replace("\\", "/")
+        root = f"{self.root.as_posix()}/"
+        if relative.lower().startswith(root.lower()):
+            relative = relative[len(root) :]
+
+        return relative
+
+    def find(self, relative):
+        """
+        Find the actual relative path of an indexed file, ignoring case.
+
+        """
+        self.load()
+
+        return self.lookup.get(relative.lower())
+
+    def exists(self, path):
+        """
+        Check if a file exists in the index, ignoring case.
+
+        """
+        return self.resolve(path) is not None
+
+    @staticmethod
+    def compile(pattern):
+        """
+        Compile a glob pattern into a regex matching relative file paths.
+
+        """
+        segments = []
+        for segment in pattern.replace("\\", "/").split("/"):
+            if segment == "**":
+                # Any number of directories, including none:
+                segments.append("(?:[^/]*/)*")
+                continue
+
+            regex = "".join("[^/]*" if char == "*" else "[^/]" if char == "?" else re.escape(char) for char in segment)
+            segments.append(f"{regex}/")
+
+        # Glob patterns are case insensitive on Windows:
+        flags = re.IGNORECASE if os.name == "nt" else 0
+
+        return re.compile("".join(segments).rstrip("/") + "$", flags)
+
+
+class RecordSources:
+    """
+    RecordSources class.
+
+    A stack of indexed record sources: the database at the bottom, and any
+    overlays on top of it. A record is identified by its path in the database,
+    even if it only exists in an overlay, and the topmost source that has a
+    record wins.
+
+    """
+
+    def __init__(self, layers):
+        self.layers = layers
+        self.root = layers[0].root
+
+        # The shared path for each reference, see `reference`:
+        self.references = {}
+
+    def overlay(self, roots):
+        """
+        Create the sources with more overlays on top of these.
+
+        """
+        overlays = [FileIndex(Path(root), paths.CACHE / f"overlay.{Path(root).name}.json") for root in roots]
+        return RecordSources(self.layers + overlays)
+
+    def glob(self, pattern):
+        """
+        Find all records in any source matching a glob pattern.
+
+        :return: sorted list of matching records.
+
+        """
+        files = {}
+        for layer in self.layers:
+            for file in layer.match(pattern):
+                # The database determines the case of a record in all sources:
+                files.setdefault(file.lower(), file)
+
+        return sorted(self.root / file for file in files.values())
+
+    def resolve(self, path):
+        """
+        Find the actual path of a record in any source, ignoring case.
+
+        :return: path of the record, prefixed with the database root, or None
+            if no source has it.
+
+        """
+        relative = self.layers[0].relative(path)
+        for layer in self.layers:
+            file = layer.find(relative)
+            if file:
+                return self.root / file
+
+        return None
+
+    def reference(self, value):
+        """
+        Return the path for a reference to a record.
+
+        The same records are referenced thousands of times, so each reference
+        returns one shared Path object instead of creating a new one. Since
+        overlays can add records, the paths are only shared by references that
+        are resolved with these sources.
+
+        """
+        path = self.references.get(value)
+        if path is None:
+            path = self.references.setdefault(value, self.resolve(value) or self.root / value)
+
+        return path
+
+    def exists(self, path):
+        """
+        Check if a record exists in any source, ignoring case.
+
+        """
+        return self.resolve(path) is not None
+
+    def locate(self, path):
+        """
+        Find the file to read a record from, in the topmost source that has it.
+
+        :return: path of the file, or the path itself if no source has it.
+
+        """
+        relative = self.layers[0].relative(path)
+        for layer in reversed(self.layers):
+            file = layer.find(relative)
+            if file:
+                return layer.root / file
+
+        return path
+
+    def overridden(self):
+        """
+        Return all records that the overlays override or add.
+
+        """
+        return {self.resolve(file) for layer in self.layers[1:] for file in layer.match("**/*.dbr")}
+
+
+# Prepare an index of the database and textures for usage:
+index = FileIndex(paths.DB, paths.CACHE / "database.json")
+textures = FileIndex(paths.TEXTURES, paths.CACHE / "textures.json")
+
+# The record sources of the current session:
+database = session_attribute("database")
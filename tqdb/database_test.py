@@ -0,0 +1,144 @@
+"""
+Functional tests for the database file index.
+
+"""
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tqdb.constants import paths
+from tqdb.database import FileIndex, RecordSources
+
+FILES = [
+    "records/item/equipmentarmband/a01.dbr",
+    "records/item/equipmentarmband/old/a02.dbr",
+    "records/xpack/item/equipmentring/r01.dbr",
+    "records/item/lootmagicalaffixes/prefix/tables_a/t01.dbr",
+    "templates/itemring.tpl",
+    "templates/ingameui/button.tpl",
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    """
+    Create a small database tree and an index for it.
+
+    """
+    root = tmp_path / "database"
+    for file in FILES:
+        os.makedirs((root / file).parent, exist_ok=True)
+        (root / file).touch()
+
+    return FileIndex(root, tmp_path / "cache" / "database.json")
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        "records/item*/equipment*/**/*.dbr",
+        "records/xpack*/item*/equipment*/*.dbr",
+        "records/item*/lootmagicalaffixes/*ix/tables*/*.dbr",
+        "templates/**/*.tpl",
+        "records/item/equipmentarmband/a0?.dbr",
+    ],
+)
+def test_glob_matches_recursive_glob(index, pattern):
+    """
+    Test that matching the index finds the same files as a recursive glob.
+
+    """
+    expected = sorted(glob.glob(str(index.root / pattern), recursive=True))
+
+    assert [str(file) for file in index.glob(pattern)] == expected
+
+
+def test_cache_is_reused_until_changed(index):
+    """
+    Test that the saved index is only used while the tree is unchanged.
+
+    """
+    index.glob("**/*.dbr")
+    assert index.read_cache() is not None
+
+    (index.root / "records/item/equipmentarmband/a03.dbr").touch()
+    assert index.read_cache() is None
+
+
+def test_concurrent_loads_scan_once(index, monkeypatch):
+    """
+    Test that threads loading the index at the same time scan it once, and all see it loaded.
+
+    """
+    scans = []
+    scan = index.scan
+    monkeypatch.setattr(index, "scan", lambda: scans.append(1) or scan())
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        found = list(executor.map(lambda _: index.find("records/xpack/item/equipmentring/r01.dbr"), range(32)))
+
+    assert len(scans) == 1
+    assert found == ["records/xpack/item/equipmentring/r01.dbr"] * 32
+
+
+def test_resolve_ignores_case_and_separators(index):
+    """
+    Test that references resolve to indexed files regardless of their case.
+
+    """
+    expected = index.root / "records/xpack/item/equipmentring/r01.dbr"
+
+    assert index.resolve("Records\\XPack\\Item\\EquipmentRing\\R01.dbr") == expected
+    assert index.resolve(index.root / "records/xpack/item/equipmentring/r01.dbr") == expected
+    assert index.exists("records/xpack/item/equipmentring/r02.dbr") is False
+
+
+def test_overlay_sources(index, tmp_path, monkeypatch):
+    """
+    Test that an overlay adds and overrides records of the database.
+
+    """
+    monkeypatch.setattr(paths, "CACHE", tmp_path / "cache")
+
+    overlay = tmp_path / "mod"
+    for file in ["records/item/equipmentarmband/a01.dbr", "records/item/equipmentarmband/a09.dbr"]:
+        os.makedirs((overlay / file).parent, exist_ok=True)
+        (overlay / file).touch()
+
+    sources = RecordSources([index]).overlay([overlay])
+
+    assert sources.glob("records/item/equipmentarmband/*.dbr") == [
+        index.root / "records/item/equipmentarmband/a01.dbr",
+        index.root / "records/item/equipmentarmband/a09.dbr",
+    ]
+    assert sources.locate(index.root / "records/item/equipmentarmband/a01.dbr") == (
+        overlay / "records/item/equipmentarmband/a01.dbr"
+    )
+    assert sources.locate("records/xpack/item/equipmentring/r01.dbr") == (
+        index.root / "records/xpack/item/equipmentring/r01.dbr"
+    )
+    assert sources.overridden() == {
+        index.root / "records/item/equipmentarmband/a01.dbr",
+        index.root / "records/item/equipmentarmband/a09.dbr",
+    }
+
+
+def test_references_per_sources(index, tmp_path, monkeypatch):
+    """
+    Test that references are shared, but only within the same sources.
+
+    """
+    monkeypatch.setattr(paths, "CACHE", tmp_path / "cache")
+
+    overlay = tmp_path / "mod"
+    os.makedirs(overlay / "records/item", exist_ok=True)
+    (overlay / "records/item/Added.dbr").touch()
+
+    sources = RecordSources([index])
+    overlaid = sources.overlay([overlay])
+
+    assert sources.reference("records/item/added.dbr") == index.root / "records/item/added.dbr"
+    assert overlaid.reference("records/item/added.dbr") == index.root / "records/item/Added.dbr"
+    assert overlaid.reference("records/item/added.dbr") is overlaid.reference("records/item/added.dbr")
@@ -8,15 +8,65 @@ Upon receiving a file to parse it will grab the template associated with
 the DBR and then parse it according to all properties in that template.
 
 """
+import contextvars
+import hashlib
+import itertools
+import locale
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from tqdb import storage
-from tqdb.parsers.main import load_parsers, InvalidItemError
+from tqdb.database import database
+from tqdb.diagnostics import diagnostics
+from tqdb.parsers.main import Skipped, load_parsers
 from tqdb.templates import templates, templates_by_path
 
 
 parsers = {}
 
+# Parsers are stateless and shared by all sessions, but only loaded once:
+parsers_lock = threading.Lock()
+
+# DBR files are decoded with the same encoding text files are opened with:
+ENCODING = locale.getpreferredencoding(False)
+
+# The records that are being parsed, from the outermost one in:
+parsing = contextvars.ContextVar("parsing", default=())
+
+# Properties that determine the template of a DBR:
+TEMPLATE_KEYS = {b"templateName": "templateName", b"Class": "Class"}
+
+# Number of records that are read ahead of the parser:
+PREFETCH = 64
+
+
+def get_parsers(template):
+    """
+    Return the parsers for a template and the templates it includes.
+
+    :return: list of parsers, sorted from highest to lowest priority.
+
+    """
+    # Initialize the parsers map if necessary:
+    global parsers
+    if not parsers:
+        with parsers_lock:
+            if not parsers:
+                parsers = load_parsers()
+
+    # Begin with the parser for the template itself, if available:
+    prioritized = [parsers[template.key]] if template.key in parsers else []
+
+    # Add any inherited template parsers:
+    prioritized.extend(parsers[t] for t in template.templates if t in parsers)
+
+    # Prioritize the list:
+    prioritized.sort(key=lambda p: p.get_priority(), reverse=True)
+
+    return prioritized
+
 
 def get_template(dbr, dbr_file):
     """
@@ -38,36 +88,174 @@ def get_template(dbr, dbr_file):
     raise Exception(f"Template could not be found for {dbr_file}")
 
 
-def read(dbr):
+def _tokenize(dbr):
     """
-    Read a DBR file and split its contents into key, value properties.
-    May return an empty dict if certain errors occur.
+    Read a DBR file and split its contents into a dict of key, value bytes.
 
-    """
-    try:
-        with open(dbr) as dbr_file:
-            result = {}
+    The properties are only decoded once the template is known, see `read`.
 
-            # DBR lines always end with ',\n' which we remove
-            lines = (line.rstrip(",\n") for line in dbr_file)
+    :return: the properties and a digest of the file contents, or an empty
+        dict and None if the file can't be read.
 
-            # Only add properties that have the correct format per line
-            # of: key,value
-            properties = dict(tuple(line.split(",", 1)) for line in lines if "," in line)
+    """
+    try:
+        with open(dbr, "rb") as dbr_file:
+            content = dbr_file.read()
     except FileNotFoundError:
-        logging.debug(f"No file found for {dbr}. ")
-        return {}
+        logging.debug("No file found for %s.", dbr)
+        return {}, None
     except PermissionError as e:
         logging.exception(f"Could not open {dbr}")
+        return {}, None
+
+    # DBR lines always end with ',\n' which we remove
+    lines = (line.rstrip(b",") for line in content.splitlines())
+
+    # Only add properties that have the correct format per line
+    # of: key,value
+    return dict(line.split(b",", 1) for line in lines if b"," in line), hashlib.sha1(content).digest()
+
+
+def _tokens(dbr, keep=True):
+    """
+    Return the tokenized properties and digest of a DBR file.
+
+    The prefetched properties are used if the file was read ahead, and are
+    dropped unless `keep` is set.
+
+    """
+    prefetched = storage.current().prefetched
+    tokenized = prefetched.get(dbr) if keep else prefetched.pop(dbr, None)
+
+    return tokenized if tokenized is not None else _tokenize(database.locate(dbr))
+
+
+def prefetch(files, workers=None, ahead=PREFETCH):
+    """
+    Iterate over DBR files, while the next files are read in the background.
+
+    Up to `ahead` files are read and tokenized by a thread pool before the
+    parser gets to them, so waiting for the disk overlaps with parsing. The
+    `read` function uses the prefetched properties of the current file.
+
+    The properties are dropped once the next file is yielded.
+
+    """
+    prefetched = storage.current().prefetched
+    remaining = iter(files)
+    pending = deque()
+
+    def schedule():
+        for dbr in itertools.islice(remaining, ahead - len(pending)):
+            # Records that were parsed or read before don't have to be read again:
+            read_before = dbr in storage.db or dbr in prefetched
+            future = None if read_before else executor.submit(_tokenize, database.locate(dbr))
+            pending.append((dbr, future))
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+    try:
+        schedule()
+        while pending:
+            dbr, future = pending.popleft()
+            if future is not None:
+                prefetched[dbr] = future.result()
+            schedule()
+
+            try:
+                yield dbr
+            finally:
+                # Drop the properties if the file wasn't read after all:
+                prefetched.pop(dbr, None)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def peek(dbr, keys):
+    """
+    Read a few properties of a DBR file, without parsing it.
+
+    This is much cheaper than `read`, since only the requested properties are
+    decoded and no template is involved. Values are the raw strings.
+
+    """
+    tokens, _ = _tokens(dbr)
+
+    encoded = ((key, key.encode()) for key in keys)
+    return {key: tokens[encoded_key].decode(ENCODING) for key, encoded_key in encoded if encoded_key in tokens}
+
+
+def read_references(dbr):
+    """
+    Find the template of a DBR file and the DBR files it references.
+
+    Only the reference properties are decoded and parsed, the DBR itself
+    isn't parsed.
+
+    :return: the template and a list of referenced files that exist, or None
+        and an empty list if the template is unknown.
+
+    """
+    tokens, _ = _tokens(dbr)
+
+    try:
+        template = get_template(read_header(tokens), dbr)
+    except Exception:
+        return None, []
+
+    references = []
+    for key in template.references & tokens.keys():
+        name = template.keys[key]
+        value = template.variables[name].parse_value(tokens[key].decode(ENCODING))
+        references.extend(
+            reference for reference in (value if isinstance(value, list) else [value]) if database.exists(reference)
+        )
+
+    return template, references
+
+
+def read(dbr):
+    """
+    Read a DBR file and split its contents into key, value properties.
+    May return an empty dict if certain errors occur.
+
+    """
+    tokens, _ = _tokens(dbr, keep=False)
+
+    if not tokens:
         return {}
 
+    # Only decode the properties that determine the template first:
+    header = read_header(tokens)
+
+    return decode(tokens, header, get_template(header, dbr))
+
+
+def read_header(tokens):
+    """
+    Decode the properties of a tokenized DBR that determine its template.
+
+    """
+    return {name: tokens[key].decode(ENCODING) for key, name in TEMPLATE_KEYS.items() if key in tokens}
+
+
+def decode(tokens, header, template):
+    """
+    Decode and parse the properties of a tokenized DBR with its template.
+
+    """
+    result = {}
+
     # The 'templateName' property isn't in any Template, so add
     # manually:
-    if "templateName" in properties:
-        result["templateName"] = properties["templateName"]
+    if "templateName" in header:
+        result["templateName"] = header["templateName"]
 
-    # Get the template for this DBR
-    template = get_template(properties, dbr)
+    properties = dict(header)
+
+    # Then decode only the properties the template has variables for:
+    properties.update(
+        (template.keys[key], value.decode(ENCODING)) for key, value in tokens.items() if key in template.keys
+    )
 
     def parse_vars_to_tuples(variables_dict):
         for name, variable in variables_dict.items():
@@ -87,20 +275,74 @@ def parse(dbr_file, references=None):
     """
     Parse a DBR file according to its template.
 
+    Records that are skipped are reported in the diagnostics, once.
+
+    :return: the parsed result, or a `Skipped` result if the file is skipped.
+
     """
-    if references is None:
-        references = {}
-    # Initialize the parsers map if necessary:
-    global parsers
-    if not parsers:
-        parsers = load_parsers()
+    session = storage.current()
+
+    # Track the records that use this one, to know what an overlay affects:
+    parents = parsing.get()
+    if parents:
+        session.dependents.setdefault(dbr_file, set()).add(parents[-1])
 
     # First check if the file has been parsed before:
-    if dbr_file in storage.db:
-        return storage.db[dbr_file]
+    cached = storage.db.get(dbr_file)
+    if cached is not None:
+        return cached
+
+    # Records that were skipped before are skipped again, without parsing
+    # (and reporting the records they skip) again. Unless they're parsed with
+    # references, since those can change the result:
+    failure = session.failures.get(dbr_file)
+    if failure is not None and not references:
+        return failure
+
+    token = parsing.set(parents + (dbr_file,))
+    try:
+        result = parse_record(dbr_file, references)
+    finally:
+        parsing.reset(token)
+
+    if isinstance(result, Skipped):
+        # A record can be skipped due to a record it uses:
+        result = result.of(dbr_file)
+        diagnostics.skip_result(result)
+        if not references:
+            session.failures[dbr_file] = result
+
+    return result
+
+
+def content_key(digest, dbr_file, prioritized_parsers, references):
+    """
+    Identify the result of a record by its contents, instead of its path.
+
+    The digest covers the template too, since the template is determined by
+    the contents. Parsers that use the path of the record add the part of the
+    path they use, and records that are parsed with references from the record
+    using them can't share their result at all.
+
+    :return: the key of the result, or None if it can't be shared.
+
+    """
+    if digest is None or references:
+        return None
 
-    logging.debug(f"Parsing {dbr_file}")
-    dbr = read(dbr_file)
+    return digest, tuple(parser.path_key(dbr_file) for parser in prioritized_parsers)
+
+
+def parse_record(dbr_file, references=None):
+    """
+    Parse a DBR file that isn't cached yet.
+
+    """
+    if references is None:
+        references = {}
+
+    logging.debug("Parsing %s", dbr_file)
+    tokens, digest = _tokens(dbr_file, keep=False)
 
     # Initialize an empty result, this variable will be updated by the parsers.
     result = {
@@ -112,41 +354,41 @@ def parse(dbr_file, references=None):
     }
 
     # There are still non-existent references, make sure the DBR isn't empty:
-    if not dbr:
+    if not tokens:
         return result
 
     # If a template exists for this type, parse it accordingly:
-    template = get_template(dbr, dbr_file)
-
-    # Construct a list of parsers to organize by priority:
-    prioritized = []
-
-    # Begin updating the result by the first template parser, if available:
-    if template.key in parsers:
-        prioritized.append(parsers[template.key])
-
-    # Add any inherited template parsers:
-    for t in template.templates:
-        if t not in parsers:
-            continue
-        prioritized.append(parsers[t])
-
-    # Prioritize the list and then run through the parsers:
-    prioritized.sort(key=lambda p: p.get_priority(), reverse=True)
-    for prioritized_parser in prioritized:
-        try:
-            prioritized_parser.parse(dbr, dbr_file, result)
-        except InvalidItemError as e:
-            # One of the parsers has determined this file shouldn't be parsed:
-            raise InvalidItemError(
-                f"Parser {prioritized_parser} for template key {prioritized_parser.template.key} "
-                "tells us this item is invalid and should be ignored."
-            ) from e
+    header = read_header(tokens)
+    template = get_template(header, dbr_file)
+    prioritized_parsers = get_parsers(template)
+
+    # Records with the same contents share their result, if it's cached:
+    key = content_key(digest, dbr_file, prioritized_parsers, references)
+    if key is not None:
+        session = storage.current()
+        original = session.contents.setdefault(key, dbr_file)
+        shared = storage.db.get(original) if original != dbr_file else None
+        if shared is not None:
+            storage.db.alias(dbr_file, original)
+
+            # The alias uses the records the original used, through its result:
+            session.dependents.setdefault(original, set()).add(dbr_file)
+            return shared
+
+    dbr = decode(tokens, header, template)
+
+    # Run through the parsers for this template, by priority. Any of them can
+    # determine this file shouldn't be parsed, by returning a Skipped result:
+    for prioritized_parser in prioritized_parsers:
+        skipped = prioritized_parser.parse(dbr, dbr_file, result)
+        if skipped is not None:
+            return skipped
 
     # Pop the helper data references again:
     result.pop("references")
 
-    # Retain the parsed result in memory, for reuse:
-    storage.db[dbr_file] = result
+    # Retain the parsed result in memory, for reuse. Loot tables and skills
+    # (which have a path) are referenced by many records, so keep those:
+    storage.db.store(dbr_file, result, pinned="loot_table" in result or "path" in result)
 
     return result
@@ -0,0 +1,107 @@
+"""
+Functional tests for reading DBR files.
+
+"""
+import pytest
+
+from tqdb import dbr as DBRParser
+
+# Sample records, with the line endings and oddities found in the game files:
+SAMPLES = {
+    "lf": "templateName,records\\item.tpl,\nClass,ArmorProtective_Head,\nitemLevel,12,\n",
+    "crlf": "templateName,records\\item.tpl,\r\nClass,ArmorProtective_Head,\r\nitemLevel,12,\r\n",
+    "mixed": "Class,ArmorProtective_Head,\r\nitemLevel,12,\nitemNameTag,tagHelm,\r",
+    "no-comma": "Class,Monster,\nthis line has no comma\n\nitemLevel,3,\n",
+    "trailing": "Class,Monster,,,\nempty,\nlootNames,a.dbr;b.dbr,\nitemLevel,3",
+    "duplicates": "itemLevel,1,\nClass,Monster,\nitemLevel,2,\n",
+    "commas": "description,one, two, three,\n,value,\n",
+    "non-ascii": "Class,Monster,\ndescription,Café ñandú ΑΒΓ 日本,\n",
+}
+
+
+def read_lines(path):
+    """
+    Split a DBR file into properties, like the text reader did before the tokenizer.
+
+    """
+    with open(path, encoding=DBRParser.ENCODING) as dbr_file:
+        lines = (line.rstrip(",\n") for line in dbr_file)
+        return dict(tuple(line.split(",", 1)) for line in lines if "," in line)
+
+
+@pytest.fixture
+def sample(tmp_path):
+    def write(name):
+        path = tmp_path / f"{name}.dbr"
+        path.write_bytes(SAMPLES[name].encode(DBRParser.ENCODING))
+        return path
+
+    return write
+
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_tokenize_matches_text_reader(sample, name):
+    """
+    Test that the tokenized properties are the same as the ones of the text reader.
+
+    """
+    path = sample(name)
+    tokens, _ = DBRParser._tokenize(path)
+
+    decoded = {key.decode(DBRParser.ENCODING): value.decode(DBRParser.ENCODING) for key, value in tokens.items()}
+    assert decoded == read_lines(path)
+
+
+def test_tokenize_edge_cases(sample):
+    """
+    Test the tokenized properties of lines that aren't a plain key and value.
+
+    """
+    tokens, _ = DBRParser._tokenize(sample("crlf"))
+    assert tokens[b"itemLevel"] == b"12"
+
+    tokens, _ = DBRParser._tokenize(sample("no-comma"))
+    assert list(tokens) == [b"Class", b"itemLevel"]
+
+    # Trailing commas are stripped, so a key without a value isn't a property:
+    tokens, _ = DBRParser._tokenize(sample("trailing"))
+    assert tokens == {b"Class": b"Monster", b"lootNames": b"a.dbr;b.dbr", b"itemLevel": b"3"}
+
+    # The last value of a key wins:
+    tokens, _ = DBRParser._tokenize(sample("duplicates"))
+    assert tokens[b"itemLevel"] == b"2"
+
+    # Only the first comma separates the key from the value:
+    tokens, _ = DBRParser._tokenize(sample("commas"))
+    assert tokens == {b"description": b"one, two, three", b"": b"value"}
+
+    tokens, _ = DBRParser._tokenize(sample("non-ascii"))
+    assert tokens[b"description"].decode(DBRParser.ENCODING) == "Café ñandú ΑΒΓ 日本"
+
+
+def test_tokenize_digest(sample, tmp_path):
+    """
+    Test that the digest only depends on the contents of a file.
+
+    """
+    copy = tmp_path / "copy.dbr"
+    copy.write_bytes(sample("lf").read_bytes())
+
+    assert DBRParser._tokenize(copy)[1] == DBRParser._tokenize(sample("lf"))[1]
+    assert DBRParser._tokenize(sample("crlf"))[1] != DBRParser._tokenize(sample("lf"))[1]
+    assert DBRParser._tokenize(tmp_path / "missing.dbr") == ({}, None)
+
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_read_header_matches_text_reader(sample, name):
+    """
+    Test that the header has the template properties of the text reader.
+
+    """
+    path = sample(name)
+    tokens, _ = DBRParser._tokenize(path)
+
+    properties = read_lines(path)
+    assert DBRParser.read_header(tokens) == {
+        key: properties[key] for key in ["templateName", "Class"] if key in properties
+    }
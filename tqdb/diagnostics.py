@@ -0,0 +1,109 @@
+"""
+Diagnostics of the records that are skipped while parsing.
+
+Most records in the database aren't interesting for TQDB, so skipping them is
+expected. Instead of formatting a log message for each of them, the reason is
+recorded as a (code, path, args) tuple and counted. The messages are only
+formatted when debug logging is enabled, or when they're rendered.
+
+The diagnostics of the current parse session are available as `diagnostics`.
+
+"""
+import logging
+import threading
+from collections import Counter
+
+from tqdb.session import session_attribute
+
+# The message for each reason, formatted with the path and the arguments:
+MESSAGES = {
+    "artifact-difficulty": "Artifact %s has an unknown difficulty.",
+    "creature-loot": "Creature %s has no loot%sItem%s.",
+    "creature-tag": "Creature %s has no tag.",
+    "formula-artifact": "Artifact formula %s has no %s.",
+    "invalid-reference": "Record %s uses %s, which is skipped (%s).",
+    "item-classification": "Item %s is excluded due to Class %s with itemClassification %s.",
+    "item-difficulty": "Monster Infrequent %s does not specify a known difficulty.",
+    "item-tag": "Item %s has no itemNameTag.",
+    "loot-name": "Loot table %s has no lootName%s.",
+    "loot-reference": "Loot table %s references %s, which isn't a loot table or item.",
+    "loot-table": "Loot container %s has no table.",
+    "parse-error": "Record %s could not be parsed: %s",
+    "quest-reward": "Quest %s rewards %s, which is skipped (%s).",
+    "set-members": "Set %s has no members.",
+    "set-tag": "Set %s has no tag or name.",
+    "skill-name": "Skill %s has no skillDisplayName.",
+}
+
+
+def message(code, path, args):
+    """
+    Format the message for a skipped record.
+
+    """
+    return MESSAGES[code] % (path, *args)
+
+
+class Diagnostics:
+    """
+    Diagnostics class.
+
+    Collects the reasons records are skipped in a parse session, and counts
+    them per reason.
+
+    """
+
+    def __init__(self):
+        self.records = []
+        self.counts = Counter()
+
+        # Records can be skipped by multiple threads in a session:
+        self.lock = threading.Lock()
+
+    def skip(self, code, path, *args):
+        """
+        Record that a record is skipped, and why.
+
+        :param code: the reason, one of the MESSAGES keys.
+        :param path: the record that's skipped.
+        :param args: any details that are part of the message.
+
+        """
+        with self.lock:
+            self.records.append((code, path, args))
+            self.counts[code] += 1
+
+        # The logging module only formats the message if it's enabled:
+        logging.debug(MESSAGES[code], path, *args)
+
+    def skip_result(self, skipped):
+        """
+        Record that a record is skipped, with the `Skipped` result of its parse.
+
+        """
+        self.skip(skipped.code, skipped.path, *skipped.details)
+
+    def render(self, code=None):
+        """
+        Format the messages of all skipped records, or those for one reason.
+
+        """
+        with self.lock:
+            records = list(self.records)
+
+        return [message(c, path, args) for c, path, args in records if code is None or c == code]
+
+    def summary(self):
+        """
+        Summarize the number of skipped records, per reason.
+
+        """
+        with self.lock:
+            counts = self.counts.most_common()
+
+        details = ", ".join(f"{code}: {count}" for code, count in counts)
+        return f"Skipped {sum(count for _, count in counts)} records" + (f" ({details})." if details else ".")
+
+
+# The diagnostics of the current session:
+diagnostics = session_attribute("diagnostics")
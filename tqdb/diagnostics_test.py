@@ -0,0 +1,46 @@
+"""
+Functional tests for the diagnostics of skipped records.
+
+"""
+from tqdb.diagnostics import Diagnostics
+from tqdb.parsers.main import Skipped
+
+
+def test_skips_are_counted_and_rendered():
+    """
+    Test that skipped records are counted per reason and rendered on request.
+
+    """
+    diagnostics = Diagnostics()
+    diagnostics.skip("item-tag", "a.dbr")
+    diagnostics.skip("item-tag", "b.dbr")
+    diagnostics.skip("loot-name", "table.dbr", 3)
+
+    assert diagnostics.counts == {"item-tag": 2, "loot-name": 1}
+    assert diagnostics.render("loot-name") == ["Loot table table.dbr has no lootName3."]
+    assert diagnostics.summary() == "Skipped 3 records (item-tag: 2, loot-name: 1)."
+
+
+def test_skipped_message():
+    """
+    Test that a skipped item has the message of its reason.
+
+    """
+    skipped = Skipped("item-classification", "a.dbr", "ArmorProtective_Head", "Common")
+
+    assert str(skipped) == "Item a.dbr is excluded due to Class ArmorProtective_Head with itemClassification Common."
+
+
+def test_skipped_due_to_reference():
+    """
+    Test that a record skipped due to a record it uses reports that record.
+
+    """
+    diagnostics = Diagnostics()
+    diagnostics.skip_result(Skipped("item-tag", "a.dbr").of("a.dbr"))
+    diagnostics.skip_result(Skipped("item-tag", "b.dbr").of("set.dbr"))
+
+    assert diagnostics.render() == [
+        "Item a.dbr has no itemNameTag.",
+        "Record set.dbr uses b.dbr, which is skipped (item-tag).",
+    ]
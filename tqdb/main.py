@@ -2,6 +2,8 @@
 Main functions to parse the full Titan Quest Database.
 
 """
+import contextlib
+import contextvars
 import glob
 import logging
 import os
@@ -9,16 +11,22 @@ import re
 import string
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from pathlib import Path
 
 from tqdb import storage
 from tqdb.constants import resources, paths
-from tqdb.dbr import parse, read
-from tqdb.parsers.main import InvalidItemError
+from tqdb.database import database
+from tqdb.dbr import parse, peek, read
+from tqdb.diagnostics import diagnostics
+from tqdb.parsers.creatures import MonsterParser
+from tqdb.parsers.equipment import ItemBaseParser
+from tqdb.parsers.main import Skipped
+from tqdb.scheduler import Scheduler
 from tqdb.utils import images
 from tqdb.utils.text import texts
-from tqdb.utils.core import get_affix_table_type, is_duplicate_affix
+from tqdb.utils.core import fingerprint, get_affix_table_type
 
 
 def parse_affixes():
@@ -35,50 +43,42 @@ def parse_affixes():
 
     files = []
     for resource in resources.AFFIX_TABLES:
-        table_files = paths.DB / resource
-        files.extend(glob.glob(str(table_files), recursive=True))
+        files.extend(database.glob(resource))
 
     logging.info(f"Found {len(files)} affix table files.")
 
     # The affix tables will determine what gear an affix can be applied to.
-    affix_tables: dict[str, set] = {}
-    affix_files: set[Path] = set()
-    for dbr in files:
-        table = read(dbr)
-
-        # Use the filename to determine what equipment this table is for:
-        file_name = os.path.basename(dbr).split("_")
-        table_type = get_affix_table_type(file_name[0])
-
-        # For each affix in this table, create an entry:
-        for field, affix_dbr in table.items():
-            if not field.startswith("randomizerName") or not affix_dbr.exists():
-                continue
-
-            # Add this file as discovered, this will determine what affixes are actually parsed
-            affix_files.add(affix_dbr)
-
-            if affix_dbr not in affix_tables:
-                affix_tables[affix_dbr] = {table_type}
-            elif table_type not in affix_tables[affix_dbr]:
+    # Tables are read in parallel, and their equipment types merged per affix:
+    affix_tables: dict[Path, set] = defaultdict(set)
+    with ThreadPoolExecutor() as executor:
+        # Each table is read in (a copy of) the context of the current session:
+        tables = [executor.submit(contextvars.copy_context().run, read_affix_table, dbr) for dbr in files]
+        for table in tables:
+            table_type, table_affixes = table.result()
+            for affix_dbr in table_affixes:
                 affix_tables[affix_dbr].add(table_type)
 
+    # The discovered files determine what affixes are actually parsed:
+    affix_files = sorted(affix_tables)
+
     logging.info(f"Found {len(affix_files)} affix files.")
 
     affixes = {"prefixes": {}, "suffixes": {}}
-    for dbr in affix_files:
+
+    # Fingerprints of the properties that are already stored, per affix type and tag:
+    fingerprints = defaultdict(set)
+
+    # The affixes are parsed by the workers of the session, but merged in order:
+    for dbr in Scheduler().run(affix_files):
         affix = parse(dbr)
+        if isinstance(affix, Skipped):
+            continue
 
         # Tinkerer needs a little custom love because it has no properties, but a special text:
         if affix["tag"] == "x3tagSuffix01":
-            affix["properties"] = {"description": texts.get("x3tagextrarelic")}
-
-        # Assign the table types to this affix:
-        if dbr not in affix_tables:
-            # Affix can occur on all equipment:
-            affix["equipment"] = {"none"}
+            properties = {"description": texts.get("x3tagextrarelic")}
         else:
-            affix["equipment"] = affix_tables[dbr]
+            properties = affix["properties"]
 
         # Add affixes to their respective pre- or suffix list.
         if "Prefix" in affix["tag"] and "suffix" not in dbr.parts:
@@ -86,32 +86,32 @@ def parse_affixes():
         else:
             affixType = "suffixes"
 
-        affixTag = affix.pop("tag")
+        affixTag = affix["tag"]
+
+        # Skip duplicate affix properties:
+        key = fingerprint(properties)
+        if key in fingerprints[affixType, affixTag]:
+            continue
+        fingerprints[affixType, affixTag].add(key)
 
         # Either add the affix or add its properties as an alternative
-        if affixTag in affixes[affixType]:
+        if affixTag not in affixes[affixType]:
+            # Copy the parsed affix, since the cached result shouldn't be altered:
+            affix_result = {k: v for k, v in affix.items() if k != "tag"}
+            affix_result.update({"equipment": set(), "properties": []})
+            affixes[affixType][affixTag] = affix_result
+        else:
             affix_result = affixes[affixType][affixTag]
-            # Skip duplicate affix properties:
-            if is_duplicate_affix(affix_result, affix):
-                continue
 
-            # Create a list if it wasn't already one
-            if not isinstance(affix_result["properties"], list):
-                affix_result["properties"] = [affix_result["properties"], affix["properties"]]
-            else:
-                affix_result["properties"].append(affix["properties"])
-            affix_result["equipment"].update(affix["equipment"])
-        else:
-            # Make sure to copy here since we alter some properties after looping
-            affixes[affixType][affixTag] = affix.copy()
+        affix_result["properties"].append(properties)
+
+        # Assign the table types to this affix, or all equipment if it isn't in any table:
+        affix_result["equipment"].update(affix_tables.get(dbr, {"none"}))
 
-    # Parse the equipment & properties one last time to standardize the formats
+    # Standardize the equipment format:
     for _, v in affixes.items():
         for _, affix in v.items():
-            affix["equipment"] = ",".join(list(affix["equipment"]))
-            affix["properties"] = (
-                affix["properties"] if isinstance(affix["properties"], list) else [affix["properties"]]
-            )
+            affix["equipment"] = ",".join(sorted(affix["equipment"]))
 
     # Log and reset the timer:
     logging.info(f"Parsed affixes in {time.time() - start_time:.2f} seconds.")
@@ -119,7 +119,30 @@ def parse_affixes():
     return affixes
 
 
-def parse_equipment():
+def read_affix_table(dbr):
+    """
+    Read an affix table and find the affixes in it.
+
+    :return: the equipment type the table is for, and the affix files it lists.
+
+    """
+    table = read(dbr)
+
+    # Use the filename to determine what equipment this table is for:
+    file_name = os.path.basename(dbr).split("_")
+    table_type = get_affix_table_type(file_name[0])
+
+    # Each randomizerName field in this table refers to an affix:
+    table_affixes = [
+        affix_dbr
+        for field, affix_dbr in table.items()
+        if field.startswith("randomizerName") and database.exists(affix_dbr)
+    ]
+
+    return table_type, table_affixes
+
+
+def parse_equipment(bitmaps=None):
     """
     Parse all wearable Titan Quest equipment.
 
@@ -127,6 +150,9 @@ def parse_equipment():
     categories are defined by the Class property of each piece of equipment
     which is mapped to the 'category' key in the parsed result.
 
+    :param bitmaps: the `images.BitmapConverter` to queue the item bitmaps in,
+        which can be shared by sessions. By default the bitmaps are converted
+        to the graphics directory before returning.
     :return: dictionary keyed by equipment category string, value is a list of
         dicts, one for each item in that category. Common items are omitted.
 
@@ -135,7 +161,7 @@ def parse_equipment():
 
     files = []
     for resource in resources.EQUIPMENT:
-        for equipment_filename in paths.DB.glob(resource):
+        for equipment_filename in database.glob(resource):
             if not (
                 # Exclude all files in 'old' and 'default'
                 "old" in equipment_filename.parts
@@ -143,51 +169,65 @@ def parse_equipment():
             ):
                 files.append(equipment_filename)
 
-    logging.info(f"Found {len(files)} equipment files to process.")
+    logging.info(f"Found {len(files)} equipment files.")
+
+    # Parse the items and all records they reference, from the bottom up.
+    # Common items are skipped before they're parsed:
+    files = Scheduler().run(files, select=lambda dbr: ItemBaseParser.accepts(peek(dbr, ItemBaseParser.HEADER)))
 
     # TODO: add multithreading!
 
     items = defaultdict(list)
-    for dbr in files:
-        try:
-            parsed = parse(dbr)
-        except InvalidItemError as e:
-            exception_messages = exception_messages_with_causes(e)
 
-            logging.debug(f"Ignoring item in {dbr}. {exception_messages}")
-            continue
-        except Exception as e:
-            logging.info(f"Error in {dbr}")
-            logging.exception(e)
-            continue
+    # Bitmaps are converted in the background, and finished before returning
+    # unless the converter is shared:
+    converter = images.BitmapConverter(paths.GRAPHICS) if bitmaps is None else contextlib.nullcontext(bitmaps)
+    with converter as bitmaps:
+        for dbr in files:
+            try:
+                parsed = parse(dbr)
+            except Exception as e:
+                logging.info(f"Error in {dbr}")
+                logging.exception(e)
+                continue
 
-        try:
-            # Skip items without a category
-            if "category" not in parsed:
+            if isinstance(parsed, Skipped):
                 continue
 
-            # Organize the equipment based on its category
-            category = parsed.pop("category")
+            # Copy the cached result, since the item is altered below:
+            parsed = parsed.copy()
 
-            # Skip items without rarities
-            if "classification" not in parsed:
-                continue
+            try:
+                # Skip items without a category
+                if "category" not in parsed:
+                    continue
 
-            # Save the bitmap and remove the bitmap key
-            images.save_bitmap(parsed, category, paths.GRAPHICS)
-        except KeyError as e:
-            # Skip equipment that couldn't be parsed:
-            logging.warning(f"DBR {dbr} parse result unacceptable. Parse result: {parsed}. Error: {e}")
-            # raise e
-            continue
+                # Organize the equipment based on its category
+                category = parsed.pop("category")
 
-        # Pop off the properties key off any item without properties:
-        if "properties" in parsed and not parsed["properties"]:
-            parsed.pop("properties")
+                # Skip items without rarities
+                if "classification" not in parsed:
+                    continue
 
-        # Now save the parsed item in the category:
-        if category:
-            items[category].append(parsed)
+                # Queue the bitmap to be saved and remove the bitmap key. Items the
+                # session shares with the session it's forked from have the same icon:
+                if storage.db.inherits(dbr):
+                    parsed.pop("bitmap", None)
+                else:
+                    bitmaps.submit(parsed, category)
+            except KeyError as e:
+                # Skip equipment that couldn't be parsed:
+                logging.warning(f"DBR {dbr} parse result unacceptable. Parse result: {parsed}. Error: {e}")
+                # raise e
+                continue
+
+            # Pop off the properties key off any item without properties:
+            if "properties" in parsed and not parsed["properties"]:
+                parsed.pop("properties")
+
+            # Now save the parsed item in the category:
+            if category:
+                items[category].append(parsed)
 
     # Log the timer:
     logging.info(f"Parsed equipment in {time.time() - start_time:.2f} seconds.")
@@ -195,14 +235,6 @@ def parse_equipment():
     return items
 
 
-def exception_messages_with_causes(e):
-    exception_messages = [str(e)]
-    while e.__cause__:
-        e = e.__cause__
-        exception_messages.append(str(e))
-    return exception_messages
-
-
 def parse_creatures():
     """
     Parse all creatures (bosses and heroes) in Titan Quest.
@@ -218,33 +250,27 @@ def parse_creatures():
 
     files = []
     for resource in resources.CREATURES:
-        boss_files = paths.DB / resource
-        files.extend(glob.glob(str(boss_files), recursive=True))
+        files.extend(database.glob(resource))
 
     logging.info(f"Found {len(files)} creature files.")
 
+    # Parse the creatures and all records they reference, from the bottom up.
+    # Don't include common monsters, skip them before they're parsed:
+    files = Scheduler().run(files, select=lambda dbr: MonsterParser.accepts(peek(dbr, MonsterParser.HEADER)))
+
     creatures = {}
     for dbr in files:
-        try:
-            logging.debug(f"Attempting to parse creature in {dbr}.")
-            parsed = parse(dbr)
-        except InvalidItemError as e:
-            logging.debug(f"Ignoring creature in {dbr}. {e}")
+        logging.debug("Attempting to parse creature in %s.", dbr)
+        parsed = parse(dbr)
+        if isinstance(parsed, Skipped):
             continue
 
         try:
-            # Don't include common monsters
-            # XXX - Should 'Champion' be added?
-            # Should this be moved to MonsterParser to save work? The equipment
-            # parser does that.
-            if parsed["classification"] not in ["Quest", "Hero", "Boss"]:
-                continue
-
             # Store the monster by its tag:
             creatures[parsed["tag"]] = parsed
         except KeyError:
             # Skip creatures without tags
-            logging.debug(f"Ignoring creature in {dbr}. No classification " "present.")
+            diagnostics.skip("creature-tag", dbr)
             continue
 
     # Log the timer:
@@ -328,11 +354,9 @@ def parse_quests():
                 continue
 
             # Prepend the path with the database path:
-            try:
-                rewards = parse(paths.DB / reward_file)
-            except InvalidItemError as e:
-                messages = exception_messages_with_causes(e)
-                logging.debug(f"Skipping quest reward {reward_file} of {qst}. {messages}")
+            rewards = parse(paths.DB / reward_file)
+            if isinstance(rewards, Skipped):
+                diagnostics.skip("quest-reward", qst, reward_file, rewards.code)
                 continue
 
             # Skip quests where the rewards aren't items:
@@ -363,6 +387,49 @@ def parse_quests():
     return quests
 
 
+def parse_loot(creatures, quests):
+    """
+    Index the sources of every item that can drop or be rewarded.
+
+    This is the reverse of the creature loot and chest tables and the quest
+    rewards: for each item it lists where the item comes from. The sources
+    are grouped by their kind, since the chances of each kind are stored in
+    their own format (see `parse_creatures` and `parse_quests`).
+
+    :param creatures: the result of `parse_creatures`
+    :param quests: the result of `parse_quests`
+    :return: dictionary keyed by item tag, value is a dict keyed by source kind
+        ('creature', 'chest' or 'quest') with a list of
+        [source tag, difficulty index, chance] entries.
+
+    """
+    start_time = time.time()
+
+    loot = defaultdict(lambda: defaultdict(list))
+
+    def index(kind, source, tiers):
+        # Each tier in a loot list is a difficulty:
+        for difficulty, items in enumerate(tiers):
+            for item, chance in items.items():
+                loot[item][kind].append([source, difficulty, chance])
+
+    # A single pass over all creature loot and chests, then quest rewards:
+    for tag, creature in creatures.items():
+        index("creature", tag, creature.get("loot", []))
+        index("chest", tag, creature.get("chest", []))
+
+    for tag, quest in quests.items():
+        index("quest", tag, quest["rewards"])
+
+    # Sort the sources so output is consistent (useful for diffs)
+    result = {item: {kind: sorted(entries) for kind, entries in sources.items()} for item, sources in loot.items()}
+
+    # Log the timer:
+    logging.info(f"Indexed loot sources for {len(result)} items in {time.time() - start_time:.2f} seconds.")
+
+    return result
+
+
 def parse_sets():
     """
     Parse the Titan Quest equipment sets.
@@ -375,16 +442,15 @@ def parse_sets():
 
     files = []
     for resource in resources.SETS:
-        set_files = paths.DB / resource
-        files.extend(glob.glob(str(set_files), recursive=True))
+        files.extend(database.glob(resource))
+
+    # Parse the sets and all records they reference, from the bottom up:
+    files = Scheduler().run(files)
 
     sets = {}
     for dbr in files:
-        try:
-            parsed = parse(dbr)
-        except InvalidItemError as e:
-            exception_messages = exception_messages_with_causes(e)
-            logging.debug(f"Ignoring item in {dbr}. {exception_messages}")
+        parsed = parse(dbr)
+        if isinstance(parsed, Skipped):
             continue
 
         try:
@@ -410,10 +476,7 @@ def parse_skills():
     but is no longer required for output.
 
     """
-    skills = storage.skills.copy()
-    for skill in skills.values():
-        # Pop the 'path' property, it was used during parsing to ensure correct
-        # skill tag references for requipment.
-        skill.pop("path")
-
-    return skills
+    # Leave out the 'path' property, it was used during parsing to ensure correct
+    # skill tag references for requipment. The stored skills aren't altered,
+    # since they can be shared with another session.
+    return {tag: {k: v for k, v in skill.items() if k != "path"} for tag, skill in storage.skills.items()}
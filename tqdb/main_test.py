@@ -0,0 +1,63 @@
+"""
+Functional tests for the main parse functions.
+
+"""
+from tqdb import main
+
+
+def test_loot_sources_are_grouped_by_kind():
+    """
+    Test that each item lists its sources per kind, sorted by source, difficulty and chance.
+
+    """
+    creatures = {
+        "tagBoss": {
+            "loot": [{"ring01": 0.5}, {"ring01": 0.25, "amulet01": 1.0}, {}],
+            "chest": [{"ring01": 0.1}],
+        },
+        "tagAnt": {"loot": [{}, {}, {"ring01": 0.75}]},
+        # Creatures without loot tables don't add anything:
+        "tagCat": {},
+    }
+    quests = {
+        "tagQuest": {"name": "Quest", "rewards": [{"amulet01": 0.5}, {}, {"amulet01": 0.5}]},
+    }
+
+    loot = main.parse_loot(creatures, quests)
+
+    assert loot == {
+        "ring01": {
+            "creature": [["tagAnt", 2, 0.75], ["tagBoss", 0, 0.5], ["tagBoss", 1, 0.25]],
+            "chest": [["tagBoss", 0, 0.1]],
+        },
+        "amulet01": {
+            "creature": [["tagBoss", 1, 1.0]],
+            "quest": [["tagQuest", 0, 0.5], ["tagQuest", 2, 0.5]],
+        },
+    }
+
+
+def test_loot_chances_are_kept_per_kind():
+    """
+    Test that the chances of a source aren't merged across kinds or difficulties.
+
+    """
+    creatures = {"tagBoss": {"loot": [{"ring01": 0.5}, {"ring01": 0.5}], "chest": [{"ring01": 0.5}]}}
+    quests = {"tagBoss": {"name": "Boss", "rewards": [{"ring01": 1.0}, {}, {}]}}
+
+    loot = main.parse_loot(creatures, quests)
+
+    # The chances of each kind have their own format, so they're never summed:
+    assert loot["ring01"] == {
+        "creature": [["tagBoss", 0, 0.5], ["tagBoss", 1, 0.5]],
+        "chest": [["tagBoss", 0, 0.5]],
+        "quest": [["tagBoss", 0, 1.0]],
+    }
+
+
+def test_loot_without_sources():
+    """
+    Test that items that don't drop aren't indexed.
+
+    """
+    assert main.parse_loot({"tagCat": {"loot": [{}, {}, {}]}}, {}) == {}
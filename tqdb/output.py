@@ -0,0 +1,624 @@
+"""
+Writers for the parsed data.
+
+The data of a locale is written one category at a time, as soon as it's
+parsed, instead of building the data of the whole locale in memory first.
+Locales can be parsed at the same time, so all writers are thread safe.
+
+"""
+import abc
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+from tqdb import __version__ as tqdb_version
+from tqdb.constants import paths
+
+
+def file_name(prefix, locale, extension):
+    """
+    Return the name of an output file for a locale.
+
+    A locale can have a variant, like 'en.mod' for English with the overlays
+    of a mod, which is added after the version.
+
+    """
+    language, _, variant = locale.partition(".")
+    suffix = f".{variant}" if variant else ""
+
+    return f"{prefix}.{language}.{tqdb_version}{suffix}.{extension}"
+
+
+class Writer(metaclass=abc.ABCMeta):
+    """
+    Abstract writer class.
+
+    The data of a locale is passed to `write` per category, after which
+    `end_locale` is called. Once all locales are written, `close` is called.
+
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory or paths.OUTPUT)
+        self.lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    @abc.abstractmethod
+    def write(self, locale, category, data):
+        """
+        Write the data of a category for a locale.
+
+        """
+        raise NotImplementedError
+
+    def write_texts(self, locale, texts):
+        """
+        Write the texts of a locale, so they can be reviewed.
+
+        """
+        with open(self.directory / f"texts.{locale}.json", "w", encoding="utf8") as texts_file:
+            json.dump(texts, texts_file, ensure_ascii=False, sort_keys=True)
+
+    def end_locale(self, locale):
+        """
+        Finish writing a locale, all its categories have been written.
+
+        """
+        pass
+
+    def close(self):
+        """
+        Finish writing, all locales have been written.
+
+        """
+        pass
+
+
+class JSONWriter(Writer):
+    """
+    Writes one JSON file per locale, with all categories in it.
+
+    The file is opened when the first category is written, and each category
+    is streamed into it directly.
+
+    """
+
+    def __init__(self, directory=None):
+        super().__init__(directory)
+
+        # The open file of each locale that's being written:
+        self.files = {}
+
+    def write(self, locale, category, data):
+        with self.lock:
+            output = self.files.get(locale)
+            if output is None:
+                output = open(self.directory / file_name("tqdb", locale, "json"), "w", encoding="utf8")
+                self.files[locale] = output
+                output.write("{")
+            else:
+                output.write(",")
+
+        # Only the thread parsing a locale writes its file:
+        output.write(f"{json.dumps(category)}:")
+        json.dump(data, output, ensure_ascii=False, sort_keys=True)
+
+    def end_locale(self, locale):
+        with self.lock:
+            output = self.files.pop(locale, None)
+
+        if output is not None:
+            output.write("}")
+            output.close()
+
+    def close(self):
+        for locale in list(self.files):
+            self.end_locale(locale)
+
+
+class JSONLinesWriter(Writer):
+    """
+    Writes one JSON Lines file per locale, with a line for each record.
+
+    Each line is an object with the category, key and data of the record.
+    Categories that have a list of records per key (like the equipment per
+    equipment category) have a line for each record in the list.
+
+    """
+
+    def __init__(self, directory=None):
+        super().__init__(directory)
+        self.files = {}
+
+    def write(self, locale, category, data):
+        with self.lock:
+            output = self.files.get(locale)
+            if output is None:
+                output = open(self.directory / file_name("tqdb", locale, "jsonl"), "w", encoding="utf8")
+                self.files[locale] = output
+
+        for key, value in sorted(data.items()):
+            for record in value if isinstance(value, list) else [value]:
+                line = {"category": category, "key": key, "data": record}
+                output.write(json.dumps(line, ensure_ascii=False, sort_keys=True))
+                output.write("\n")
+
+    def end_locale(self, locale):
+        with self.lock:
+            output = self.files.pop(locale, None)
+
+        if output is not None:
+            output.close()
+
+    def close(self):
+        for locale in list(self.files):
+            self.end_locale(locale)
+
+
+class ShardedWriter(Writer):
+    """
+    Writes a JSON file per category and locale, with a manifest of all files.
+
+    The shards are written to a directory for the version, with a directory
+    per locale, so a client can fetch only the categories it needs:
+
+        tqdb.<version>/manifest.json
+        tqdb.<version>/en/equipment.json
+        tqdb.<version>/en/texts.json
+
+    """
+
+    def __init__(self, directory=None):
+        super().__init__(directory)
+        self.root = self.directory / f"tqdb.{tqdb_version}"
+
+        # The written shards, by locale and category:
+        self.shards = {}
+
+    def write(self, locale, category, data):
+        shard = Path(locale) / f"{category}.json"
+        os.makedirs(self.root / locale, exist_ok=True)
+
+        with open(self.root / shard, "w", encoding="utf8") as shard_file:
+            json.dump(data, shard_file, ensure_ascii=False, sort_keys=True)
+
+        with self.lock:
+            self.shards.setdefault(locale, {})[category] = {
+                "file": shard.as_posix(),
+                "size": os.path.getsize(self.root / shard),
+            }
+
+    def write_texts(self, locale, texts):
+        self.write(locale, "texts", texts)
+
+    def end_locale(self, locale):
+        # Keep the manifest up to date, in case a later locale fails:
+        self.write_manifest()
+
+    def close(self):
+        self.write_manifest()
+
+    def write_manifest(self):
+        """
+        Write the manifest of all shards that were written.
+
+        """
+        with self.lock:
+            manifest = {"version": tqdb_version, "locales": self.shards}
+
+            with open(self.root / "manifest.json", "w", encoding="utf8") as manifest_file:
+                json.dump(manifest, manifest_file, sort_keys=True)
+
+        logging.info(f"Wrote manifest of {sum(len(s) for s in self.shards.values())} shards to {self.root}.")
+
+
+class SQLiteWriter(Writer):
+    """
+    Writes one SQLite database per locale, to query the data with indexes.
+
+    Every category has a table with a row per record, with the record itself
+    as JSON and the properties that are queried often as indexed columns. The
+    loot is stored as a table of edges between items and their sources, and
+    the names of all records are indexed for full-text search.
+
+    """
+
+    # The columns of each table besides its tag, mapped to the property of a
+    # record they hold. The name comes first, it's also indexed for searching:
+    TABLES = {
+        "affixes": {"name": "name", "type": "type", "equipment": "equipment"},
+        "creatures": {"name": "name", "classification": "classification", "level": "level"},
+        "equipment": {"name": "name", "category": "category", "classification": "classification", "level": "itemLevel"},
+        "quests": {"name": "name"},
+        "sets": {"name": "name"},
+        "skills": {"name": "name"},
+    }
+
+    # The columns that are indexed, besides the tag of each table:
+    INDEXES = ["category", "classification", "level"]
+
+    def __init__(self, directory=None):
+        super().__init__(directory)
+
+        # The open connection of each locale that's being written:
+        self.connections = {}
+
+    def connect(self, locale):
+        """
+        Return the connection to the database of a locale, creating it if needed.
+
+        """
+        with self.lock:
+            connection = self.connections.get(locale)
+            if connection is not None:
+                return connection
+
+            output_name = self.directory / file_name("tqdb", locale, "sqlite")
+            if os.path.exists(output_name):
+                os.remove(output_name)
+
+            # Only the thread parsing a locale uses its connection:
+            connection = sqlite3.connect(output_name, check_same_thread=False)
+            self.connections[locale] = connection
+
+        # The database is written once, so durability isn't needed until it's closed:
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        self.create_schema(connection)
+
+        return connection
+
+    def create_schema(self, connection):
+        """
+        Create the tables and indexes of a database.
+
+        """
+        for table, columns in self.TABLES.items():
+            connection.execute(f"CREATE TABLE {table} (tag TEXT, {', '.join(columns)}, data TEXT)")
+            connection.execute(f"CREATE INDEX {table}_tag ON {table} (tag)")
+            for column in self.INDEXES:
+                if column in columns:
+                    connection.execute(f"CREATE INDEX {table}_{column} ON {table} ({column})")
+
+        connection.execute("CREATE TABLE loot (item TEXT, kind TEXT, source TEXT, difficulty INTEGER, chance REAL)")
+        connection.execute("CREATE INDEX loot_item ON loot (item)")
+        connection.execute("CREATE INDEX loot_source ON loot (source)")
+
+        connection.execute("CREATE TABLE strings (tag TEXT PRIMARY KEY, text TEXT)")
+
+        # The names of all records, for searching. Without FTS5 a regular
+        # table with an index still allows prefix searches with LIKE:
+        try:
+            connection.execute("CREATE VIRTUAL TABLE names USING fts5(name, category UNINDEXED, tag UNINDEXED)")
+        except sqlite3.OperationalError:
+            logging.warning("SQLite is compiled without FTS5, names are indexed without full-text search.")
+            connection.execute("CREATE TABLE names (name TEXT, category TEXT, tag TEXT)")
+            connection.execute("CREATE INDEX names_name ON names (name)")
+
+    @staticmethod
+    def records(category, data):
+        """
+        Iterate over the records of a category, each with its tag set.
+
+        """
+        for key, value in data.items():
+            if category == "equipment":
+                # Equipment is grouped by its category:
+                for item in value:
+                    yield {**item, "category": key}
+            elif category == "affixes":
+                # Affixes are grouped by their type, prefixes or suffixes:
+                for tag, affix in value.items():
+                    yield {**affix, "tag": tag, "type": key}
+            else:
+                yield {**value, "tag": key}
+
+    def write(self, locale, category, data):
+        connection = self.connect(locale)
+
+        if category == "loot":
+            connection.executemany(
+                "INSERT INTO loot VALUES (?, ?, ?, ?, ?)",
+                (
+                    (item, kind, source, difficulty, chance)
+                    for item, sources in data.items()
+                    for kind, entries in sources.items()
+                    for source, difficulty, chance in entries
+                ),
+            )
+            return
+
+        columns = self.TABLES[category]
+
+        def column(record, key):
+            value = record.get(key)
+            # Lists (like a level per difficulty) are indexed by their first value:
+            return value[0] if isinstance(value, list) and value else value
+
+        rows = [
+            (
+                record.get("tag"),
+                *(column(record, key) for key in columns.values()),
+                json.dumps(record, ensure_ascii=False, sort_keys=True),
+            )
+            for record in self.records(category, data)
+        ]
+
+        placeholders = ", ".join("?" * (len(columns) + 2))
+        connection.executemany(f"INSERT INTO {category} VALUES ({placeholders})", rows)
+        connection.executemany(
+            "INSERT INTO names VALUES (?, ?, ?)",
+            ((row[1], category, row[0]) for row in rows if row[1]),
+        )
+
+    def write_texts(self, locale, texts):
+        connection = self.connect(locale)
+        connection.executemany("INSERT INTO strings VALUES (?, ?)", texts.items())
+
+    def end_locale(self, locale):
+        with self.lock:
+            connection = self.connections.pop(locale, None)
+
+        if connection is not None:
+            connection.commit()
+            connection.execute("ANALYZE")
+            connection.close()
+
+    def close(self):
+        for locale in list(self.connections):
+            self.end_locale(locale)
+
+
+class StructureWriter(Writer):
+    """
+    Writes the data of all locales as one structure, with strings per locale.
+
+    The locales only differ in their display strings, so the structure of the
+    reference locale is written once, with every string that differs between
+    the locales replaced by a reference: {"$t": <id>}. The strings themselves
+    are written per locale, as a list indexed by their id:
+
+        tqdb.structure.<version>.json
+        strings.en.<version>.json
+        strings.de.<version>.json
+
+    Entries of a locale that don't match the structure, for example because a
+    record is skipped in one locale only, are written as overrides:
+
+        overrides.de.<version>.json
+
+    The reference of a category is the first locale that writes it, which
+    should be the `REFERENCE` locale. Each other locale is compared to it as
+    soon as it's written, so only the reference data and the differences are
+    kept until the files are written on close.
+
+    """
+
+    # The locale whose data should be the structure, so it's written first:
+    REFERENCE = "en"
+
+    # The keys that identify the entries of a list, instead of their index:
+    IDENTITY = ("tag", "path")
+
+    # The value of an entry that a locale doesn't have:
+    MISSING = object()
+
+    def __init__(self, directory=None):
+        super().__init__(directory)
+
+        # The reference data, by variant (see `file_name`) and category:
+        self.structures = defaultdict(dict)
+
+        # The strings that differ from the reference, by variant, path and locale:
+        self.localized = defaultdict(dict)
+
+        # The (path, value) of the entries that don't match the reference, by variant and locale:
+        self.overrides = defaultdict(lambda: defaultdict(list))
+
+        # All locales that were written, by variant:
+        self.locales = defaultdict(set)
+
+    def write(self, locale, category, data):
+        language, _, variant = locale.partition(".")
+
+        # Compare the data as it's written. It's copied, since the strings of
+        # the structure are replaced by references:
+        data = json.loads(json.dumps(data))
+
+        with self.lock:
+            self.locales[variant].add(language)
+            reference = self.structures[variant].setdefault(category, data)
+
+        if reference is not data:
+            self.compare(variant, reference, language, category, data)
+
+    def compare(self, variant, reference, language, category, data):
+        """
+        Store the strings and entries of a locale that differ from the reference.
+
+        """
+        localized = []
+        overrides = []
+        for is_string, path, value in self.differences(reference, data, (category,)):
+            (localized if is_string else overrides).append((path, value))
+
+        if overrides:
+            logging.warning(f"{len(overrides)} {category} entries of {language} don't match the structure.")
+
+        with self.lock:
+            for path, text in localized:
+                self.localized[variant].setdefault(path, {})[language] = text
+            self.overrides[variant][language].extend(overrides)
+
+    @classmethod
+    def differences(cls, reference, data, path):
+        """
+        Iterate over the values in the data that differ from the reference.
+
+        The data is walked along with the reference, so only values at the same
+        path are compared. The entries of lists are matched by their identity
+        (see `IDENTITY`) if they have one, or by their index otherwise.
+
+        Strings that differ are localized. Any other difference overrides the
+        entry it's in: the value of a key, an entry of a list, or a whole list
+        if its entries can't be matched. Entries that aren't in the reference
+        are added by their identity, entries the data lacks are MISSING.
+
+        :return: generator of (is_string, path, value) tuples.
+
+        """
+        if isinstance(reference, dict) and isinstance(data, dict):
+            for key, value in reference.items():
+                if key in data:
+                    yield from cls.differences(value, data[key], path + (key,))
+                else:
+                    yield False, path + (key,), cls.MISSING
+
+            for key in sorted(data.keys() - reference.keys()):
+                yield False, path + (key,), data[key]
+        elif isinstance(reference, list) and isinstance(data, list):
+            identities = cls.identities(reference)
+            entries = cls.identities(data)
+            if identities is not None and entries is not None:
+                # Look the entries of the data up by their identity:
+                entries = dict(zip(entries, data))
+                for index, (identity, value) in enumerate(zip(identities, reference)):
+                    if identity in entries:
+                        yield from cls.differences(value, entries.pop(identity), path + (index,))
+                    else:
+                        yield False, path + (index,), cls.MISSING
+
+                for identity, value in entries.items():
+                    identity = {key: part for key, part in zip(cls.IDENTITY, identity) if part is not None}
+                    yield False, path + (identity,), value
+            elif len(reference) == len(data):
+                for index, (value, other) in enumerate(zip(reference, data)):
+                    yield from cls.differences(value, other, path + (index,))
+            else:
+                yield False, path, data
+        elif isinstance(reference, str) and isinstance(data, str):
+            if reference != data:
+                yield True, path, data
+        elif type(reference) is not type(data) or reference != data:
+            yield False, path, data
+
+    @classmethod
+    def identities(cls, entries):
+        """
+        Identify the entries of a list by their identity keys.
+
+        :return: list of identities, or None if not every entry has a unique one.
+
+        """
+        identities = [
+            tuple(entry.get(key) for key in cls.IDENTITY)
+            if isinstance(entry, dict) and any(key in entry for key in cls.IDENTITY)
+            else None
+            for entry in entries
+        ]
+
+        if None in identities or len(set(identities)) < len(identities):
+            return None
+
+        return identities
+
+    def close(self):
+        for variant, structure in self.structures.items():
+            self.write_structure(variant, structure)
+
+        # The overrides are applied to the structure, in order. A path is a list
+        # of the keys and indexes in the structure, or ends with the identity of
+        # an entry that's added to a list. Without a value, the entry is removed:
+        for variant, overrides in self.overrides.items():
+            suffix = f".{variant}" if variant else ""
+            for language, entries in overrides.items():
+                output_name = self.directory / file_name("overrides", f"{language}{suffix}", "json")
+                with open(output_name, "w", encoding="utf8") as output:
+                    json.dump(
+                        [
+                            {"path": list(path)} if value is self.MISSING else {"path": list(path), "value": value}
+                            for path, value in entries
+                        ],
+                        output,
+                        ensure_ascii=False,
+                        sort_keys=True,
+                    )
+
+    def write_structure(self, variant, structure):
+        """
+        Replace the localized strings by references, and write all files.
+
+        """
+        languages = sorted(self.locales[variant])
+        suffix = f".{variant}" if variant else ""
+
+        # Strings with the same text in every locale share their id:
+        ids = {}
+        for path, texts in self.localized[variant].items():
+            node = structure
+            for key in path[:-1]:
+                node = node[key]
+
+            # Locales without a different string use the reference string:
+            strings = tuple(texts.get(language, node[path[-1]]) for language in languages)
+            node[path[-1]] = {"$t": ids.setdefault(strings, len(ids))}
+
+        output_name = self.directory / file_name("tqdb", f"structure{suffix}", "json")
+        with open(output_name, "w", encoding="utf8") as output:
+            json.dump(structure, output, ensure_ascii=False, sort_keys=True)
+
+        for index, language in enumerate(languages):
+            output_name = self.directory / file_name("strings", f"{language}{suffix}", "json")
+            with open(output_name, "w", encoding="utf8") as output:
+                json.dump([strings[index] for strings in ids], output, ensure_ascii=False)
+
+        logging.info(f"Wrote structure with {len(ids)} strings for {len(languages)} locales.")
+
+
+class Writers(Writer):
+    """
+    Passes all data to multiple writers, to write multiple formats at once.
+
+    """
+
+    def __init__(self, writers):
+        self.writers = writers
+
+    def write(self, locale, category, data):
+        for writer in self.writers:
+            writer.write(locale, category, data)
+
+    def write_texts(self, locale, texts):
+        for writer in self.writers:
+            writer.write_texts(locale, texts)
+
+    def end_locale(self, locale):
+        for writer in self.writers:
+            writer.end_locale(locale)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+# The available output formats:
+FORMATS = {
+    "json": JSONWriter,
+    "jsonl": JSONLinesWriter,
+    "sharded": ShardedWriter,
+    "sqlite": SQLiteWriter,
+    "structure": StructureWriter,
+}
+
+
+def create(formats, directory=None):
+    """
+    Create the writer for one or more output formats.
+
+    """
+    return Writers([FORMATS[output_format](directory) for output_format in formats])
@@ -0,0 +1,171 @@
+"""
+Functional tests for the output writers.
+
+"""
+import json
+import sqlite3
+
+from tqdb import __version__ as tqdb_version
+from tqdb.output import JSONLinesWriter, JSONWriter, ShardedWriter, SQLiteWriter, StructureWriter
+
+DATA = {
+    "equipment": {"ring": [{"tag": "ring01"}, {"tag": "ring02"}]},
+    "sets": {"set01": {"items": ["ring01", "ring02"]}},
+}
+
+
+def write(writer, locale):
+    """
+    Write all test data for a locale.
+
+    """
+    for category, data in DATA.items():
+        writer.write(locale, category, data)
+    writer.end_locale(locale)
+
+
+def test_json_writer_streams_categories(tmp_path):
+    """
+    Test that the categories streamed into a file form the full data.
+
+    """
+    writer = JSONWriter(tmp_path)
+    write(writer, "en")
+    write(writer, "en.mod")
+    writer.close()
+
+    with open(tmp_path / f"tqdb.en.{tqdb_version}.json", encoding="utf8") as data_file:
+        assert json.load(data_file) == DATA
+    assert (tmp_path / f"tqdb.en.{tqdb_version}.mod.json").is_file()
+
+
+def test_json_lines_writer(tmp_path):
+    """
+    Test that each record is written on its own line.
+
+    """
+    writer = JSONLinesWriter(tmp_path)
+    write(writer, "de")
+    writer.close()
+
+    with open(tmp_path / f"tqdb.de.{tqdb_version}.jsonl", encoding="utf8") as data_file:
+        lines = [json.loads(line) for line in data_file]
+
+    assert [(line["category"], line["key"]) for line in lines] == [
+        ("equipment", "ring"),
+        ("equipment", "ring"),
+        ("sets", "set01"),
+    ]
+    assert lines[1]["data"] == {"tag": "ring02"}
+
+
+def test_sharded_writer_manifest(tmp_path):
+    """
+    Test that every shard is listed in the manifest.
+
+    """
+    writer = ShardedWriter(tmp_path)
+    write(writer, "en")
+    writer.write_texts("en", {"tagring01": "Ring"})
+    writer.close()
+
+    root = tmp_path / f"tqdb.{tqdb_version}"
+    with open(root / "manifest.json", encoding="utf8") as manifest_file:
+        manifest = json.load(manifest_file)
+
+    assert sorted(manifest["locales"]["en"]) == ["equipment", "sets", "texts"]
+    with open(root / manifest["locales"]["en"]["sets"]["file"], encoding="utf8") as shard_file:
+        assert json.load(shard_file) == DATA["sets"]
+
+
+def test_sqlite_writer_indexes_names(tmp_path):
+    """
+    Test that records are queryable by their columns and searchable by name.
+
+    """
+    writer = SQLiteWriter(tmp_path)
+    writer.write_texts("en", {"tagring01": "Ring of Fire"})
+    writer.write("en", "equipment", {"ring": [{"tag": "tagring01", "name": "Ring of Fire", "itemLevel": 12}]})
+    writer.write("en", "loot", {"tagring01": {"creature": [["tagboss", 0, 0.5]]}})
+    writer.end_locale("en")
+
+    connection = sqlite3.connect(tmp_path / f"tqdb.en.{tqdb_version}.sqlite")
+    assert connection.execute("SELECT tag, level FROM equipment WHERE category = 'ring'").fetchall() == [
+        ("tagring01", 12)
+    ]
+    assert connection.execute("SELECT source FROM loot WHERE item = 'tagring01'").fetchall() == [("tagboss",)]
+    assert connection.execute("SELECT tag FROM names WHERE names MATCH 'fire'").fetchall() == [("tagring01",)]
+    connection.close()
+
+
+def test_structure_writer_references_localized_strings(tmp_path):
+    """
+    Test that strings which differ per locale are replaced by references.
+
+    """
+    english = {"set01": {"name": "Set", "items": ["ring01"], "classification": "Epic", "level": 10}}
+    german = {"set01": {"name": "Satz", "items": ["ring01"], "classification": "Episch", "level": 10}}
+
+    writer = StructureWriter(tmp_path)
+    # The first locale that writes a category is its reference:
+    writer.write("de", "sets", german)
+    writer.write("en", "sets", english)
+    writer.write("en", "equipment", {"ring": [{"tag": "ring01", "classification": "Epic"}]})
+    writer.write("de", "equipment", {"ring": [{"tag": "ring01", "classification": "Episch"}]})
+    writer.close()
+
+    with open(tmp_path / f"tqdb.structure.{tqdb_version}.json", encoding="utf8") as structure_file:
+        structure = json.load(structure_file)
+    with open(tmp_path / f"strings.de.{tqdb_version}.json", encoding="utf8") as strings_file:
+        strings = json.load(strings_file)
+
+    assert structure["sets"]["set01"]["items"] == ["ring01"]
+    assert structure["sets"]["set01"]["level"] == 10
+    assert strings[structure["sets"]["set01"]["name"]["$t"]] == "Satz"
+
+    # The same translation is stored once:
+    assert structure["equipment"]["ring"][0]["classification"] == structure["sets"]["set01"]["classification"]
+
+
+def test_structure_writer_matches_entries(tmp_path):
+    """
+    Test that list entries are matched by their tag, and that entries which
+    don't match the structure are written as overrides.
+
+    """
+    writer = StructureWriter(tmp_path)
+    writer.write("en", "equipment", {"ring": [{"tag": "r1", "name": "Ring"}, {"tag": "r2", "name": "Band"}]})
+    writer.write("en", "skills", {"tagA": {"name": "Barrage", "level": 1}})
+    # The same entries in a different order, and an extra one:
+    writer.write(
+        "de",
+        "equipment",
+        {"ring": [{"tag": "r2", "name": "Reif"}, {"tag": "r1", "name": "Ring"}, {"tag": "r3", "name": "Neu"}]},
+    )
+    writer.write("de", "skills", {"tagA": {"name": "Sperrfeuer", "level": 2}, "tagB": {"name": "Extra"}})
+    # A locale that skipped a record:
+    writer.write("fr", "equipment", {"ring": [{"tag": "r1", "name": "Anneau"}]})
+    writer.write("fr", "skills", {"tagA": {"name": "Barrage", "level": 1}})
+    writer.close()
+
+    with open(tmp_path / f"tqdb.structure.{tqdb_version}.json", encoding="utf8") as structure_file:
+        structure = json.load(structure_file)
+    with open(tmp_path / f"strings.de.{tqdb_version}.json", encoding="utf8") as strings_file:
+        strings = json.load(strings_file)
+
+    rings = structure["equipment"]["ring"]
+    assert [ring["tag"] for ring in rings] == ["r1", "r2"]
+    assert strings[rings[0]["name"]["$t"]] == "Ring" and strings[rings[1]["name"]["$t"]] == "Reif"
+
+    overrides = {}
+    for locale in ["de", "fr"]:
+        with open(tmp_path / f"overrides.{locale}.{tqdb_version}.json", encoding="utf8") as overrides_file:
+            overrides[locale] = json.load(overrides_file)
+
+    # Only the entries that differ are overridden, not their categories:
+    assert overrides["de"] == [
+        {"path": ["equipment", "ring", {"tag": "r3"}], "value": {"name": "Neu", "tag": "r3"}},
+        {"path": ["skills", "tagA", "level"], "value": 2},
+        {"path": ["skills", "tagB"], "value": {"name": "Extra"}},
+    ]
+    assert overrides["fr"] == [{"path": ["equipment", "ring", 1]}]
@@ -2,11 +2,9 @@
 Base templates that are often included by other templates.
 
 """
-import logging
-
 from tqdb import dbr as DBRParser
 from tqdb import storage
-from tqdb.parsers.main import TQDBParser, InvalidItemError
+from tqdb.parsers.main import TQDBParser, Skipped
 from tqdb.utils.text import texts
 
 # Some shared core constants:
@@ -341,6 +339,9 @@ class ItemSkillAugmentParser(TQDBParser):
 
             # Parse the skill:
             skill = DBRParser.parse(mastery_file)
+            if isinstance(skill, Skipped):
+                return skill
+
             # Store the skill, which will ensure a unique tag:
             skill_tag = storage.store_skill(skill)
             level = dbr[level]
@@ -368,13 +369,8 @@ class ItemSkillAugmentParser(TQDBParser):
             return
 
         level = dbr[self.SKILL_LEVEL]
-        try:
-            skill = DBRParser.parse(dbr[self.SKILL_NAME])
-        except InvalidItemError as e:
-            logging.debug(f"Skipping granted skill record in {dbr[self.SKILL_NAME]}. {e}")
-            return
-
-        if "name" not in skill:
+        skill = DBRParser.parse(dbr[self.SKILL_NAME])
+        if isinstance(skill, Skipped) or "name" not in skill:
             return
 
         # Store the skill, which will ensure a unique tag:
@@ -548,12 +544,13 @@ class ParametersOffensiveParser(TQDBParser):
             field (str): Field name, as listed in the FIELDS list
 
         """
-        # Set the result and prepare the global stores:
-        self.result = result
-        self.offensive = {}
-        self.offensiveXOR = False
-        self.retaliation = {}
-        self.retaliationXOR = False
+        # Prepare the global stores, per call so the parser can be shared:
+        scratch = {
+            "offensive": {},
+            "offensiveXOR": False,
+            "retaliation": {},
+            "retaliationXOR": False,
+        }
 
         for field, field_type in self.FIELDS.items():
             # Find whether the flat, modifier, or both fields are present:
@@ -574,14 +571,14 @@ class ParametersOffensiveParser(TQDBParser):
 
                 if min in iteration:
                     # Parse the flat (+...) version:
-                    self.parse_flat(field, field_type, iteration)
+                    self.parse_flat(field, field_type, iteration, result, scratch)
                 if mod in iteration:
                     # Parse the modifier (+...%) version
-                    self.parse_modifier(field, field_type, iteration)
+                    self.parse_modifier(field, field_type, iteration, result, scratch)
 
         # Now add the global chance tags if they're set:
         offensive_key = "offensiveGlobalChance"
-        if offensive_key in dbr and self.offensive:
+        if offensive_key in dbr and scratch["offensive"]:
             # Skip 0 chance globals altogether
             chances = [chance for chance in dbr[offensive_key] if chance]
 
@@ -591,15 +588,17 @@ class ParametersOffensiveParser(TQDBParser):
                     # The global chance for the offensive properties
                     chance,
                     # If any global offensive properties are XOR-ed:
-                    self.offensiveXOR,
+                    scratch["offensiveXOR"],
                     # The dictionary of global offensive properties
-                    self.offensive,
+                    scratch["offensive"],
                     # Index of this global chance
                     index,
+                    # The result to add the global properties to
+                    result,
                 )
 
         retaliation_key = "retaliationGlobalChance"
-        if retaliation_key in dbr and self.retaliation:
+        if retaliation_key in dbr and scratch["retaliation"]:
             # Skip 0 chance globals altogether
             chances = [chance for chance in dbr[retaliation_key] if chance]
 
@@ -609,14 +608,16 @@ class ParametersOffensiveParser(TQDBParser):
                     # The global chance for the offensive properties
                     chance,
                     # If any global offensive properties are XOR-ed:
-                    self.retaliationXOR,
+                    scratch["retaliationXOR"],
                     # The dictionary of global offensive properties
-                    self.retaliation,
+                    scratch["retaliation"],
                     # Index of this global chance
                     index,
+                    # The result to add the global properties to
+                    result,
                 )
 
-    def parse_global(self, key, chance, xor, all_fields, index):
+    def parse_global(self, key, chance, xor, all_fields, index, result):
         """
         Add a global chance for properties.
 
@@ -647,9 +648,9 @@ class ParametersOffensiveParser(TQDBParser):
             }
 
         # Insert the value normally
-        TQDBParser.insert_value(key, value, self.result)
+        TQDBParser.insert_value(key, value, result)
 
-    def parse_flat(self, field, field_type, dbr):
+    def parse_flat(self, field, field_type, dbr, result, scratch):
         """
         Parse a flat increase in an offensive attribute.
 
@@ -710,27 +711,27 @@ class ParametersOffensiveParser(TQDBParser):
 
         if not is_global:
             # Insert the value normally
-            TQDBParser.insert_value(field, f"{prefix}{value}{suffix}", self.result)
+            TQDBParser.insert_value(field, f"{prefix}{value}{suffix}", result)
         elif field.startswith("offensive"):
             # Add this field to the global offensive list
-            self.offensive[field] = (
+            scratch["offensive"][field] = (
                 [f"{prefix}{value}{suffix}"]
-                if field not in self.offensive
-                else self.offensive[field] + [f"{prefix}{value}{suffix}"]
+                if field not in scratch["offensive"]
+                else scratch["offensive"][field] + [f"{prefix}{value}{suffix}"]
             )
             if is_xor:
-                self.offensiveXOR = True
+                scratch["offensiveXOR"] = True
         elif field.startswith("retaliation"):
             # Add this field to the global retaliation list
-            self.retaliation[field] = (
+            scratch["retaliation"][field] = (
                 [f"{prefix}{value}{suffix}"]
-                if field not in self.retaliation
-                else self.retaliation[field] + [f"{prefix}{value}{suffix}"]
+                if field not in scratch["retaliation"]
+                else scratch["retaliation"][field] + [f"{prefix}{value}{suffix}"]
             )
             if is_xor:
-                self.retaliationXOR = True
+                scratch["retaliationXOR"] = True
 
-    def parse_modifier(self, field, field_type, dbr):
+    def parse_modifier(self, field, field_type, dbr, result, scratch):
         """
         Parse a percentage increase in an offensive attribute.
 
@@ -759,20 +760,20 @@ class ParametersOffensiveParser(TQDBParser):
 
         if not is_global:
             # Insert the value normally
-            TQDBParser.insert_value(field_mod, f"{prefix}{value}{suffix}", self.result)
+            TQDBParser.insert_value(field_mod, f"{prefix}{value}{suffix}", result)
         elif field.startswith("offensive"):
             # Add this field to the global offensive list
-            self.offensive[field_mod] = (
+            scratch["offensive"][field_mod] = (
                 [f"{prefix}{value}{suffix}"]
-                if field_mod not in self.offensive
-                else self.offensive[field_mod] + [f"{prefix}{value}{suffix}"]
+                if field_mod not in scratch["offensive"]
+                else scratch["offensive"][field_mod] + [f"{prefix}{value}{suffix}"]
             )
         elif field.startswith("retaliation"):
             # Add this field to the global retaliation list
-            self.retaliation[field_mod] = (
+            scratch["retaliation"][field_mod] = (
                 [f"{prefix}{value}{suffix}"]
-                if field_mod not in self.retaliation
-                else self.retaliation[field_mod] + [f"{prefix}{value}{suffix}"]
+                if field_mod not in scratch["retaliation"]
+                else scratch["retaliation"][field_mod] + [f"{prefix}{value}{suffix}"]
             )
 
 
@@ -864,6 +865,8 @@ class PetBonusParser(TQDBParser):
         if self.NAME in dbr:
             # Parse the pet bonus and add it:
             pet_bonus = DBRParser.parse(dbr[self.NAME])
+            if isinstance(pet_bonus, Skipped):
+                return pet_bonus
 
             properties = (
                 # If a tiered property set is found, return the first entry
@@ -2,14 +2,14 @@
 Creature and monster template parsers.
 
 """
-import logging
-
 from tqdb import dbr as DBRParser
 from tqdb import storage
 from tqdb.constants.paths import DB
 from tqdb.constants.resources import CHESTS
+from tqdb.database import database
+from tqdb.diagnostics import diagnostics
 from tqdb.parsers import base as parsers
-from tqdb.parsers.main import TQDBParser, InvalidItemError
+from tqdb.parsers.main import TQDBParser, Skipped
 from tqdb.utils.text import texts
 
 
@@ -70,6 +70,13 @@ class MonsterParser(TQDBParser):
     HP = "characterLife"
     MP = "characterMana"
 
+    # Only these monsters are included in TQDB:
+    # XXX - Should 'Champion' be added?
+    CLASSIFICATIONS = ["Quest", "Hero", "Boss"]
+
+    # Properties needed to check if a monster should be parsed at all:
+    HEADER = ["description", "monsterClassification"]
+
     def __init__(self):
         super().__init__()
 
@@ -89,6 +96,16 @@ class MonsterParser(TQDBParser):
         """
         return TQDBParser.LOWEST_PRIORITY
 
+    @classmethod
+    def accepts(cls, header):
+        """
+        Check if a monster with these HEADER properties is included in TQDB.
+
+        Common monsters and monsters without a tag are skipped.
+
+        """
+        return bool(header.get("description")) and header.get("monsterClassification", "Common") in cls.CLASSIFICATIONS
+
     def parse(self, dbr, dbr_file, result):
         """
         Parse the monster.
@@ -138,6 +155,8 @@ class MonsterParser(TQDBParser):
                     DB / CHESTS[tag][index],
                     {"level": level},
                 )
+                if isinstance(loot, Skipped):
+                    return loot
 
                 # Convert all item chances to 4 point precision:
                 chests[index] = dict((k, float("{0:.4f}".format(v))) for k, v in loot["loot_table"].items())
@@ -232,31 +251,30 @@ class MonsterParser(TQDBParser):
             if not equip_chance:
                 continue
 
-            equip_key = f"{equip_key}Item"
+            # Only the possibilities that have a chance are set:
+            weights = self.slots(dbr, f"{equip_key}Item")
+            loot_files = dict(self.slots(dbr, f"loot{equipment}Item"))
 
             # Iterate over all the possibilities and sum up the weights:
-            summed = sum(v for k, v in dbr.items() if k.startswith(equip_key))
-
-            for i in range(1, 7):
-                weight = dbr.get(f"{equip_key}{i}", 0)
-
-                # Skip slots that have 0 chance
-                if not weight:
-                    continue
+            summed = sum(weight for _, weight in weights)
 
+            for i, weight in weights:
                 chance = float("{0:.5f}".format(weight / summed))
 
                 # Grab the loot table holding the equipment list:
-                loot_key = f"loot{equipment}Item{i}"
-                loot_file = dbr.get(loot_key)
-                if not loot_file or not loot_file.is_file():
-                    logging.debug(f"No {loot_key} in {dbr_file}")
+                loot_file = loot_files.get(i)
+                if not loot_file or not database.exists(loot_file):
+                    diagnostics.skip("creature-loot", dbr_file, equipment, i)
                     continue
 
                 try:
                     loot = DBRParser.parse(loot_file, {"level": dbr["charLevel"]})
-                except (KeyError, InvalidItemError) as e:
-                    logging.debug(f"Skipping loot item in {loot_file} because it's invalid. {e}")
+                except KeyError as e:
+                    diagnostics.skip("invalid-reference", dbr_file, loot_file, f"no {e}")
+                    continue
+
+                if isinstance(loot, Skipped):
+                    diagnostics.skip("invalid-reference", dbr_file, loot.path, loot.code)
                     continue
 
                 if "tag" in loot:
@@ -331,20 +349,25 @@ class MonsterSkillManager(TQDBParser):
         # Initialize the abilities (to be indexed per level)
         abilities = []
 
-        # Parse all the normal skills (17 max):
-        for i in range(1, 18):
-            nameTag = f"skillName{i}"
-            levelTag = f"skillLevel{i}"
+        # The skill levels for each of the difficulties. If a level is set to
+        # 0 for a difficulty, it won't be in the extracted result:
+        difficulty_levels = [
+            dict(self.slots(TQDBParser.extract_values(dbr, "skill", difficulty), "skillLevel"))
+            for difficulty in range(3)
+        ]
+        levels = dict(self.slots(dbr, "skillLevel"))
 
+        # Parse all the normal skills (17 max):
+        for i, skill_file in self.slots(dbr, "skillName"):
             # Skip unset skills or skills that are to be ignored:
-            if nameTag not in dbr or levelTag not in dbr or str(dbr[nameTag]).lower() in self.IGNORE_SKILLS:
+            if i not in levels or str(skill_file).lower() in self.IGNORE_SKILLS:
                 continue
 
-            try:
-                skill = DBRParser.parse(dbr[nameTag])
-            except InvalidItemError as e:
-                logging.debug(f"Skipping creature skill {nameTag} in {dbr_file} because it's invalid. {e}")
+            skill = DBRParser.parse(skill_file)
+            if isinstance(skill, Skipped):
+                diagnostics.skip("invalid-reference", dbr_file, skill.path, skill.code)
                 continue
+
             if not skill["properties"]:
                 continue
 
@@ -353,11 +376,7 @@ class MonsterSkillManager(TQDBParser):
 
             # Iterate over the difficulties:
             for difficulty in range(3):
-                itr = TQDBParser.extract_values(dbr, "skill", difficulty)
-
-                # If a level is set to 0 for a difficulty, it won't be in the
-                # extracted result, so use the KeyError safe 'get' method:
-                level = itr.get(levelTag, 0)
+                level = difficulty_levels[difficulty].get(i, 0)
 
                 if not level:
                     continue
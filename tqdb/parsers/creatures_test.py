@@ -0,0 +1,55 @@
+"""
+Functional tests for the creature parsers.
+
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from tqdb.parsers import base, creatures
+from tqdb.parsers.creatures import MonsterParser
+from tqdb.parsers.equipment_test import RecordingHeader
+
+# Monster records, by the file they're in:
+MONSTERS = {
+    "boss.dbr": {"description": "tagBoss", "monsterClassification": "Boss", "charLevel": [30, 45, 60]},
+    "hero.dbr": {"description": "tagHero", "monsterClassification": "Hero"},
+    "quest.dbr": {"description": "tagQuest", "monsterClassification": "Quest"},
+    "champion.dbr": {"description": "tagChampion", "monsterClassification": "Champion"},
+    "common.dbr": {"description": "tagCommon", "monsterClassification": "Common"},
+    "unclassified.dbr": {"description": "tagSatyr"},
+    "tagless.dbr": {"monsterClassification": "Boss"},
+    "empty-tag.dbr": {"description": "", "monsterClassification": "Hero"},
+    "empty.dbr": {},
+}
+
+
+@pytest.fixture
+def parser(monkeypatch):
+    monkeypatch.setattr(creatures, "texts", SimpleNamespace(get=lambda tag: tag))
+    monkeypatch.setattr(base, "ParametersDefensiveParser", lambda: SimpleNamespace(parse=lambda *args: None))
+
+    # Parsers load their templates when they're created, which needs the game data:
+    return MonsterParser.__new__(MonsterParser)
+
+
+@pytest.mark.parametrize("name", MONSTERS)
+def test_monster_prefilter_matches_parser(parser, name):
+    """
+    Test that the prefilter accepts the monsters that were kept after they were fully parsed.
+
+    """
+    dbr = MONSTERS[name]
+    header = RecordingHeader({key: dbr[key] for key in MonsterParser.HEADER if key in dbr})
+
+    # Empty properties are left out of a parsed record:
+    result = {"properties": {}}
+    parser.parse_creature({key: value for key, value in dbr.items() if value}, f"records/creatures/{name}", result)
+
+    # Creatures used to be parsed in full, and kept if they were tagged bosses, heroes or quest monsters:
+    kept = "tag" in result and result["classification"] in ["Quest", "Hero", "Boss"]
+
+    assert MonsterParser.accepts(header) is kept
+
+    # The prefilter only needs the properties that are peeked:
+    assert header.keys_read <= set(MonsterParser.HEADER)
@@ -9,7 +9,8 @@ import numexpr
 
 from tqdb import dbr as DBRParser
 from tqdb.constants.paths import DB
-from tqdb.parsers.main import TQDBParser, InvalidItemError
+from tqdb.diagnostics import diagnostics
+from tqdb.parsers.main import TQDBParser, Skipped
 from tqdb.utils.text import texts
 
 # Shared constant to determine what difficulty an item drops in:
@@ -42,12 +43,17 @@ class ItemArtifactParser(TQDBParser):
     def get_template_path():
         return f"{TQDBParser.base}\\itemartifact.tpl"
 
+    @staticmethod
+    def path_key(dbr_file):
+        # The file name starts with the difficulty the artifact drops in:
+        return os.path.basename(dbr_file).split("_")[0]
+
     def parse(self, dbr, dbr_file, result):
         file_name = os.path.basename(dbr_file).split("_")
 
         # Skip artifacts with unknown difficulties in which they drop:
         if file_name[0] not in DIFFICULTIES:
-            raise InvalidItemError(f"File {file_name} has unknown difficulty.")
+            return Skipped("artifact-difficulty", dbr_file)
 
         # Artifact classification value (always Lesser, Greater or Divine)
         ac_value = dbr.get("artifactClassification", None)
@@ -88,9 +94,11 @@ class ItemArtifactFormulaParser(TQDBParser):
     def parse(self, dbr, dbr_file, result):
         # Skip formula without artifacts
         if self.ARTIFACT not in dbr:
-            raise InvalidItemError(f"Artifact {dbr_file} has no {self.ARTIFACT}.")
+            return Skipped("formula-artifact", dbr_file, self.ARTIFACT)
 
         artifact = DBRParser.parse(dbr[self.ARTIFACT])
+        if isinstance(artifact, Skipped):
+            return artifact
 
         # Update the result with the artifact:
         result["tag"] = artifact["tag"]
@@ -104,18 +112,17 @@ class ItemArtifactFormulaParser(TQDBParser):
         for reagent_key in ["reagent1", "reagent2", "reagent3"]:
             # For some reason reagent DBRs are of type array, so grab [0]:
             reagent = DBRParser.parse(dbr[reagent_key + "BaseName"][0])
+            if isinstance(reagent, Skipped):
+                return reagent
 
             # Add the reagent (relic, scroll or artifact)
             result[reagent_key] = reagent["tag"]
 
         # Add the potential completion bonuses
-        bonuses = {}
-        try:
-            bonuses = DBRParser.parse(dbr["artifactBonusTableName"])
-        except InvalidItemError as e:
-            logging.debug(
-                "Could not parse artifact completion bonus " f"information for {result['name']} in {dbr_file}. " f"{e}"
-            )
+        bonuses = DBRParser.parse(dbr["artifactBonusTableName"])
+        if isinstance(bonuses, Skipped):
+            diagnostics.skip("invalid-reference", dbr_file, bonuses.path, bonuses.code)
+            bonuses = {}
 
         result["bonus"] = bonuses.get("table", [])
 
@@ -147,6 +154,9 @@ class ItemBaseParser(TQDBParser):
         "OneShot_Scroll",
     ]
 
+    # Properties needed to check if an item should be parsed at all:
+    HEADER = ["Class", "itemClassification"]
+
     REQUIREMENTS = [
         "dexterityRequirement",
         "intelligenceRequirement",
@@ -161,8 +171,15 @@ class ItemBaseParser(TQDBParser):
     def get_template_path():
         return f"{TQDBParser.base}\\templatebase\\itembase.tpl"
 
+    @staticmethod
+    def path_key(dbr_file):
+        # Monster Infrequents have their drop difficulty in the file name:
+        return "_".join(os.path.basename(dbr_file).split("_")[1:2])
+
     def parse(self, dbr, dbr_file, result):
-        self.is_valid_classification(dbr, dbr_file, result)
+        skipped = self.is_valid_classification(dbr, dbr_file, result)
+        if skipped is not None:
+            return skipped
 
         # Always set the category:
         result["category"] = dbr.get("Class", None)
@@ -172,20 +189,26 @@ class ItemBaseParser(TQDBParser):
             if requirement in dbr:
                 result[requirement] = dbr[requirement]
 
+    @classmethod
+    def accepts(cls, header):
+        """
+        Check if an item with these HEADER properties is included in TQDB.
+
+        """
+        return header.get("Class") in cls.ALLOWED or header.get("itemClassification") in cls.CLASSIFICATIONS
+
     def is_valid_classification(self, dbr, dbr_file, result):
         """
         Check if this item is of a valid classification for TQDB.
 
+        :return: None, or a `Skipped` result if it isn't.
+
         """
         itemClass = dbr.get("Class")
         classification = dbr.get("itemClassification", None)
 
-        if itemClass not in self.ALLOWED and classification not in self.CLASSIFICATIONS.keys():
-            raise InvalidItemError(
-                f"Item {dbr_file} is excluded due to Class "
-                f"{itemClass} with itemClassification "
-                f"{classification}."
-            )
+        if not self.accepts(dbr):
+            return Skipped("item-classification", dbr_file, itemClass, classification)
         elif classification in self.CLASSIFICATIONS.keys() and "classification" not in result:
             # Only add the classification if it doesn't exist yet:
             result["classification"] = texts.get(self.CLASSIFICATIONS[classification]).strip()
@@ -194,9 +217,7 @@ class ItemBaseParser(TQDBParser):
             if classification == "Rare":
                 file_name = os.path.basename(dbr_file).split("_")
                 if len(file_name) < 2 or file_name[1] not in DIFFICULTIES:
-                    raise InvalidItemError(
-                        f"File name {file_name} does not " "specify difficulty, or difficulty " "not recognized."
-                    )
+                    return Skipped("item-difficulty", dbr_file)
 
                 # Set the difficulty for which this MI drops:
                 result["dropsIn"] = texts.get(DIFFICULTIES[file_name[1]]).strip()
@@ -237,7 +258,7 @@ class ItemEquipmentParser(TQDBParser):
         # If no tag exists, skip parsing:
         tag = dbr.get("itemNameTag", None)
         if not tag:
-            raise InvalidItemError(f"Item {dbr_file} has no itemNameTag.")
+            return Skipped("item-tag", dbr_file)
 
         # Set the known item properties:
         result.update(
@@ -320,6 +341,11 @@ class ItemRelicParser(TQDBParser):
     def get_template_path():
         return f"{TQDBParser.base}\\itemrelic.tpl"
 
+    @staticmethod
+    def path_key(dbr_file):
+        # The file name starts with the difficulty and act the relic drops in:
+        return "_".join(os.path.basename(dbr_file).split("_")[:2])
+
     def get_priority(self):
         """
         Override this parsers priority to set as lowest.
@@ -351,13 +377,10 @@ class ItemRelicParser(TQDBParser):
         )
 
         # The possible completion bonuses are in bonusTableName:
-        bonuses = {}
-        try:
-            bonuses = DBRParser.parse(dbr["bonusTableName"])
-        except InvalidItemError as e:
-            logging.debug(
-                "Could not parse relic completion bonus information " f"for {result['name']} in {dbr_file}. {e}"
-            )
+        bonuses = DBRParser.parse(dbr["bonusTableName"])
+        if isinstance(bonuses, Skipped):
+            diagnostics.skip("invalid-reference", dbr_file, bonuses.path, bonuses.code)
+            bonuses = {}
 
         result["bonus"] = bonuses.get("table", [])
 
@@ -412,8 +435,8 @@ class ItemSetParser(TQDBParser):
         tag = dbr.get(self.NAME, None)
 
         if not tag or texts.get(tag) == tag:
-            logging.warning(f"No tag or name for set found in {dbr_file}.")
-            raise InvalidItemError(f"No tag or name for set found in {dbr_file}.")
+            logging.warning("No tag or name for set found in %s.", dbr_file)
+            return Skipped("set-tag", dbr_file)
 
         result.update(
             {
@@ -427,10 +450,9 @@ class ItemSetParser(TQDBParser):
         # Add the set members:
         for set_member_path in dbr["setMembers"]:
             # Parse the set member:
-            try:
-                set_member = DBRParser.parse(set_member_path)
-            except InvalidItemError as e:
-                logging.debug(f"Could not parse set member {set_member_path} " f"in {result['name']}. {e}")
+            set_member = DBRParser.parse(set_member_path)
+            if isinstance(set_member, Skipped):
+                diagnostics.skip("invalid-reference", dbr_file, set_member.path, set_member.code)
                 continue
 
             # Some sets are templates that don't have actual members
@@ -443,7 +465,7 @@ class ItemSetParser(TQDBParser):
 
         # Skip any sets that have no members
         if len(result["items"]) == 0:
-            raise InvalidItemError(f"ItemSet {dbr_file} has no members.")
+            return Skipped("set-members", dbr_file)
 
         # The number of set bonuses is equal to the number of set items minus 1
         bonus_number = len(result["items"]) - 1
@@ -494,6 +516,11 @@ class OneShotScrollParser(TQDBParser):
         # Note: this technically handles parameters from oneshot.tpl too.
         return f"{TQDBParser.base}\\oneshot_scroll.tpl"
 
+    @staticmethod
+    def path_key(dbr_file):
+        # Potions and the difficulty of scrolls are determined by the path:
+        return str(dbr_file)
+
     def parse(self, dbr, dbr_file, result):
         """
         Parse the scroll.
@@ -528,11 +555,10 @@ class OneShotScrollParser(TQDBParser):
             result["bitmap"] = dbr["bitmap"]
 
         # Grab the skill file:
-        skill = {}
-        try:
-            skill = DBRParser.parse(dbr["skillName"])
-        except InvalidItemError as e:
-            logging.debug(f"Could not parse skill {dbr['skillName']} from " f"scroll {result['name']}. {e}")
+        skill = DBRParser.parse(dbr["skillName"])
+        if isinstance(skill, Skipped):
+            diagnostics.skip("invalid-reference", dbr_file, skill.path, skill.code)
+            skill = {}
 
         # Add the first tier of properties if there are any:
         if "properties" in skill and skill["properties"]:
@@ -0,0 +1,85 @@
+"""
+Functional tests for the equipment parsers.
+
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from tqdb.parsers import equipment
+from tqdb.parsers.equipment import ItemBaseParser
+from tqdb.parsers.main import Skipped
+
+# Item records, by the file they're in:
+ITEMS = {
+    "ring_n_01.dbr": {"Class": "ArmorJewelry_Ring", "itemClassification": "Rare"},
+    "ring_x_01.dbr": {"Class": "ArmorJewelry_Ring", "itemClassification": "Rare"},
+    "ring02.dbr": {"Class": "ArmorJewelry_Ring", "itemClassification": "Common"},
+    "ring03.dbr": {"Class": "ArmorJewelry_Ring"},
+    "amulet01.dbr": {"Class": "ArmorJewelry_Amulet", "itemClassification": "Magical"},
+    "sword01.dbr": {"Class": "WeaponMelee_Sword", "itemClassification": "Epic", "levelRequirement": 20},
+    "sword02.dbr": {"Class": "WeaponMelee_Sword", "itemClassification": "Legendary"},
+    "sword03.dbr": {"Class": "WeaponMelee_Sword", "itemClassification": "Broken"},
+    "relic01.dbr": {"Class": "ItemRelic"},
+    "charm01.dbr": {"Class": "ItemCharm", "itemClassification": "Common"},
+    "scroll01.dbr": {"Class": "OneShot_Scroll"},
+    "potion01.dbr": {"Class": "OneShot_PotionHealth"},
+    "empty.dbr": {},
+}
+
+
+class RecordingHeader(dict):
+    """
+    Header that records the properties that are looked up.
+
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.keys_read = set()
+
+    def get(self, key, default=None):
+        self.keys_read.add(key)
+        return super().get(key, default)
+
+    def __getitem__(self, key):
+        self.keys_read.add(key)
+        return super().__getitem__(key)
+
+
+@pytest.fixture
+def parser(monkeypatch):
+    monkeypatch.setattr(equipment, "texts", SimpleNamespace(get=lambda tag: tag))
+
+    # Parsers load their templates when they're created, which needs the game data:
+    return ItemBaseParser.__new__(ItemBaseParser)
+
+
+@pytest.mark.parametrize("name", ITEMS)
+def test_item_prefilter_matches_parser(parser, name):
+    """
+    Test that the prefilter accepts the items the parser doesn't skip for their classification.
+
+    """
+    dbr = ITEMS[name]
+    header = RecordingHeader({key: dbr[key] for key in ItemBaseParser.HEADER if key in dbr})
+
+    result = parser.parse(dict(dbr), f"records/item/{name}", {"properties": {}})
+    rejected = isinstance(result, Skipped) and result.code == "item-classification"
+
+    assert ItemBaseParser.accepts(header) is not rejected
+
+    # The prefilter only needs the properties that are peeked:
+    assert header.keys_read <= set(ItemBaseParser.HEADER)
+
+
+def test_item_prefilter_keeps_other_skips(parser):
+    """
+    Test that accepted items can still be skipped by the parser for other reasons.
+
+    """
+    dbr = ITEMS["ring_x_01.dbr"]
+    assert ItemBaseParser.accepts(dbr)
+
+    result = parser.parse(dict(dbr), "records/item/ring_x_01.dbr", {"properties": {}})
+    assert result.code == "item-difficulty"
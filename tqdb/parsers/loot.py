@@ -4,11 +4,11 @@ All loot table parsers.
 """
 import logging
 import numexpr
-import os
-import re
 
 from tqdb import dbr as DBRParser
-from tqdb.parsers.main import TQDBParser, InvalidItemError
+from tqdb.database import database
+from tqdb.diagnostics import diagnostics
+from tqdb.parsers.main import TQDBParser, Skipped
 from tqdb.utils.text import texts
 
 
@@ -48,34 +48,24 @@ class LootRandomizerTableParser(TQDBParser):
         return f"{TQDBParser.base}\\lootrandomizertable.tpl"
 
     def parse(self, dbr, dbr_file, result):
-        tables = {}
-        weights = {}
-
         # Initialize the results table:
         result["table"] = []
 
-        # Parse all available entries
-        for field, value in dbr.items():
-            if field.startswith("randomizerName"):
-                # Grab the number suffix (1-70)
-                number = re.search(r"\d+", field).group()
-                # Store the DBR reference in the table
-                tables[number] = value
-            if field.startswith("randomizerWeight"):
-                # Grab the number suffix (1-70)
-                number = re.search(r"\d+", field).group()
-                # Store the weight reference in the table
-                weights[number] = value
+        # Parse all available entries (numbered 1-70), by their number:
+        tables = dict(self.slots(dbr, "randomizerName"))
+        weights = dict(self.slots(dbr, "randomizerWeight"))
 
         # Add all the weights together to determined % later
         total_weight = sum(weights.values())
         for key, randomizer_file in tables.items():
             # Skip entries without chance or without a file
-            if key not in weights or not os.path.exists(randomizer_file):
+            if key not in weights or not database.exists(randomizer_file):
                 continue
 
             # Parse the table entry
             randomizer = DBRParser.parse(randomizer_file)
+            if isinstance(randomizer, Skipped):
+                return randomizer
 
             # Append the parsed bonus with its chance:
             result["table"].append(
@@ -92,6 +82,9 @@ class LootMasterTableParser(TQDBParser):
 
     """
 
+    # Results depend on the references that are passed along:
+    CONTEXTUAL = True
+
     def __init__(self):
         super().__init__()
 
@@ -102,41 +95,38 @@ class LootMasterTableParser(TQDBParser):
     def parse(self, dbr, dbr_file, result):
         items = {}
 
+        # Only the loot entries with a chance are set:
+        weights = self.slots(dbr, "lootWeight")
+        loot_files = dict(self.slots(dbr, "lootName"))
+
         # Add up all the loot weights:
-        summed = sum(v for k, v in dbr.items() if k.startswith("lootWeight"))
+        summed = sum(weight for _, weight in weights)
 
         # Run through all the loot entries and parse them:
-        for i in range(1, 31):
-            weight = dbr.get(f"lootWeight{i}", 0)
-
-            # Skip items with no chance:
-            if not weight:
-                continue
-
+        for i, weight in weights:
             chance = float("{0:.5f}".format(weight / summed))
 
             try:
                 # Try to parse the referenced loot file
-                loot_file = dbr[f"lootName{i}"]
+                loot_file = loot_files[i]
             except KeyError:
-                logging.debug(f"No lootName{i} not found in {dbr_file}.")
+                diagnostics.skip("loot-name", dbr_file, i)
                 continue
 
             # Parse the loot file
-            try:
-                loot = DBRParser.parse(
-                    loot_file,
-                    # Always pass along any references that were set:
-                    result["references"],
-                )
-            except InvalidItemError as e:
-                logging.debug(f"Invalid lootName{i} in {loot_file} referenced by {dbr_file}.")
+            loot = DBRParser.parse(
+                loot_file,
+                # Always pass along any references that were set:
+                result["references"],
+            )
+            if isinstance(loot, Skipped):
+                diagnostics.skip("invalid-reference", dbr_file, loot.path, loot.code)
                 continue
 
             # e.g. xpack2\quests\rewards\loottables\generic_rareweapon_n.dbr
             # The entry lootName15 has two entries separated by ';'
             if "loot_table" not in loot:
-                logging.debug(f"Invalid lootName{i} in {dbr_file}.")
+                diagnostics.skip("loot-reference", dbr_file, loot_file)
                 continue
 
             # Loot entries will be in 'table', add those:
@@ -159,6 +149,9 @@ class FixedItemContainerParser(TQDBParser):
 
     """
 
+    # Results depend on the references that are passed along:
+    CONTEXTUAL = True
+
     def __init__(self):
         super().__init__()
 
@@ -168,8 +161,7 @@ class FixedItemContainerParser(TQDBParser):
 
     def parse(self, dbr, dbr_file, result):
         if "tables" not in dbr:
-            logging.debug(f"No table found in {dbr_file}")
-            raise InvalidItemError(f"No table found in {dbr_file}")
+            return Skipped("loot-table", dbr_file)
 
         # Parse the references 'tables' file and set the result:
         loot = DBRParser.parse(
@@ -177,6 +169,9 @@ class FixedItemContainerParser(TQDBParser):
             # Always pass along any references that were set:
             result["references"],
         )
+        if isinstance(loot, Skipped):
+            return loot
+
         result["loot_table"] = loot["loot_table"]
 
 
@@ -186,6 +181,9 @@ class FixedItemLootParser(TQDBParser):
 
     """
 
+    # Results depend on the references that are passed along:
+    CONTEXTUAL = True
+
     def __init__(self):
         super().__init__()
 
@@ -195,7 +193,7 @@ class FixedItemLootParser(TQDBParser):
 
     def parse(self, dbr, dbr_file, result):
         # Initialize a dictionary of item chances to add to:
-        self.items = {}
+        items = {}
 
         # This camelCased variable is required for the spawn equations:
         numberOfPlayers = 1  # noqa
@@ -207,47 +205,47 @@ class FixedItemLootParser(TQDBParser):
 
         # There are 6 loot slots:
         for slot in range(1, 7):
-            self.parse_loot(f"loot{slot}", spawn_number, dbr, result)
+            self.parse_loot(f"loot{slot}", spawn_number, dbr, result, items)
 
-        result["loot_table"] = self.items
+        result["loot_table"] = items
 
-    def parse_loot(self, loot_key, spawn_number, dbr, result):
+    def parse_loot(self, loot_key, spawn_number, dbr, result, items):
         chance = dbr.get(f"{loot_key}Chance", 0)
 
         # Skip slots that have 0 chance to drop
         if not chance:
             return
 
+        # Only the loot possibilities with a chance are set:
+        weights = self.slots(dbr, f"{loot_key}Weight")
+        loot_files = dict(self.slots(dbr, f"{loot_key}Name"))
+
         # Add up all the loot weights:
-        summed = sum(v for k, v in dbr.items() if k.startswith(f"{loot_key}Weight"))
+        summed = sum(weight for _, weight in weights)
 
         # Run through all the loot possibilities and parse them:
-        for i in range(1, 7):
-            weight = dbr.get(f"{loot_key}Weight{i}", 0)
-
-            # Skip items with no chance:
-            if not weight:
-                continue
-
+        for i, weight in weights:
             try:
                 loot = DBRParser.parse(
-                    dbr[f"{loot_key}Name{i}"][0],
+                    loot_files[i][0],
                     # Always pass along any references that were set:
                     result["references"],
                 )
+                if isinstance(loot, Skipped):
+                    continue
 
                 # Parse the table and multiply the values by the chance:
                 loot_chance = float("{0:.5f}".format(weight / summed))
                 new_items = dict((k, v * loot_chance * chance * spawn_number) for k, v in loot["loot_table"].items())
-            except (KeyError, InvalidItemError):
+            except KeyError:
                 # Skip files that weren't found/parsed (no loot_table)
                 continue
 
             for k, v in new_items.items():
-                if k in self.items:
-                    self.items[k] += v
+                if k in items:
+                    items[k] += v
                 else:
-                    self.items[k] = v
+                    items[k] = v
 
 
 class LootItemTable_DynWeightParser(TQDBParser):
@@ -256,6 +254,9 @@ class LootItemTable_DynWeightParser(TQDBParser):
 
     """
 
+    # Results depend on the references that are passed along:
+    CONTEXTUAL = True
+
     def __init__(self):
         super().__init__()
 
@@ -289,14 +290,13 @@ class LootItemTable_DynWeightParser(TQDBParser):
 
         for index, loot_file in enumerate(dbr.get("itemNames", [])):
             # Grab the item and its chance
-            try:
-                item = DBRParser.parse(loot_file)
-            except InvalidItemError as e:
-                logging.debug(f"Invalid loot file {loot_file} in {dbr_file}. {e}")
+            item = DBRParser.parse(loot_file)
+            if isinstance(item, Skipped):
+                diagnostics.skip("invalid-reference", dbr_file, item.path, item.code)
                 continue
 
             if "tag" not in item:
-                logging.debug(f"No tag for {loot_file} in {dbr_file}")
+                diagnostics.skip("loot-reference", dbr_file, loot_file)
                 continue
 
             level = item["itemLevel"]
@@ -339,23 +339,24 @@ class LootItemTable_FixedWeightParser(TQDBParser):
     def parse(self, dbr, dbr_file, result):
         items = {}
 
+        # Only the loot chances that are set:
+        weights = self.slots(dbr, "lootWeight")
+        loot_files = dict(self.slots(dbr, "lootName"))
+
         # Add up all the loot weights:
-        summed = sum(v for k, v in dbr.items() if k.startswith("lootWeight"))
+        summed = sum(weight for _, weight in weights)
 
         # Run through all the loot chances and parse them:
-        for i in range(1, 31):
-            weight = dbr.get(f"lootWeight{i}", 0)
-
-            # Skip items with no chance:
-            if not weight:
-                continue
-
+        for i, weight in weights:
             try:
                 # Grab the item and its chance
-                item = DBRParser.parse(dbr[f"lootName{i}"])
+                item = DBRParser.parse(loot_files[i])
+                if isinstance(item, Skipped):
+                    continue
+
                 # Store the chance of this item by its tag:
                 items[item["tag"]] = float("{0:.5f}".format(weight / summed))
-            except (KeyError, InvalidItemError):
+            except KeyError:
                 # Skip items that have no tag:
                 continue
 
@@ -9,18 +9,42 @@ import pkgutil
 from importlib import import_module
 from pathlib import Path
 
-from tqdb.templates import templates_by_path
+from tqdb.diagnostics import message
+from tqdb.templates import families, templates_by_path
 
 
-class InvalidItemError(Exception):
+class Skipped:
     """
-    Raised by parser when it identifies that the item being parsed is invalid
-    and should be ignored. This may be because it is missing crucial information,
-    or because it's filtered out because it's uninteresting, for example if it
-    is a common item.
+    Returned by a parser when it identifies that the record being parsed is
+    invalid and should be ignored. This may be because it is missing crucial
+    information, or because it's filtered out because it's uninteresting, for
+    example if it is a common item.
+
+    Skipped records are expected, so they're returned instead of raised, and
+    only hold the reason (a code of `tqdb.diagnostics.MESSAGES`) and its
+    details. The message is only formatted when it's needed.
     """
 
-    pass
+    def __init__(self, code, path, *details):
+        self.code = code
+        self.path = path
+        self.details = details
+
+    def __repr__(self):
+        return f"Skipped({self.code!r}, {self.path!r})"
+
+    def __str__(self):
+        return message(self.code, self.path, self.details)
+
+    def of(self, path):
+        """
+        Return the reason a record is skipped, if it's skipped due to this one.
+
+        A record that can't be parsed without a record it uses is skipped as
+        well, with a reference to this record as its reason.
+
+        """
+        return self if self.path == path else Skipped("invalid-reference", path, self.path, self.code)
 
 
 class TQDBParser(metaclass=abc.ABCMeta):
@@ -35,6 +59,10 @@ class TQDBParser(metaclass=abc.ABCMeta):
     # Base that all subclasses use for their template names.
     base = "database\\templates"
 
+    # Contextual parsers use the references passed by the record that
+    # references them, so their results can't be parsed ahead of time:
+    CONTEXTUAL = False
+
     # Priority constants:
     HIGHEST_PRIORITY = 3
     DEFAULT_PRIORITY = 2
@@ -68,6 +96,18 @@ class TQDBParser(metaclass=abc.ABCMeta):
         """
         return self.DEFAULT_PRIORITY
 
+    @staticmethod
+    def path_key(dbr_file):
+        """
+        Return the part of the record's path that this parser uses.
+
+        Records with the same contents share their parsed result, unless the
+        parsers use a different part of their paths. This method is overriden
+        by any subclass that parses (part of) the path of the record.
+
+        """
+        return ""
+
     @abc.abstractstaticmethod
     def get_template_path():
         """
@@ -81,6 +121,8 @@ class TQDBParser(metaclass=abc.ABCMeta):
         """
         Parses a specific DBR file and updates the result.
 
+        :return: None, or a `Skipped` result if the file should be skipped.
+
         """
         raise NotImplementedError
 
@@ -122,6 +164,23 @@ class TQDBParser(metaclass=abc.ABCMeta):
 
         return result
 
+    @staticmethod
+    def slots(dbr, family):
+        """
+        Return the populated slots of a family of numbered fields in a DBR.
+
+        The numbered fields of all templates are indexed once, so the slots
+        are found without building the field names for every DBR.
+
+        For example:
+            lootName1: a.dbr
+            lootName3: b.dbr
+
+        For the family 'lootName' this returns [(1, 'a.dbr'), (3, 'b.dbr')].
+
+        """
+        return [(number, dbr[name]) for number, name in families.get(family, ()) if name in dbr]
+
     @staticmethod
     def highest_tier(dbr, properties):
         """
@@ -0,0 +1,52 @@
+"""
+Functional tests for the base functionality of the parsers.
+
+"""
+import pytest
+
+from tqdb.parsers import main
+from tqdb.parsers.main import TQDBParser
+from tqdb.templates import index_families
+
+
+@pytest.fixture(autouse=True)
+def families(monkeypatch):
+    # The families are indexed from the templates, which need the game data:
+    monkeypatch.setattr(
+        main,
+        "families",
+        index_families([*(f"lootName{i}" for i in range(1, 31)), "LootName2", "skillLevel1", "skillLevel10"]),
+    )
+
+
+def test_slots_with_gaps():
+    """
+    Test that only the populated slots are returned, in order of their number.
+
+    """
+    dbr = {"lootName12": "b.dbr", "lootName3": "a.dbr", "lootName30": "c.dbr", "lootName": "x.dbr"}
+
+    assert TQDBParser.slots(dbr, "lootName") == [(3, "a.dbr"), (12, "b.dbr"), (30, "c.dbr")]
+
+
+def test_slots_are_case_sensitive():
+    """
+    Test that the slots of a family don't include properties in another case.
+
+    """
+    dbr = {"lootName1": "a.dbr", "LootName2": "b.dbr"}
+
+    assert TQDBParser.slots(dbr, "lootName") == [(1, "a.dbr")]
+    assert TQDBParser.slots(dbr, "LootName") == [(2, "b.dbr")]
+
+
+def test_slots_of_unknown_fields():
+    """
+    Test that properties that aren't in a template, and unknown families, have no slots.
+
+    """
+    dbr = {"lootName31": "a.dbr", "skillLevel5": 5, "skillLevel10": 3}
+
+    assert TQDBParser.slots(dbr, "lootName") == []
+    assert TQDBParser.slots(dbr, "skillLevel") == [(10, 3)]
+    assert TQDBParser.slots(dbr, "randomizerName") == []
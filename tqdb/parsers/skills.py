@@ -6,7 +6,8 @@ import logging
 import re
 
 from tqdb import dbr as DBRParser
-from tqdb.parsers.main import TQDBParser
+from tqdb.diagnostics import diagnostics
+from tqdb.parsers.main import TQDBParser, Skipped
 from tqdb.utils.text import texts
 
 
@@ -74,6 +75,11 @@ class SkillBaseParser(TQDBParser):
     def get_template_path():
         return f"{TQDBParser.base}\\templatebase\\skill_base.tpl"
 
+    @staticmethod
+    def path_key(dbr_file):
+        # The path is stored with the skill:
+        return str(dbr_file)
+
     def parse(self, dbr, dbr_file, result):
         """
         Parse the base properties of a skill.
@@ -95,9 +101,9 @@ class SkillBaseParser(TQDBParser):
 
             if result["name"] == result["tag"]:
                 # If the tag wasn't returned, a friendly name weas found:
-                logging.debug(f'No skill name found for {result["tag"]}')
+                logging.debug("No skill name found for %s", result["tag"])
         else:
-            logging.debug(f"No skillDisplayName found in {dbr_file}")
+            diagnostics.skip("skill-name", dbr_file)
 
         if self.DESC in dbr and texts.has(dbr[self.DESC]):
             # Also load the description, if it's known:
@@ -209,8 +215,12 @@ class SkillBuffParser(TQDBParser):
 
         """
         if self.BUFF in dbr:
+            buff = DBRParser.parse(dbr[self.BUFF])
+            if isinstance(buff, Skipped):
+                return buff
+
             # Now set our result as the result of the buff being parsed:
-            result.update(DBRParser.parse(dbr[self.BUFF]))
+            result.update(buff)
 
 
 class SkillModifierParser(TQDBParser):
@@ -258,8 +268,12 @@ class SkillPetModifier(TQDBParser):
 
         """
         if self.PET_SKILL in dbr:
+            pet_skill = DBRParser.parse(dbr[self.PET_SKILL])
+            if isinstance(pet_skill, Skipped):
+                return pet_skill
+
             # Now set our result as the result of the pet skill being parsed:
-            result.update(DBRParser.parse(dbr[self.PET_SKILL]))
+            result.update(pet_skill)
 
 
 class SkillPassiveOnLifeBuffSelfParser(TQDBParser):
@@ -397,6 +411,8 @@ class SkillSpawnPetParser(TQDBParser):
         result["summons"] = []
         for index, spawn_file in enumerate(dbr["spawnObjects"]):
             spawn = DBRParser.parse(spawn_file)
+            if isinstance(spawn, Skipped):
+                return spawn
 
             # Keep track of the original properties this summon had:
             original_properties = {}
@@ -0,0 +1,242 @@
+"""
+Bottom-up scheduling of the DBR parsing.
+
+Parsing a record recursively parses the records it references (loot tables,
+skills, spawned pets, set members, etc.). The scheduler discovers this
+reference graph up front, and parses the records in levels: records that
+don't reference anything first, then the records that only reference those,
+and so on. Every record is then parsed, and cached, once before any of the
+records that depend on it.
+
+"""
+import contextvars
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdb import dbr as DBRParser
+from tqdb import storage
+from tqdb.diagnostics import diagnostics
+from tqdb.parsers.main import Skipped
+
+
+class Scheduler:
+    """
+    Scheduler class.
+
+    Discovers the reference graph of a list of records and parses it from the
+    bottom up. The records of a level don't depend on each other, so they are
+    parsed by `workers` threads, by default the workers of the session.
+
+    The files are parsed in batches that fit the cache of the session. Each
+    parsed record is held in the cache until the records using it are parsed,
+    and the files of a batch until they're used (see `ParseCache.hold`). The
+    files are kept for good if the session keeps its files.
+
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+
+        # The records each discovered record references:
+        self.references = {}
+
+        # Records that are parsed by contextual parsers:
+        self.contextual = set()
+
+    def run(self, files, select=None):
+        """
+        Discover and parse all records referenced by the files, and the files.
+
+        :param select: function that determines if a file is parsed, without
+            parsing it (see `dbr.peek`). By default all files are parsed.
+        :return: generator of the files that are selected, each parsed before
+            it's generated and kept cached until the next batch is parsed.
+
+        """
+        files = self.discover(files, select)
+
+        depths = self.depths()
+        logging.info(f"Scheduled {len(self.references)} records for {len(files)} files.")
+
+        # Half of the budget is for the files of a batch, the other half for the records they use:
+        max_entries = storage.db.max_entries
+        size = max(1, max_entries // 2) if max_entries is not None else max(1, len(files))
+
+        for start in range(0, len(files), size):
+            batch = files[start : start + size]
+            self.parse_batch(batch, depths)
+            try:
+                yield from batch
+            finally:
+                if storage.current().keep_files:
+                    storage.db.pin(batch)
+                storage.db.release(batch)
+
+    def parse_batch(self, files, depths):
+        """
+        Parse the files and the records they use, level by level.
+
+        A record is held from the level it's parsed at until the last level
+        that uses it. The files themselves are held until they're released by
+        the caller.
+
+        """
+        workers = self.workers or storage.current().workers
+
+        # The records the files use, and the last level each of them is used at:
+        used = {dbr: float("inf") for dbr in files}
+        remaining = list(files)
+        while remaining:
+            dbr = remaining.pop()
+            for reference in self.references[dbr]:
+                # References that form a cycle can be at a higher level than this record:
+                level = max(depths[dbr], depths[reference])
+                if reference not in used:
+                    remaining.append(reference)
+                used[reference] = max(used.get(reference, level), level)
+
+        # The records of each level, and the records that are released after it:
+        levels = defaultdict(list)
+        releases = defaultdict(list)
+        for dbr, last in used.items():
+            levels[depths[dbr]].append(dbr)
+            if depths[dbr] < last < float("inf"):
+                releases[last].append(dbr)
+
+        for index in sorted(levels):
+            # Contextual records are parsed on demand by the records referencing
+            # them, and records in the cache don't have to be parsed again:
+            records = [dbr for dbr in levels[index] if dbr not in self.contextual and dbr not in storage.db]
+
+            # Hold the records before they're parsed, so the level itself can't evict them:
+            storage.db.hold(dbr for dbr in levels[index] if used[dbr] > index)
+
+            if workers > 1:
+                # Each worker parses in (a copy of) the context of the current session:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for dbr in records:
+                        executor.submit(contextvars.copy_context().run, self.parse, dbr)
+            else:
+                # The records of a level are read just before they're parsed:
+                for dbr in DBRParser.prefetch(records):
+                    self.parse(dbr)
+
+            storage.db.release(releases[index])
+
+    def discover(self, files, select=None):
+        """
+        Discover the reference graph, one layer of references at a time.
+
+        Records are read to find their references, but their properties
+        aren't kept until they're parsed. Records that are already cached
+        aren't read at all, since neither they, nor their references, have to
+        be parsed for them.
+
+        :return: the files that are selected.
+
+        """
+        selected = []
+        discovered = []
+        for dbr in DBRParser.prefetch(list(dict.fromkeys(files))):
+            if select is None or select(dbr):
+                selected.append(dbr)
+                discovered.extend(self.visit(dbr))
+
+        remaining = list(dict.fromkeys(dbr for dbr in discovered if dbr not in self.references))
+        while remaining:
+            discovered = []
+            for dbr in DBRParser.prefetch(remaining):
+                discovered.extend(self.visit(dbr))
+
+            remaining = list(dict.fromkeys(dbr for dbr in discovered if dbr not in self.references))
+
+        return selected
+
+    def visit(self, dbr):
+        """
+        Find the references of a discovered record.
+
+        :return: the records it references, if it wasn't visited before.
+
+        """
+        if dbr in self.references:
+            return []
+
+        if dbr in storage.db:
+            self.references[dbr] = []
+            return []
+
+        template, references = DBRParser.read_references(dbr)
+        self.references[dbr] = references
+
+        if template and any(parser.CONTEXTUAL for parser in DBRParser.get_parsers(template)):
+            self.contextual.add(dbr)
+
+        return references
+
+    def levels(self):
+        """
+        Group the discovered records by level, leaves first.
+
+        :return: list of levels, each a list of records.
+
+        """
+        levels = defaultdict(list)
+        for dbr, index in self.depths().items():
+            levels[index].append(dbr)
+
+        return [levels[index] for index in sorted(levels)]
+
+    def depths(self):
+        """
+        Determine the level of each discovered record.
+
+        The level of a record is one higher than the highest level of the
+        records it references. References that form a cycle are ignored.
+
+        :return: dict of the level of each record.
+
+        """
+        level = {}
+
+        for root in self.references:
+            if root in level:
+                continue
+
+            # Depth first, with a stack of the records that are being visited:
+            visiting = {root}
+            stack = [(root, iter(self.references[root]))]
+            while stack:
+                dbr, references = stack[-1]
+                for reference in references:
+                    if reference not in level and reference not in visiting:
+                        visiting.add(reference)
+                        stack.append((reference, iter(self.references[reference])))
+                        break
+                else:
+                    # All references have a level now, so this record does too:
+                    stack.pop()
+                    visiting.discard(dbr)
+                    level[dbr] = 1 + max((level[r] for r in self.references[dbr] if r in level), default=-1)
+
+        return level
+
+    @staticmethod
+    def parse(dbr):
+        """
+        Parse a record, so its result is cached for the records using it.
+
+        Invalid records are skipped, and their Skipped result is kept (see
+        `dbr.parse`). Whoever references them gets the same result and handles
+        it, without parsing (and reporting) them again. Records that can't be
+        parsed at all are reported and kept the same way.
+
+        """
+        try:
+            DBRParser.parse(dbr)
+        except Exception as e:
+            logging.debug("Could not parse %s.", dbr, exc_info=True)
+            skipped = Skipped("parse-error", dbr, f"{type(e).__name__}: {e}")
+            diagnostics.skip_result(skipped)
+            storage.current().failures[dbr] = skipped
@@ -0,0 +1,116 @@
+"""
+Functional tests for the parse scheduler.
+
+"""
+from tqdb import dbr as DBRParser
+from tqdb import storage
+from tqdb.scheduler import Scheduler
+
+
+def test_levels_leaves_first():
+    """
+    Test that records are grouped after all the records they reference.
+
+    """
+    scheduler = Scheduler()
+    scheduler.references = {
+        "set": ["item1", "item2"],
+        "item1": ["skill"],
+        "item2": [],
+        "skill": ["pet"],
+        "pet": [],
+    }
+
+    assert scheduler.levels() == [["pet", "item2"], ["skill"], ["item1"], ["set"]]
+
+
+def test_levels_cycle():
+    """
+    Test that records referencing each other are still all scheduled.
+
+    """
+    scheduler = Scheduler()
+    scheduler.references = {"a": ["b"], "b": ["a", "c"], "c": []}
+
+    levels = scheduler.levels()
+
+    assert sorted(dbr for level in levels for dbr in level) == ["a", "b", "c"]
+    assert levels[0] == ["c"]
+
+
+def test_run_selects_files(tmp_path, monkeypatch):
+    """
+    Test that only the selected files are parsed, and no properties are kept.
+
+    """
+    files = [tmp_path / "a.dbr", tmp_path / "b.dbr"]
+    for dbr in files:
+        dbr.write_text(f"templateName,{dbr.stem}.tpl,\n")
+
+    parsed = []
+    monkeypatch.setattr(Scheduler, "parse", staticmethod(parsed.append))
+
+    session = storage.ParseSession()
+    selected = session.run(
+        lambda: list(
+            Scheduler().run(
+                files, select=lambda dbr: DBRParser.peek(dbr, ["templateName"]) == {"templateName": "a.tpl"}
+            )
+        )
+    )
+
+    assert selected == parsed == files[:1]
+    assert not session.prefetched
+
+
+def test_run_holds_records_until_used(monkeypatch):
+    """
+    Test that records aren't evicted before the records using them are parsed.
+
+    """
+    references = {"set": ["item1", "item2"], "item1": ["skill"], "item2": ["skill"], "skill": [], "other": []}
+
+    scheduler = Scheduler()
+    monkeypatch.setattr(
+        scheduler, "discover", lambda files, select=None: scheduler.references.update(references) or files
+    )
+
+    # Parsing a record uses the records it references, and stores it:
+    missing = []
+
+    def parse(dbr):
+        missing.extend(reference for reference in references[dbr] if reference not in storage.db)
+        storage.db.store(dbr, {"tag": dbr})
+
+    monkeypatch.setattr(scheduler, "parse", parse)
+
+    def run():
+        for dbr in scheduler.run(["set", "other"]):
+            assert dbr in storage.db
+
+        return storage.db
+
+    cache = storage.ParseSession(max_entries=1).run(run)
+
+    assert not missing
+    assert not cache.held and not cache.holds
+    assert len(cache) == 1
+
+
+def test_parse_errors_are_reported(monkeypatch):
+    """
+    Test that a record that can't be parsed is reported once, and skipped after.
+
+    """
+
+    def parse(dbr, references=None):
+        raise ValueError("invalid literal")
+
+    monkeypatch.setattr(DBRParser, "parse_record", parse)
+
+    session = storage.ParseSession()
+    session.run(Scheduler.parse, "a.dbr")
+    skipped = session.run(DBRParser.parse, "a.dbr")
+
+    assert (skipped.code, skipped.path) == ("parse-error", "a.dbr")
+    assert session.diagnostics.render() == ["Record a.dbr could not be parsed: ValueError: invalid literal"]
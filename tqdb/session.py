@@ -0,0 +1,39 @@
+"""
+Access to the state of the parse session that's currently running.
+
+Modules like the database, diagnostics and texts expose the state of the
+current session as a module level instance. Since the storage, which holds the
+sessions, imports those modules, the session is only looked up when one of its
+attributes is accessed.
+
+"""
+
+
+class SessionAttribute:
+    """
+    SessionAttribute class.
+
+    Forwards all attribute access to an attribute of the current session, so
+    each session uses its own instance.
+
+    """
+
+    def __init__(self, name):
+        # Underscored, so it doesn't shadow an attribute of the target:
+        self._attribute = name
+
+    def __getattr__(self, name):
+        # Imported here, since the storage imports the modules that use this:
+        from tqdb.storage import current
+
+        return getattr(getattr(current(), self._attribute), name)
+
+
+def session_attribute(name):
+    """
+    Create a proxy to an attribute of the current parse session.
+
+    :param name: the attribute of `storage.ParseSession` to forward to.
+
+    """
+    return SessionAttribute(name)
@@ -0,0 +1,21 @@
+"""
+Functional tests for the access to the current parse session.
+
+"""
+from tqdb.diagnostics import diagnostics
+from tqdb.storage import ParseSession
+
+
+def test_attribute_of_current_session():
+    """
+    Test that a session attribute forwards to the session that's running.
+
+    """
+    first = ParseSession()
+    second = ParseSession()
+
+    first.run(lambda: diagnostics.skip("item-tag", "a.dbr"))
+    second.run(lambda: diagnostics.skip("set-tag", "b.dbr"))
+
+    assert first.diagnostics.counts == {"item-tag": 1}
+    assert second.diagnostics.counts == {"set-tag": 1}
@@ -1,75 +1,465 @@
 """
 All functions related to storage while parsing the TQ DB.
 
+The storage belongs to a parse session, so multiple sessions can parse at
+the same time without sharing any state. The cache and skills of the current
+session are available as `storage.db` and `storage.skills`.
+
 """
-db = {}
-skills = {}
+import contextvars
+import logging
+import threading
+from collections import Counter, OrderedDict
 
+from tqdb.database import RecordSources, index
+from tqdb.diagnostics import Diagnostics
+from tqdb.utils.core import fingerprint
+from tqdb.utils.text import Texts
 
-def duplicate_suffix(needle):
+
+class ParseCache:
     """
-    Find the next suffix for an existing prefix in skill storage.
+    Cache of parsed DBR files, keyed by their path.
+
+    At most `max_entries` results are kept, evicting the least recently used
+    ones first. Pinned results, like loot tables and skills that are shared by
+    many records, are never evicted. Neither are held results, while they're
+    still needed (see `hold`). An evicted result is simply parsed again.
 
-    For example:
-        prefix = 'skillName1'
-        storage = {'skillName1': ....}
+    A cache can have a parent cache, whose results it shares unless they're
+    shadowed, for example because an overlay changes them. Results stored in
+    this cache never change the parent (copy-on-write).
 
-        # Return 1 because the new tag will be 'skillName1-1'
-        return 1
+    Records with the same contents as a cached record are stored as an alias
+    of that record, so they share its result and its entry.
 
     """
-    result = 1
 
-    for haystack in skills.keys():
-        if "-" not in haystack:
-            continue
+    # The default number of (unpinned) results to keep:
+    MAX_ENTRIES = 10000
 
-        prefix, suffix = haystack.split("-", maxsplit=1)
-        if prefix == needle and int(suffix) >= result:
-            result += 1
+    def __init__(self, max_entries=MAX_ENTRIES, parent=None, shadowed=()):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pinned = {}
 
-    return result
+        # Results that are held, and the number of holds for each key (see `hold`):
+        self.held = {}
+        self.holds = Counter()
 
+        # Keys that share the result of another key:
+        self.aliases = {}
 
-def store_skill(skill):
+        # The cache to fall back on, for all keys that aren't shadowed:
+        self.parent = parent
+        self.shadowed = set(shadowed)
+
+        # Records can be parsed by multiple threads in a session:
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        key = self.aliases.get(key, key)
+        return (
+            key in self.pinned or key in self.held or key in self.entries or (self.inherits(key) and key in self.parent)
+        )
+
+    def __getitem__(self, key):
+        key = self.aliases.get(key, key)
+        if key in self.pinned:
+            return self.pinned[key]
+
+        with self.lock:
+            if key in self.held:
+                return self.held[key]
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        if self.inherits(key):
+            return self.parent[key]
+
+        raise KeyError(key)
+
+    def __setitem__(self, key, result):
+        self.store(key, result)
+
+    def __len__(self):
+        return len(self.pinned) + len(self.held) + len(self.entries)
+
+    def inherits(self, key):
+        """
+        Check if the parent's result for a key can be used.
+
+        """
+        return self.parent is not None and key not in self.shadowed
+
+    def alias(self, key, target):
+        """
+        Share the result of the target key with another key.
+
+        """
+        with self.lock:
+            self.aliases[key] = self.aliases.get(target, target)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def store(self, key, result, pinned=False):
+        """
+        Store a parsed result, evicting the oldest results if necessary.
+
+        """
+        with self.lock:
+            self.aliases.pop(key, None)
+
+            if pinned:
+                self.entries.pop(key, None)
+                self.held.pop(key, None)
+                self.pinned[key] = result
+                return
+
+            if self.holds[key]:
+                self.held[key] = result
+                return
+
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            self.evict()
+
+    def evict(self):
+        """
+        Evict the oldest results that exceed the budget.
+
+        """
+        # A budget of None means the cache is unbounded:
+        if self.max_entries is None:
+            return
+
+        # Held results count towards the budget, but only the others are evicted:
+        while self.entries and len(self.entries) + len(self.held) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def pin(self, keys):
+        """
+        Pin the results of keys that are cached, so they're never evicted.
+
+        """
+        with self.lock:
+            for key in keys:
+                key = self.aliases.get(key, key)
+                if key in self.held:
+                    self.pinned[key] = self.held.pop(key)
+                elif key in self.entries:
+                    self.pinned[key] = self.entries.pop(key)
+
+    def hold(self, keys):
+        """
+        Keep the results of keys from being evicted, until they're released.
+
+        The scheduler holds the records it parsed until the records using them
+        are parsed too. Holds are counted, a result is only evicted again once
+        all of its holds are released.
+
+        """
+        with self.lock:
+            for key in keys:
+                key = self.aliases.get(key, key)
+                self.holds[key] += 1
+                if key in self.entries:
+                    self.held[key] = self.entries.pop(key)
+
+    def release(self, keys):
+        """
+        Release the holds of keys, evicting the oldest results if necessary.
+
+        """
+        with self.lock:
+            for key in keys:
+                key = self.aliases.get(key, key)
+                if not self.holds[key]:
+                    continue
+
+                self.holds[key] -= 1
+                if not self.holds[key]:
+                    del self.holds[key]
+                    if key in self.held:
+                        self.entries[key] = self.held.pop(key)
+
+            self.evict()
+
+
+class SkillStorage(dict):
     """
-    Store a skill and return a unique tag.
+    Skills stored by their unique tag.
+
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        # Index of the stored skill paths, to the tag they are stored by:
+        self.tags = {}
+
+        # The next free suffix for each tag prefix:
+        self.suffixes = {}
+
+        # Index of the stored skill contents, to the tag they are stored by:
+        self.contents = {}
+
+        # Skills can be stored by multiple threads in a session:
+        self.lock = threading.RLock()
+
+    def fork(self):
+        """
+        Copy the stored skills, for a session based on this one.
+
+        """
+        with self.lock:
+            forked = SkillStorage()
+            forked.update(self)
+            forked.tags.update(self.tags)
+            forked.suffixes.update(self.suffixes)
+            forked.contents.update(self.contents)
+
+            return forked
+
+    def duplicate_suffix(self, needle):
+        """
+        Allocate the next suffix for an existing prefix in skill storage.
+
+        For example:
+            prefix = 'skillName1'
+            storage = {'skillName1': ....}
+
+            # Return 1 because the new tag will be 'skillName1-1'
+            return 1
+
+        """
+        with self.lock:
+            result = self.suffixes.get(needle, 1)
+
+            # Skip any suffixes that are already taken:
+            while f"{needle}-{result}" in self:
+                result += 1
+
+            self.suffixes[needle] = result + 1
+
+            return result
+
+    def store(self, skill):
+        """
+        Store a skill and return a unique tag.
+
+        A skill is stored by its tag but its path is used to check if any
+        duplicates exist, since the tag is not fully unique. Skills with the same
+        content as a stored skill aren't stored again, but reference that skill.
+
+        For example, the tag tagSkillName185 resolves to Barrage for its friendly
+        name, but there's a monster skill and a skill in the Earth tree that both
+        use this tag.
+
+        """
+        # Retrieve the tag for the skill, or fall back to 'unnamed'.
+        skill_tag = skill.get("tag", "unnamed")
+        skill_path = skill.get("path")
+
+        # Skills can be large, so don't hold the lock while fingerprinting them:
+        fingerprint = skill_fingerprint(skill) if skill_path not in self.tags else None
 
-    A skill is stored by its tag but its path is used to check if any
-    duplicates exist, since the tag is not fully unique.
+        with self.lock:
+            if skill_path in self.tags:
+                # This skill was stored before, reuse its tag:
+                skill_tag = self.tags[skill_path]
+            else:
+                if fingerprint in self.contents:
+                    # The same skill is stored from another path, reference that one:
+                    skill_tag = self.contents[fingerprint]
+                    skill["tag"] = skill_tag
+                    self.tags[skill_path] = skill_tag
+                    return skill_tag
 
-    For example, the tag tagSkillName185 resolves to Barrage for its friendly
-    name, but there's a monster skill and a skill in the Earth tree that both
-    use this tag.
+                if skill_tag in self:
+                    prefix = skill_tag.split("-")[0]
+                    skill_tag = f"{prefix}-{self.duplicate_suffix(prefix)}"
 
+                self.contents[fingerprint] = skill_tag
+
+            # Set the unique tag:
+            skill["tag"] = skill_tag
+
+            # Store the skill and index its path
+            self[skill_tag] = skill
+            self.tags[skill_path] = skill_tag
+
+        # Return this (now definitely unique) tag.
+        return skill_tag
+
+
+class ParseSession:
+    """
+    ParseSession class.
+
+    A session holds all the state of a parse: the cache of parsed records,
+    the stored skills, the texts for its locale and the diagnostics of the
+    records that were skipped. The parsers don't keep
+    any state themselves, so sessions can run concurrently, for example to
+    parse two locales at once.
+
+    Use `run` to parse in a session, any thread that's started in there has
+    to copy the context (see `contextvars.copy_context`) to use it too.
+
+    """
+
+    def __init__(self, locale=None, max_entries=ParseCache.MAX_ENTRIES, database=None, workers=1, keep_files=False):
+        self.database = database or RecordSources([index])
+
+        # The number of threads that parse records in this session, see `Scheduler`:
+        self.workers = workers
+
+        # Keep the results of the files that are parsed (not the records they
+        # use), for a session that's forked from this one (see `fork`):
+        self.keep_files = keep_files
+        self.db = ParseCache(max_entries)
+        self.skills = SkillStorage()
+        self.texts = Texts()
+        self.diagnostics = Diagnostics()
+
+        # Tokenized records that were read ahead of the parser, by file:
+        self.prefetched = {}
+
+        # The records that used each parsed record, while parsing them:
+        self.dependents = {}
+
+        # The first record parsed with each content key, see `dbr.content_key`:
+        self.contents = {}
+
+        # The Skipped result of each record that's skipped, so it's only skipped once:
+        self.failures = {}
+
+        if locale:
+            self.texts.load_locale(locale)
+
+    def fork(self, overlays):
+        """
+        Create a session that parses with overlays on top of this database.
+
+        The records the overlays override, and all records that use them
+        (directly or through other records), are parsed again in the new
+        session. All other results are shared with the cache of this session,
+        which should keep the results of its files for that (see `keep_files`).
+
+        """
+        database = self.database.overlay(overlays)
+        affected = self.affected(database.overridden())
+        logging.info(f"Overlays affect {len(affected)} records.")
+
+        session = ParseSession(max_entries=self.db.max_entries, database=database, workers=self.workers)
+        session.db = ParseCache(self.db.max_entries, parent=self.db, shadowed=affected)
+        session.skills = self.skills.fork()
+        session.failures = {dbr: skipped for dbr, skipped in self.failures.items() if dbr not in affected}
+        session.texts = self.texts
+
+        return session
+
+    def affected(self, records):
+        """
+        Find all records that used any of the records, while parsing them.
+
+        :return: the records and all of their (indirect) dependents.
+
+        """
+        affected = set(records)
+        remaining = list(affected)
+        while remaining:
+            for dependent in self.dependents.get(remaining.pop(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    remaining.append(dependent)
+
+        return affected
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Run a function in this session, and return its result.
+
+        """
+        context = contextvars.copy_context()
+        context.run(_session.set, self)
+        return context.run(fn, *args, **kwargs)
+
+    def reset(self):
+        """
+        Reset the cache and skill storage.
+
+        """
+        self.db = ParseCache(self.db.max_entries)
+        self.skills = SkillStorage()
+        self.diagnostics = Diagnostics()
+        self.dependents = {}
+        self.contents = {}
+        self.failures = {}
+
+
+# The session used outside of ParseSession.run:
+default = ParseSession()
+
+_session = contextvars.ContextVar("session", default=default)
+
+
+def current():
     """
-    # Retrieve the tag for the skill, or fall back to 'unnamed'.
-    skill_tag = skill.get("tag", "unnamed")
+    Return the session that's currently parsing.
 
-    if skill_tag in skills and skills[skill_tag]["path"] != skill["path"]:
-        if "-" in skill_tag:
-            prefix, _ = skill_tag.split("-")
-            skill_tag = f"{prefix}-{duplicate_suffix(prefix)}"
-        else:
-            skill_tag = f"{skill_tag}-{duplicate_suffix(skill_tag)}"
+    """
+    return _session.get()
 
-    # Set the unique tag:
-    skill["tag"] = skill_tag
 
-    # Store the skill
-    skills[skill_tag] = skill
+def __getattr__(name):
+    """
+    Access the storage of the current session as module attributes.
+
+    """
+    if name in ["db", "skills"]:
+        return getattr(current(), name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-    # Return this (now definitely unique) tag.
-    return skill_tag
+
+def duplicate_suffix(needle):
+    """
+    Allocate the next suffix for an existing prefix in the current session.
+
+    """
+    return current().skills.duplicate_suffix(needle)
+
+
+def skill_fingerprint(skill):
+    """
+    Fingerprint the content of a parsed skill.
+
+    The path and tag don't count: skills from different records, which can
+    have different tags, are the same skill if everything else is equal.
+
+    """
+    return fingerprint({key: value for key, value in skill.items() if key not in ("path", "tag")})
+
+
+def store_skill(skill):
+    """
+    Store a skill in the current session and return a unique tag.
+
+    """
+    return current().skills.store(skill)
 
 
 def reset():
     """
-    Reset the storage.
+    Reset the storage of the current session.
 
     This is used when parsing multiple locales.
 
     """
-    global db, skills
-    db = {}
-    skills = {}
+    current().reset()
@@ -0,0 +1,376 @@
+"""
+Functional tests for the skill storage and parse sessions.
+
+"""
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from tqdb import dbr as DBRParser
+from tqdb import storage
+from tqdb.constants import paths
+from tqdb.database import FileIndex, RecordSources
+from tqdb.parsers.main import Skipped
+from tqdb.scheduler import Scheduler
+
+
+@pytest.fixture(autouse=True)
+def reset_storage():
+    """
+    Start and end every test with empty storage.
+
+    """
+    storage.reset()
+    yield
+    storage.reset()
+
+
+def test_store_skill_same_path():
+    """
+    Test that storing a skill path again returns the same tag.
+
+    """
+    first = storage.store_skill({"tag": "tagSkillName185", "path": "a.dbr"})
+    second = storage.store_skill({"tag": "tagSkillName185", "path": "a.dbr"})
+
+    assert first == second == "tagSkillName185"
+    assert len(storage.skills) == 1
+
+
+def test_store_skill_duplicate_tags():
+    """
+    Test that different paths with the same tag get a unique suffix.
+
+    """
+    tags = [storage.store_skill({"tag": "tagSkillName185", "path": f"{i}.dbr", "level": i}) for i in range(3)]
+
+    assert tags == ["tagSkillName185", "tagSkillName185-1", "tagSkillName185-2"]
+
+    # A stored skill keeps its suffixed tag, which shouldn't be suffixed twice:
+    assert storage.store_skill({"tag": "tagSkillName185-1", "path": "3.dbr", "level": 3}) == "tagSkillName185-3"
+
+
+def test_store_skill_same_content():
+    """
+    Test that skills with the same content reference a single stored skill.
+
+    """
+    # A monster skill and a skill in the Earth tree, from different records:
+    properties = {"skillCooldownTime": "2.0 Second Recharge", "skillManaCost": "25 Energy Cost"}
+    first = storage.store_skill(
+        {"tag": "tagSkillName185", "path": "monster.dbr", "name": "Barrage", "properties": dict(properties)}
+    )
+    second = storage.store_skill(
+        {"tag": "tagSkillName185", "path": "earth.dbr", "name": "Barrage", "properties": dict(properties)}
+    )
+    third = storage.store_skill(
+        {
+            "tag": "tagSkillName185",
+            "path": "other.dbr",
+            "name": "Barrage",
+            "properties": {"skillManaCost": "5 Energy Cost"},
+        }
+    )
+
+    assert first == second == "tagSkillName185"
+    assert third == "tagSkillName185-1"
+    assert len(storage.skills) == 2
+
+
+def test_sessions_are_isolated():
+    """
+    Test that skills stored in a session aren't visible in other sessions.
+
+    """
+    session = storage.ParseSession()
+    tag = session.run(storage.store_skill, {"tag": "tagSkillName185", "path": "a.dbr"})
+
+    assert tag == "tagSkillName185"
+    assert tag in session.skills
+    assert tag not in storage.skills
+
+
+def test_cache_evicts_least_recently_used():
+    """
+    Test that the cache keeps at most its budget, evicting the least recently used results.
+
+    """
+    cache = storage.ParseCache(max_entries=2)
+    cache["a.dbr"] = {"tag": "a"}
+    cache["b.dbr"] = {"tag": "b"}
+
+    # Using a result makes it the most recently used one:
+    assert cache["a.dbr"]["tag"] == "a"
+    cache["c.dbr"] = {"tag": "c"}
+    assert len(cache) == 2
+    assert "a.dbr" in cache and "b.dbr" not in cache and "c.dbr" in cache
+
+    # Storing a cached key again doesn't evict anything:
+    cache["c.dbr"] = {"tag": "c2"}
+    assert len(cache) == 2 and cache["c.dbr"]["tag"] == "c2"
+
+    with pytest.raises(KeyError):
+        cache["b.dbr"]
+    assert cache.get("b.dbr", "missing") == "missing"
+
+
+def test_cache_without_budget_never_evicts():
+    """
+    Test that a cache without a budget keeps all results.
+
+    """
+    cache = storage.ParseCache(max_entries=None)
+    for index in range(100):
+        cache[f"{index}.dbr"] = {"tag": index}
+
+    assert len(cache) == 100
+
+
+def test_cache_pinned_results_survive_eviction():
+    """
+    Test that pinned results are never evicted, and don't count towards the budget.
+
+    """
+    cache = storage.ParseCache(max_entries=1)
+    cache.store("loot.dbr", {"tag": "loot"}, pinned=True)
+    cache["a.dbr"] = {"tag": "a"}
+    cache.pin(["a.dbr"])
+
+    for name in ["b.dbr", "c.dbr", "d.dbr"]:
+        cache[name] = {"tag": name}
+
+    assert "loot.dbr" in cache and "a.dbr" in cache
+    assert "b.dbr" not in cache and "c.dbr" not in cache and "d.dbr" in cache
+    assert len(cache) == 3
+
+
+def test_cache_aliases_survive_eviction():
+    """
+    Test that aliases don't count towards the budget, and resolve while their target is cached.
+
+    """
+    cache = storage.ParseCache(max_entries=2)
+    cache["a.dbr"] = {"tag": "a"}
+    for index in range(10):
+        cache.alias(f"copy{index}.dbr", "a.dbr")
+    cache["b.dbr"] = {"tag": "b"}
+
+    assert len(cache) == 2
+    assert all(cache[f"copy{index}.dbr"] is cache["a.dbr"] for index in range(10))
+
+    # Using an alias uses its target, so b is the least recently used one now:
+    cache["c.dbr"] = {"tag": "c"}
+    assert "copy0.dbr" in cache and "b.dbr" not in cache
+
+    # Once the target is evicted, the alias has to be parsed again too:
+    cache["d.dbr"] = {"tag": "d"}
+    cache["e.dbr"] = {"tag": "e"}
+    assert "a.dbr" not in cache and "copy0.dbr" not in cache
+
+
+def test_cache_looks_up_parent():
+    """
+    Test that a child cache falls back on its parent, and prefers its own results.
+
+    """
+    parent = storage.ParseCache(max_entries=1)
+    parent["a.dbr"] = {"tag": "a"}
+
+    child = storage.ParseCache(max_entries=1, parent=parent)
+    assert child["a.dbr"] is parent["a.dbr"]
+    assert child.get("b.dbr") is None
+
+    # Parent results don't count towards the budget of the child:
+    child["b.dbr"] = {"tag": "b"}
+    assert len(child) == 1 and "a.dbr" in child and "b.dbr" not in parent
+
+    child["a.dbr"] = {"tag": "child"}
+    assert child["a.dbr"]["tag"] == "child" and parent["a.dbr"]["tag"] == "a"
+
+
+def test_cache_shadows_parent():
+    """
+    Test that a child cache shares the parent's results, unless shadowed.
+
+    """
+    parent = storage.ParseCache()
+    parent["a.dbr"] = {"tag": "a"}
+    parent["b.dbr"] = {"tag": "b"}
+
+    child = storage.ParseCache(parent=parent, shadowed={"b.dbr"})
+    assert child["a.dbr"] is parent["a.dbr"]
+    assert "b.dbr" not in child
+
+    child["b.dbr"] = {"tag": "mod"}
+    assert child["b.dbr"]["tag"] == "mod"
+    assert parent["b.dbr"]["tag"] == "b"
+
+
+def test_cache_holds_results_until_released():
+    """
+    Test that held results aren't evicted, until all of their holds are released.
+
+    """
+    cache = storage.ParseCache(max_entries=2)
+    cache.hold(["a.dbr", "a.dbr", "b.dbr"])
+    for name in ["a.dbr", "b.dbr", "c.dbr"]:
+        cache[name] = {"tag": name}
+
+    # Held results count towards the budget, so only the other one is evicted:
+    assert "a.dbr" in cache and "b.dbr" in cache and "c.dbr" not in cache
+
+    cache.release(["a.dbr", "b.dbr"])
+    cache["c.dbr"] = {"tag": "c.dbr"}
+    assert "a.dbr" in cache and "b.dbr" not in cache and "c.dbr" in cache
+
+    cache.release(["a.dbr"])
+    cache["d.dbr"] = {"tag": "d.dbr"}
+    # A released result is the most recently used one:
+    assert len(cache) == 2 and "a.dbr" in cache and "c.dbr" not in cache
+
+
+def test_cache_aliases_share_result():
+    """
+    Test that an alias shares the result of its target until it's stored.
+
+    """
+    cache = storage.ParseCache()
+    cache["a.dbr"] = {"tag": "a"}
+    cache.alias("b.dbr", "a.dbr")
+    cache.alias("c.dbr", "b.dbr")
+
+    assert cache["c.dbr"] is cache["a.dbr"]
+    assert len(cache) == 1
+
+    cache["b.dbr"] = {"tag": "b"}
+    assert cache["b.dbr"]["tag"] == "b"
+    assert cache["c.dbr"]["tag"] == "a"
+
+
+def test_affected_dependents():
+    """
+    Test that records using an affected record, even indirectly, are affected.
+
+    """
+    session = storage.ParseSession()
+    session.dependents = {"item.dbr": {"table.dbr"}, "table.dbr": {"monster.dbr"}, "other.dbr": {"set.dbr"}}
+
+    assert session.affected({"item.dbr"}) == {"item.dbr", "table.dbr", "monster.dbr"}
+
+
+class ReferenceParser:
+    """
+    Parser that copies the value of the record it references, or its own.
+
+    """
+
+    CONTEXTUAL = False
+
+    @staticmethod
+    def path_key(dbr_file):
+        return ()
+
+    @staticmethod
+    def parse(dbr, dbr_file, result):
+        properties = DBRParser.peek(dbr_file, ["reference", "value"])
+        if "reference" in properties:
+            reference = DBRParser.parse(Path(properties["reference"]))
+            if isinstance(reference, Skipped):
+                return reference
+            result["value"] = reference["value"]
+        elif "value" in properties:
+            result["value"] = properties["value"]
+        else:
+            return Skipped("item-tag", dbr_file)
+
+
+@pytest.fixture
+def reference_parser(tmp_path, monkeypatch):
+    """
+    Parse all records with the ReferenceParser.
+
+    """
+    monkeypatch.setattr(paths, "CACHE", tmp_path / "cache")
+    monkeypatch.setattr(
+        DBRParser, "get_template", lambda dbr, dbr_file: SimpleNamespace(keys={}, variables={}, references=set())
+    )
+    monkeypatch.setattr(DBRParser, "get_parsers", lambda template: [ReferenceParser])
+
+
+def test_fork_parses_aliases_again(tmp_path, reference_parser):
+    """
+    Test that records sharing the result of another record, because their
+    contents are the same, are parsed again if an overlay affects that result.
+
+    """
+    root = tmp_path / "database"
+    root.mkdir()
+    (root / "value.dbr").write_text("value,1,\n")
+    for name in ["a.dbr", "b.dbr"]:
+        (root / name).write_text(f"reference,{root / 'value.dbr'},\n")
+
+    overlay = tmp_path / "mod"
+    overlay.mkdir()
+    (overlay / "value.dbr").write_text("value,2,\n")
+
+    session = storage.ParseSession(database=RecordSources([FileIndex(root, tmp_path / "cache" / "database.json")]))
+    assert [session.run(DBRParser.parse, root / name)["value"] for name in ["a.dbr", "b.dbr"]] == ["1", "1"]
+    assert session.db.aliases == {root / "b.dbr": root / "a.dbr"}
+
+    forked = session.fork([overlay])
+    assert [forked.run(DBRParser.parse, root / name)["value"] for name in ["b.dbr", "a.dbr"]] == ["2", "2"]
+
+
+def test_skipped_records_are_parsed_once(tmp_path, reference_parser, monkeypatch):
+    """
+    Test that a record that's skipped isn't parsed (or reported) again, but skipped again.
+
+    """
+    (tmp_path / "invalid.dbr").write_text("tag,x,\n")
+    (tmp_path / "item.dbr").write_text(f"reference,{tmp_path / 'invalid.dbr'},\n")
+
+    parsed = []
+    parse_record = DBRParser.parse_record
+    monkeypatch.setattr(DBRParser, "parse_record", lambda dbr, *args: parsed.append(dbr) or parse_record(dbr, *args))
+
+    for _ in range(2):
+        skipped = DBRParser.parse(tmp_path / "item.dbr")
+        assert (skipped.code, skipped.path) == ("invalid-reference", tmp_path / "item.dbr")
+
+    assert parsed == [tmp_path / "item.dbr", tmp_path / "invalid.dbr"]
+    assert storage.current().diagnostics.render() == [
+        f"Item {tmp_path / 'invalid.dbr'} has no itemNameTag.",
+        f"Record {tmp_path / 'item.dbr'} uses {tmp_path / 'invalid.dbr'}, which is skipped (item-tag).",
+    ]
+
+
+def test_fork_reuses_kept_files(tmp_path, reference_parser, monkeypatch):
+    """
+    Test that a session forked from one that keeps its files doesn't parse
+    the files the overlays don't affect again, however small its cache is.
+
+    """
+    root = tmp_path / "database"
+    root.mkdir()
+    files = [root / f"{name}.dbr" for name in ["a", "b", "c"]]
+    for dbr in files:
+        dbr.write_text(f"value,{dbr.stem},\n")
+
+    overlay = tmp_path / "mod"
+    overlay.mkdir()
+    (overlay / "b.dbr").write_text("value,mod,\n")
+
+    database = RecordSources([FileIndex(root, tmp_path / "cache" / "database.json")])
+    session = storage.ParseSession(max_entries=1, database=database, keep_files=True)
+    session.run(lambda: list(Scheduler().run(files)))
+
+    parsed = []
+    parse_record = DBRParser.parse_record
+    monkeypatch.setattr(DBRParser, "parse_record", lambda dbr, *args: parsed.append(dbr) or parse_record(dbr, *args))
+
+    forked = session.fork([overlay])
+    values = forked.run(lambda: [DBRParser.parse(dbr)["value"] for dbr in Scheduler().run(files)])
+
+    assert values == ["a", "mod", "c"]
+    assert parsed == [root / "b.dbr"]
@@ -2,19 +2,26 @@
 Classes and functionality relating to Templates.
 
 """
-import glob
+import functools
 import re
+import sys
 from pathlib import Path
 
 from tqdb.constants import paths
+from tqdb.database import database, textures
 
 templates_by_path = {}
 templates = {}
 
+# Numbered variables, like lootName1 to lootName30, by their family name:
+families = {}
+
 # Global directory constants
-TEMPLATE_DIR = paths.DB / "templates/**/*.tpl"
+TEMPLATE_DIR = "templates/**/*.tpl"
 TEMPLATE_PREFIX = "%TEMPLATE_DIR%"
-TEXTURES = Path("data/textures/")
+
+# Regex to split a numbered variable into its family name and number:
+NUMBERED_REGEX = re.compile(r"^(.*\D)(\d+)$")
 
 
 class Variable:
@@ -75,7 +82,7 @@ class Variable:
             values = value.split(";")
 
             if len(values) == 1:
-                return [self._parse(v) for v in values if self._parse(v)]
+                return [parsed for parsed in map(self._parse, values) if parsed]
 
             # If more than one value was present, keep all values:
             return [self._parse(v, always_return=True) for v in values]
@@ -102,11 +109,37 @@ class Variable:
             return bool(int(value)) if bool(int(value)) else None
         elif self["type"] == "file_dbr":
             # Prepare the DBR reference fully
-            return paths.DB / value.lower()
+            return dbr_reference(value.lower())
         elif self["type"] == "file_tex":
             # Prepare the TEX reference fully
-            return TEXTURES / value
-        return value
+            return tex_reference(value)
+
+        # Strings like classes and classifications recur a lot, share them:
+        return sys.intern(value)
+
+
+def dbr_reference(value):
+    """
+    Return the path for a DBR reference.
+
+    References are resolved to the actual case of the file when it exists, in
+    the record sources of the current session (see `RecordSources.reference`).
+
+    """
+    return database.reference(value)
+
+
+@functools.lru_cache(maxsize=None)
+def tex_reference(value):
+    """
+    Return the path for a TEX reference.
+
+    The same textures are referenced thousands of times, so each reference
+    returns one shared Path object. Unlike records, textures don't depend on
+    the session, so they're shared by all sessions.
+
+    """
+    return textures.resolve(value) or paths.TEXTURES / value
 
 
 class Template:
@@ -163,6 +196,12 @@ class Template:
         # Set the name of this template according to its Class:
         self.name = self.variables["Class"]["defaultValue"].lower() if "Class" in self.variables else None
 
+        # Map the encoded variable names to their names, for tokenizing DBR files:
+        self.keys = {name.encode(): name for name in self.variables}
+
+        # Encoded names of the variables that reference other DBR files:
+        self.references = {key for key, name in self.keys.items() if self.variables[name]["type"] == "file_dbr"}
+
     def parse_content(self, content, ancestry):
         """
         Parse the content, which has been split by newline into a list.
@@ -253,7 +292,7 @@ def load_templates():
     Load all the .tpl templates in the TEMPLATE_DIR.
 
     """
-    for template_file in glob.glob(str(TEMPLATE_DIR), recursive=True):
+    for template_file in database.glob(TEMPLATE_DIR):
         # Parse the template and store it by its key
         template = Template(template_file)
         templates_by_path[template.key] = template
@@ -261,5 +300,28 @@ def load_templates():
         if template.name:
             templates[template.name] = template
 
+    # Index the numbered variables of all templates by their family:
+    families.update(index_families(name for template in templates_by_path.values() for name in template.variables))
+
+
+def index_families(names):
+    """
+    Index numbered variable names by their family name.
+
+    Names are case sensitive, like the properties of a DBR, and names that
+    don't end in a number aren't in any family.
+
+    :return: dictionary keyed by family name, value is a list of
+        (number, variable name) tuples, sorted by number.
+
+    """
+    numbered = {}
+    for name in names:
+        match = NUMBERED_REGEX.match(name)
+        if match:
+            numbered.setdefault(match.group(1), {})[int(match.group(2))] = name
+
+    return {family: sorted(numbers.items()) for family, numbers in numbered.items()}
+
 
 load_templates()
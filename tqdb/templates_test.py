@@ -0,0 +1,42 @@
+"""
+Functional tests for the template variables.
+
+"""
+from tqdb.templates import index_families
+
+
+def test_families_are_sorted_by_number():
+    """
+    Test that numbered variables are indexed by their number, with gaps in the numbering.
+
+    """
+    families = index_families(["lootName10", "lootName2", "lootName1", "lootWeight3", "lootName30"])
+
+    assert families == {
+        "lootName": [(1, "lootName1"), (2, "lootName2"), (10, "lootName10"), (30, "lootName30")],
+        "lootWeight": [(3, "lootWeight3")],
+    }
+
+
+def test_families_are_case_sensitive():
+    """
+    Test that names that only differ in case are in their own family.
+
+    """
+    families = index_families(["skillName1", "SkillName2", "skillname3", "skillName4"])
+
+    assert families == {
+        "skillName": [(1, "skillName1"), (4, "skillName4")],
+        "SkillName": [(2, "SkillName2")],
+        "skillname": [(3, "skillname3")],
+    }
+
+
+def test_families_skip_unnumbered_names():
+    """
+    Test that only names that end in a number are indexed, by their last number.
+
+    """
+    families = index_families(["lootName", "skill10Level", "123", "chestTier2Name3", "itemLevel", ""])
+
+    assert families == {"chestTier2Name": [(3, "chestTier2Name3")]}
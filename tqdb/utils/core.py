@@ -95,16 +95,22 @@ def get_affix_table_type(file_prefix):
     return file_prefix
 
 
-def is_duplicate_affix(affixes, affix):
+def fingerprint(value):
     """
-    Check if the properties for an affix are already known.
+    Canonicalize (nested) properties into a hashable fingerprint.
 
-    """
-    for properties in affixes["properties"]:
-        if properties == affix["properties"]:
-            return True
+    Equal properties have equal fingerprints, regardless of key order, so
+    duplicates can be found with a set instead of comparing against each one.
 
-    return False
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, fingerprint(v)) for key, v in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(fingerprint(v) for v in value)
+    elif isinstance(value, set):
+        return frozenset(fingerprint(v) for v in value)
+
+    return value
 
 
 def pluck(d, *k):
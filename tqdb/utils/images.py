@@ -2,187 +2,558 @@
 Classes and functionality to store TQ images and styling.
 
 """
+import hashlib
+import json
 import logging
 import os
 import subprocess
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
-from shutil import rmtree
+from shutil import copyfile, rmtree
 
-from PIL import Image
+from PIL import Image, features
 
 from tqdb.constants import paths
+from tqdb.database import textures
+
+# Resampling filter for scaled sprites:
+LANCZOS = Image.Resampling.LANCZOS
+
+# Locks for icons that are being converted:
+ICON_LOCKS = {}
+ICON_LOCKS_GUARD = threading.Lock()
+
+
+class SkylinePacker:
+    """
+    SkylinePacker class.
+
+    Packs rectangles into a fixed width area of growing height, using the
+    skyline bottom-left heuristic: each rectangle is placed where its top edge
+    ends up lowest, preferring the leftmost position on ties.
+
+    """
+
+    def __init__(self, width):
+        self.width = width
+        self.height = 0
+
+        # The skyline is a list of [x, y, width] segments, from left to right:
+        self.skyline = [[0, 0, width]]
+
+    def insert(self, width, height):
+        """
+        Find a position for a rectangle and add it to the packed area.
+
+        :return: the (x, y) position of the top left corner of the rectangle.
+
+        """
+        best = None
+
+        for index in range(len(self.skyline)):
+            y = self.fits(index, width)
+            if y is None:
+                continue
+
+            # Bottom-left: lowest resulting top edge, then the leftmost:
+            candidate = (y + height, self.skyline[index][0], index, y)
+            if best is None or candidate < best:
+                best = candidate
+
+        if best is None:
+            raise ValueError(f"Rectangle of width {width} does not fit in {self.width}.")
+
+        _, x, index, y = best
+        self.add_segment(index, x, y + height, width)
+        self.height = max(self.height, y + height)
+
+        return x, y
+
+    def fits(self, index, width):
+        """
+        Check if a rectangle fits on the skyline, starting at a segment.
+
+        :return: the y position the rectangle would rest at, or None.
+
+        """
+        x = self.skyline[index][0]
+        if x + width > self.width:
+            return None
+
+        # The rectangle rests on the highest segment it spans:
+        y = 0
+        remaining = width
+        while remaining > 0:
+            _, segment_y, segment_width = self.skyline[index]
+            y = max(y, segment_y)
+            remaining -= segment_width
+            index += 1
+
+        return y
+
+    def add_segment(self, index, x, y, width):
+        """
+        Raise the skyline where a rectangle was placed.
+
+        """
+        self.skyline.insert(index, [x, y, width])
+        right = x + width
+
+        # Shrink or remove the segments that are now covered:
+        next_index = index + 1
+        while next_index < len(self.skyline):
+            segment = self.skyline[next_index]
+            if segment[0] >= right:
+                break
+
+            overlap = right - segment[0]
+            if overlap >= segment[2]:
+                self.skyline.pop(next_index)
+                continue
+
+            segment[0] += overlap
+            segment[2] -= overlap
+            break
+
+        # Merge neighbouring segments at the same height:
+        merged = [self.skyline[0]]
+        for segment in self.skyline[1:]:
+            if segment[1] == merged[-1][1]:
+                merged[-1][2] += segment[2]
+            else:
+                merged.append(segment)
+        self.skyline = merged
 
 
 class SpriteCreator:
     """
     SpriteCreator class.
 
-    Class that takes the bitmap outputs from the TQDB Parser and creates a
-    single sprite image and the corresponding sprite stylesheet.
+    Class that takes the bitmap outputs from the TQDB Parser and creates
+    sprite images and the corresponding sprite stylesheets.
+
+    By default a single sprite is created for all equipment. Otherwise one
+    sprite is created per equipment category. Each sprite is saved in all
+    requested formats and scales, and a JSON manifest lists the coordinates
+    (in 1x pixels) of every icon in every sprite.
+
+    The icons are taken from the `graphics` directory, and the sprites are
+    named after `name`, so the icons of overlays get a sprite of their own.
 
     """
 
-    def __init__(self):
-        # Image map will be used to categorize by sizes
-        images_map = {}
-        images = []
+    # Cached fingerprints of the icons, kept between runs:
+    FINGERPRINTS = paths.ICONS / "fingerprints.json"
 
-        try:
-            # Iterate through all the files and make a list of the image objects
-            for file in paths.GRAPHICS.glob('*.png'):
-                image = Image.open(file)
-                image.filename = os.path.basename(file).split(".")[0]
-                images.append(image)
+    # Maximum width of the sprite (it's only exceeded by wider images):
+    WIDTH = 768
 
-            if len(images) <= 0:
-                logging.warning(f"No images found in {paths.GRAPHICS}. Skipping creation of sprite sheet.")
-                return
+    CSS = ".{0} {{\n" "  background-position: {1} {2};\n" "  width: {3};\n" "  height: {4};\n}}\n"
+
+    # The sprite itself, with its scaled variants sized to the 1x coordinates:
+    SHEET_CSS = (
+        ".{0} {{\n"
+        '  background-image: url("{1}");\n'
+        "  background-image: image-set({2});\n"
+        "  background-size: {3} {4};\n}}\n"
+    )
+
+    # Supported output formats and their Pillow save options:
+    FORMATS = {
+        "png": {"format": "PNG", "optimize": True},
+        "webp": {"format": "WEBP", "lossless": True},
+    }
 
-            logging.info(f"Combining {len(images)} images into a sprite sheet.")
+    def __init__(self, per_category=False, formats=("png",), scales=(1,), graphics=paths.GRAPHICS, name="sprite"):
+        # Only keep the formats that this Pillow installation can write:
+        if "webp" in formats and not features.check("webp"):
+            logging.warning("Pillow was built without WebP support. Skipping WebP sprites.")
+            formats = [f for f in formats if f != "webp"]
 
-            # Sort images so output is consistent (useful for diffs)
-            images.sort(key=lambda x: x.filename)
+        # The 1x sprite is always created, the coordinates are based on it:
+        scales = sorted(set([1, *scales]))
 
-            # Iterate through all the image objects and organize them by size
-            for image in images:
-                width, height = image.size
+        fingerprints = self.load_fingerprints()
+        categories = self.index_icons(graphics, fingerprints)
+        self.save_fingerprints(fingerprints)
 
-                # Append this image to its size list, or create a new size list
-                key = f"{width}x{height}"
-                if key in images_map:
-                    images_map[key].append(image)
+        if len(categories) <= 0:
+            logging.warning(f"No images found in {graphics}. Skipping creation of sprite sheet.")
+            return
+
+        if per_category:
+            sheets = dict((f"{name}.{category}", icons) for category, icons in categories.items())
+        else:
+            sheets = {name: self.merge(categories)}
+
+        manifest = {}
+        for sheet, icons in sorted(sheets.items()):
+            manifest[sheet] = self.create_sheet(sheet, icons, formats, scales)
+
+        # Save the manifest with the coordinates of all sprites
+        with open(paths.OUTPUT / f"{name}.json", "w", encoding="utf8") as manifest_file:
+            json.dump(manifest, manifest_file, sort_keys=True)
+
+        # Remove all the images
+        rmtree(graphics)
+
+    def index_icons(self, graphics, fingerprints):
+        """
+        Group the images per category by their pixels.
+
+        Identical icons are stored once. Only the fingerprints and sizes are
+        kept, images are loaded again when they are pasted.
+
+        :return: dictionary keyed by category, value is a dictionary keyed by
+            fingerprint with a (file, size, tags) tuple.
+
+        """
+        categories = defaultdict(dict)
+        for file in sorted(graphics.glob("*/*.png")):
+            name = file.name.split(".")[0]
+
+            # The fingerprints of icons are cached by the hash of their file:
+            with open(file, "rb") as icon:
+                key = hashlib.sha1(icon.read()).hexdigest()
+
+            if key not in fingerprints:
+                with Image.open(file) as image:
+                    fingerprints[key] = (self.fingerprint(image), image.size)
+
+            fingerprint, size = fingerprints[key]
+            unique = categories[file.parent.name]
+            if fingerprint in unique:
+                unique[fingerprint][2].append(name)
+            else:
+                unique[fingerprint] = (file, tuple(size), [name])
+
+        return categories
+
+    @staticmethod
+    def merge(categories):
+        """
+        Merge the icons of all categories, keeping each tag only once.
+
+        """
+        merged = {}
+        seen = set()
+        for _, icons in sorted(categories.items()):
+            for fingerprint, (file, size, names) in icons.items():
+                names = [name for name in names if name not in seen]
+                seen.update(names)
+
+                if not names:
+                    continue
+
+                if fingerprint in merged:
+                    merged[fingerprint][2].extend(names)
                 else:
-                    images_map[key] = [image]
-
-            # Keep a sorted list of the keys (descending by height):
-            sorted_keys = list(images_map.keys())
-            sorted_keys.sort(key=lambda x: int(x.split("x")[1]))
-
-            # Maximum width of the sprite is 768px
-            sprite_width = 768
-            sprite_height = 0
-            sprite_css = ".{0} {{\n" "  background-position: {1} {2};\n" "  width: {3};\n" "  height: {4};\n}}\n"
-
-            # Keep track of the canvases (per size) and css (per image)
-            css = []
-            canvases = []
-
-            # Run through the keys (sorted by descending height)
-            for key in sorted_keys:
-                canvas_width, canvas_height = tuple(map(int, key.split("x")))
-
-                canvas = Image.new(mode="RGBA", size=(sprite_width, canvas_height), color=(0, 0, 0, 0))
-                x = 0
-
-                # Iterate over all the images in this size:
-                for index, image in enumerate(images_map[key]):
-                    image_width, image_height = image.size
-                    if x + image_width < sprite_width:
-                        canvas.paste(image, (x, 0))
-                        css.append(
-                            sprite_css.format(
-                                image.filename,
-                                f"{0 - x}px" if 0 - x != 0 else 0 - x,
-                                (f"{0 - sprite_height}px" if 0 - sprite_height != 0 else 0 - sprite_height),
-                                (f"{image_width}px" if image_width != 0 else image_width),
-                                (f"{image_height}px" if image_height != 0 else image_height),
-                            )
-                        )
-                        x += image_width
-
-                    elif x + image_width == sprite_width:
-                        canvas.paste(image, (x, 0))
-                        css.append(
-                            sprite_css.format(
-                                image.filename,
-                                f"{0 - x}px" if 0 - x != 0 else 0 - x,
-                                (f"{0 - sprite_height}px" if 0 - sprite_height != 0 else 0 - sprite_height),
-                                (f"{image_width}px" if image_width != 0 else image_width),
-                                (f"{image_height}px" if image_height != 0 else image_height),
-                            )
-                        )
-
-                        if index == len(images_map[key]) - 1:
-                            # Last image, append canvas:
-                            canvases.append(canvas)
-                            sprite_height += canvas_height
-                        else:
-                            # More images to come, reset row:
-                            x += image_width
-                    else:
-                        canvases.append(canvas)
-                        canvas = Image.new(mode="RGBA", size=(sprite_width, canvas_height), color=(0, 0, 0, 0))
-                        canvas.paste(image, (0, 0))
-                        x = image_width
-                        sprite_height += canvas_height
-
-                        css.append(
-                            sprite_css.format(
-                                image.filename,
-                                0,
-                                (f"{0 - sprite_height}px" if 0 - sprite_height != 0 else 0 - sprite_height),
-                                (f"{image_width}px" if image_width != 0 else image_width),
-                                (f"{image_height}px" if image_height != 0 else image_height),
-                            )
-                        )
-
-                # Append last row
-                if x < sprite_width:
-                    canvases.append(canvas)
-                    sprite_height += canvas_height
-        finally:
-            for image in images:
-                image.close()
-
-        # Create the new sprite image
-        sprite_image = Image.new(mode="RGBA", size=(sprite_width, sprite_height), color=(0, 0, 0, 0))
-        sprite_y = 0
-
-        # Paste all the canvases on the sprite image
-        for canvas in canvases:
-            sprite_image.paste(canvas, (0, sprite_y))
-            sprite_y += canvas.size[1]
-
-        # Save the sprite
-        sprite_image.save(paths.OUTPUT / "sprite.png", optimize=True)
-
-        # Save the CSS
+                    merged[fingerprint] = (file, size, names)
+
+        return merged
+
+    def create_sheet(self, name, icons, formats, scales):
+        """
+        Pack and save a single sprite and its stylesheet.
+
+        :return: the manifest entry for this sprite.
+
+        """
+        # Pack the tallest (then widest) images first, sorted by name on ties
+        # so output is consistent (useful for diffs):
+        images = sorted(icons.values(), key=lambda x: (-x[1][1], -x[1][0], x[0].name))
+
+        total = sum(len(names) for _, _, names in images)
+        logging.info(f"Combining {total} images ({len(images)} unique) into {name}.")
+
+        packer = SkylinePacker(max([self.WIDTH] + [width for _, (width, _), _ in images]))
+        placements = [(file, packer.insert(*size), size, names) for file, size, names in images]
+
+        # Preallocate the sprite image for every scale:
+        sprites = dict(
+            (scale, Image.new(mode="RGBA", size=self.scale_box(scale, 0, 0, packer.width, packer.height)[2:]))
+            for scale in scales
+        )
+
+        css = []
+        coordinates = {}
+        for file, (x, y), (width, height), names in placements:
+            # Paste the image directly onto the sprite for every scale:
+            with Image.open(file) as image:
+                for scale, sprite_image in sprites.items():
+                    left, top, scaled_width, scaled_height = self.scale_box(scale, x, y, width, height)
+                    scaled = image if scale == 1 else image.resize((scaled_width, scaled_height), LANCZOS)
+                    sprite_image.paste(scaled, (left, top))
+
+            # Every tag with this image points at the same position:
+            for tag in names:
+                css.append(self.format_css(tag, x, y, width, height))
+                coordinates[tag] = [x, y, width, height]
+
+        # Save the sprite in all formats and scales
+        files = {}
+        sizes = {}
+        for scale, sprite_image in sprites.items():
+            suffix = "" if scale == 1 else f"@{scale:g}x"
+            files[f"{scale:g}x"] = {}
+            for output_format in formats:
+                file_name = f"{name}{suffix}.{output_format}"
+                sprite_image.save(paths.OUTPUT / file_name, **self.FORMATS[output_format])
+                files[f"{scale:g}x"][output_format] = file_name
+
+            # Scaled sprites round their size, so it's listed for each scale:
+            sizes[f"{scale:g}x"] = {"height": sprite_image.height, "scale": scale, "width": sprite_image.width}
+            sprite_image.close()
+
+        # Save the CSS, the rule for the sprite itself (in the first format) goes first:
         css.sort()
-        with open(paths.OUTPUT / "sprite.css", "w") as css_file:
+        if formats:
+            css.insert(0, self.format_sheet_css(name, files, formats[0], packer.width, packer.height))
+        with open(paths.OUTPUT / f"{name}.css", "w") as css_file:
             for line in css:
                 css_file.write(f"{line}\n")
 
-        # Remove all the images
-        rmtree(paths.GRAPHICS)
+        return {
+            "css": f"{name}.css",
+            "files": files,
+            "height": packer.height,
+            "icons": coordinates,
+            "scales": sizes,
+            "width": packer.width,
+        }
+
+    @staticmethod
+    def scale_box(scale, x, y, width, height):
+        """
+        Scale a box on the sprite, without overlapping its neighbours.
+
+        At small scales a box can round down to nothing, so it's always kept at
+        least a pixel wide and high, even if it overlaps its neighbour then.
+
+        :return: the (x, y, width, height) of the scaled box.
+
+        """
+        left, top = round(x * scale), round(y * scale)
+        return left, top, max(1, round((x + width) * scale) - left), max(1, round((y + height) * scale) - top)
+
+    @classmethod
+    def load_fingerprints(cls):
+        """
+        Load the cached icon fingerprints.
+
+        """
+        if not os.path.isfile(cls.FINGERPRINTS):
+            return {}
+
+        with open(cls.FINGERPRINTS, encoding="utf8") as fingerprints_file:
+            return json.load(fingerprints_file)
+
+    @classmethod
+    def save_fingerprints(cls, fingerprints):
+        """
+        Save the icon fingerprints to the cache.
+
+        """
+        if not os.path.exists(cls.FINGERPRINTS.parent):
+            os.makedirs(cls.FINGERPRINTS.parent)
+
+        with open(cls.FINGERPRINTS, "w", encoding="utf8") as fingerprints_file:
+            json.dump(fingerprints, fingerprints_file, sort_keys=True)
+
+    @staticmethod
+    def fingerprint(image):
+        """
+        Hash the decoded pixels of an image.
+
+        """
+        pixels = image.convert("RGBA")
+        return hashlib.sha1(f"{pixels.size}".encode() + pixels.tobytes()).hexdigest()
+
+    @classmethod
+    def format_css(cls, name, x, y, width, height):
+        """
+        Format the CSS rule for an image at a position in the sprite.
+
+        """
+
+        def px(value):
+            # Zero values are written without a unit:
+            return f"{value}px" if value != 0 else value
+
+        return cls.CSS.format(name, px(0 - x), px(0 - y), px(width), px(height))
+
+    @classmethod
+    def format_sheet_css(cls, name, files, output_format, width, height):
+        """
+        Format the CSS rule for a sprite, that picks the scale for the screen.
+
+        The rule is named after the sprite (with dashes instead of dots). The
+        icon positions are in 1x pixels, so every scale is sized to the 1x
+        sprite.
+
+        :param files: the file names of the sprite, per scale and format.
+
+        """
+        images = ", ".join(f'url("{formats[output_format]}") {scale}' for scale, formats in files.items())
+        return cls.SHEET_CSS.format(
+            name.replace(".", "-"), files["1x"][output_format], images, f"{width}px", f"{height}px"
+        )
 
 
 ###############################################################################
 #                              BITMAP UTILITY                                 #
 ###############################################################################
-def save_bitmap(item, item_type: str, graphics: Path):
+class BitmapConverter:
+    """
+    BitmapConverter class.
+
+    Converts item bitmaps in a bounded pool of worker threads, so the texture
+    file reads, writes and TextureViewer runs don't stall the parsing.
+
+    Submitting blocks when too many conversions are pending. Use it as a
+    context manager to wait for all conversions to finish.
+
+    A converter can be shared by sessions that parse at the same time, so each
+    icon is only converted once for all of them.
+
+    """
+
+    def __init__(self, graphics: Path, workers=None, pending=64):
+        self.graphics = graphics
+        self.executor = ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1))
+        self.slots = threading.BoundedSemaphore(pending)
+
+        # The last submitted conversion, and its bitmap, for each output file:
+        self.conversions = {}
+        self.bitmaps = {}
+
+        # Sessions can submit from multiple threads:
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, item, item_type: str):
+        """
+        Pop the bitmap off an item and queue its conversion.
+
+        """
+        # Wait for a free slot before adding more work:
+        self.slots.acquire()
+
+        with self.lock:
+            target = bitmap_target(item, item_type, self.graphics, self.conversions)
+
+            # Another session can submit the same bitmap for an output:
+            if not target or self.bitmaps.get(target[1]) == target[0]:
+                self.slots.release()
+                return
+
+            bitmap, output = target
+
+            # A conversion to the same output waits for the previous one to finish,
+            # so the last submitted bitmap is the one that's kept:
+            conversion = self.executor.submit(self.convert, bitmap, output, self.conversions.get(output))
+            conversion.add_done_callback(lambda _: self.slots.release())
+            self.conversions[output] = conversion
+            self.bitmaps[output] = bitmap
+
+    @staticmethod
+    def convert(bitmap: Path, output: Path, previous=None):
+        if previous:
+            # The result of the previous conversion is not needed:
+            wait([previous])
+
+        store_icon(bitmap, output)
+
+    def close(self):
+        """
+        Wait for all pending conversions to finish.
+
+        """
+        self.executor.shutdown(wait=True)
+
+        for output, conversion in self.conversions.items():
+            if conversion.exception():
+                logging.error(f"Could not convert bitmap for {output}: {conversion.exception()}")
+
+
+def bitmap_target(item, item_type: str, graphics: Path, pending=()):
+    """
+    Pop the bitmap off an item and determine the icon to save it as.
+
+    Icons are saved per category, as `graphics/<category>/<tag>.png`.
+
+    :param pending: output files that are already being saved.
+    :return: the bitmap and output file, or None if it shouldn't be saved.
+
+    """
     bitmap = item.pop("bitmap", None)
     tag = item["tag"]
 
-    if not tag or not bitmap or not bitmap.is_file():
+    if not tag or not bitmap or not textures.exists(bitmap):
         logging.warning(f'Missing tag or bitmap for {item["tag"]}: {bitmap}')
-        return
+        return None
 
     # Tags for formula's are all the same (lesser, greater, divine)
     if item_type == "ItemArtifactFormula":
         tag = item["classification"].lower()
     # Skip all non-MI duplicates
-    elif item.get("classification", None) != "Rare" and os.path.isfile(graphics / f"{tag}.png"):
+    elif item.get("classification", None) != "Rare" and (
+        graphics / item_type / f"{tag}.png" in pending or os.path.isfile(graphics / item_type / f"{tag}.png")
+    ):
+        return None
+
+    return bitmap, graphics / item_type / f"{tag}.png"
+
+
+def store_icon(bitmap: Path, output: Path):
+    """
+    Save the icon for a bitmap, converting it if it isn't cached yet.
+
+    """
+    with open(bitmap, "rb") as texture:
+        content = texture.read()
+
+    # Converted icons are cached by the hash of their texture, so unchanged
+    # textures are never converted again:
+    icon = paths.ICONS / f"{hashlib.sha1(content).hexdigest()}.png"
+
+    # Different items can share a texture, only convert it once:
+    with ICON_LOCKS_GUARD:
+        icon_lock = ICON_LOCKS.setdefault(icon, threading.Lock())
+
+    with icon_lock:
+        if not icon.is_file():
+            convert_texture(bitmap, content, icon)
+
+    if not icon.is_file():
+        logging.warning(f"Could not convert bitmap {bitmap} for {output}")
         return
 
+    # The graphics only hold a copy of the icon, named by the tag:
+    os.makedirs(output.parent, exist_ok=True)
+    copyfile(icon, output)
+
+
+def convert_texture(bitmap: Path, content: bytes, output: Path):
+    """
+    Convert a TEX texture to a PNG file with the TextureViewer.
+
+    """
+    os.makedirs(output.parent, exist_ok=True)
+
     filename = str(bitmap)
-    h = open(bitmap, "rb")
-    alls = h.read()
-    h.close()
     magic = b"TEX" + b"\x02"
-    magicpos = alls.find(magic)
+    magicpos = content.find(magic)
 
     if magicpos == 0:
-        ba = bytearray(alls)
+        ba = bytearray(content)
         ba[3] = 1
         ba.pop(8)
         alls2 = bytes(ba)
@@ -192,14 +563,12 @@ def save_bitmap(item, item_type: str, graphics: Path):
         h2.write(alls2)
         h2.close()
 
-    # Run the texture viewer if a bitmap and tag are set:
+    # Run the texture viewer to convert the texture:
     command = [
         "utils/textureviewer/TextureViewer.exe",
         # Convert path to string
         str(filename),
-        # Output to graphics folder, file name being the tag.
-        str(graphics / f"{tag}.png"),
+        # Output to the given file
+        str(output),
     ]
     subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-
-    return
@@ -0,0 +1,201 @@
+"""
+Functional tests for the sprite sheets and bitmap conversion.
+
+"""
+import json
+import random
+import threading
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from tqdb.utils import images
+from tqdb.utils.images import BitmapConverter, SkylinePacker, SpriteCreator
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_packer_places_without_overlap(seed):
+    """
+    Test that packed rectangles don't overlap and stay within the sheet.
+
+    """
+    generator = random.Random(seed)
+    sizes = [(generator.randint(1, 96), generator.randint(1, 96)) for _ in range(200)]
+
+    packer = SkylinePacker(256)
+    boxes = [(*packer.insert(width, height), width, height) for width, height in sizes]
+
+    for x, y, width, height in boxes:
+        assert x >= 0 and y >= 0
+        assert x + width <= packer.width and y + height <= packer.height
+
+    for index, (x, y, width, height) in enumerate(boxes):
+        for other_x, other_y, other_width, other_height in boxes[index + 1 :]:
+            assert (
+                x + width <= other_x
+                or other_x + other_width <= x
+                or y + height <= other_y
+                or other_y + other_height <= y
+            )
+
+    assert packer.height == max(y + height for _, y, _, height in boxes)
+
+
+def test_packer_rejects_wide_rectangles():
+    """
+    Test that a rectangle wider than the sheet isn't placed.
+
+    """
+    with pytest.raises(ValueError):
+        SkylinePacker(64).insert(65, 1)
+
+
+def test_identical_icons_are_stored_once(tmp_path):
+    """
+    Test that icons with the same pixels are indexed and merged once.
+
+    """
+    for category, name, color in [
+        ("ring", "ring01", "red"),
+        ("ring", "ring02", "red"),
+        ("ring", "ring03", "blue"),
+        ("amulet", "amulet01", "red"),
+    ]:
+        (tmp_path / category).mkdir(exist_ok=True)
+        Image.new("RGBA", (4, 4), color).save(tmp_path / category / f"{name}.png")
+
+    # Index without creating the sprites:
+    categories = SpriteCreator.__new__(SpriteCreator).index_icons(tmp_path, {})
+
+    assert sorted(sorted(names) for _, _, names in categories["ring"].values()) == [["ring01", "ring02"], ["ring03"]]
+    assert sorted(sorted(names) for _, _, names in SpriteCreator.merge(categories).values()) == [
+        ["amulet01", "ring01", "ring02"],
+        ["ring03"],
+    ]
+
+
+@pytest.mark.parametrize("scale", [0.1, 0.25, 0.5, 1.5, 2])
+def test_scaled_boxes_are_never_empty(scale):
+    """
+    Test that scaled boxes are at least a pixel wide and high.
+
+    """
+    for x in range(64):
+        for size in range(1, 8):
+            _, _, width, height = SpriteCreator.scale_box(scale, x, x, size, size)
+            assert width >= 1 and height >= 1
+
+
+def test_scaled_boxes_tile_the_sheet():
+    """
+    Test that neighbouring boxes that are large enough don't overlap when scaled.
+
+    """
+    left, _, width, _ = SpriteCreator.scale_box(0.5, 0, 0, 33, 33)
+    right, _, _, _ = SpriteCreator.scale_box(0.5, 33, 0, 33, 33)
+
+    assert left + width == right
+
+
+def test_converter_keeps_last_submitted_bitmap(tmp_path, monkeypatch):
+    """
+    Test that the last bitmap submitted for an icon is the one that's saved.
+
+    """
+    monkeypatch.setattr(images, "textures", SimpleNamespace(exists=lambda bitmap: True))
+
+    # The first conversion is only finished after the second one is submitted:
+    submitted = threading.Event()
+
+    def store_icon(bitmap, output):
+        if bitmap == "first.tex":
+            submitted.wait(5)
+        output.parent.mkdir(exist_ok=True)
+        output.write_text(bitmap)
+
+    monkeypatch.setattr(images, "store_icon", store_icon)
+
+    with BitmapConverter(tmp_path, workers=2) as bitmaps:
+        for bitmap in ["first.tex", "second.tex"]:
+            bitmaps.submit({"tag": "ring01", "bitmap": bitmap, "classification": "Rare"}, "ring")
+        submitted.set()
+
+    assert (tmp_path / "ring" / "ring01.png").read_text() == "second.tex"
+
+
+def test_shared_converter_converts_once(tmp_path, monkeypatch):
+    """
+    Test that sessions sharing a converter convert each bitmap once for an icon.
+
+    """
+    monkeypatch.setattr(images, "textures", SimpleNamespace(exists=lambda bitmap: True))
+
+    stored = []
+    monkeypatch.setattr(images, "store_icon", lambda bitmap, output: stored.append((bitmap, output)))
+
+    def parse(bitmaps):
+        for tag, classification in [("ring01", "Rare"), ("ring02", "Epic")]:
+            bitmaps.submit({"tag": tag, "bitmap": f"{tag}.tex", "classification": classification}, "ring")
+
+    with BitmapConverter(tmp_path, workers=2) as bitmaps:
+        sessions = [threading.Thread(target=parse, args=(bitmaps,)) for _ in range(4)]
+        for session in sessions:
+            session.start()
+        for session in sessions:
+            session.join()
+
+    assert sorted(stored) == [
+        ("ring01.tex", tmp_path / "ring" / "ring01.png"),
+        ("ring02.tex", tmp_path / "ring" / "ring02.png"),
+    ]
+
+
+def test_scaled_sheets_are_sized_to_1x(tmp_path, monkeypatch):
+    """
+    Test that the sprite rule sizes every scale to the 1x sprite, and the manifest lists each size.
+
+    """
+    monkeypatch.setattr(images.paths, "OUTPUT", tmp_path)
+
+    icons = {}
+    for name, size in [("ring01", (5, 7)), ("ring02", (3, 3))]:
+        file = tmp_path / f"{name}.png"
+        Image.new("RGBA", size, "red").save(file)
+        icons[name] = (file, size, [name])
+
+    sheet = SpriteCreator.__new__(SpriteCreator).create_sheet("sprite.ring", icons, ["png"], [0.5, 1, 2])
+
+    assert sheet["scales"]["1x"] == {"height": sheet["height"], "scale": 1, "width": sheet["width"]}
+    for scale, size in sheet["scales"].items():
+        with Image.open(tmp_path / sheet["files"][scale]["png"]) as image:
+            assert [image.width, image.height] == [size["width"], size["height"]]
+
+    css = (tmp_path / "sprite.ring.css").read_text()
+    assert css.startswith(
+        ".sprite-ring {\n"
+        '  background-image: url("sprite.ring.png");\n'
+        '  background-image: image-set(url("sprite.ring@0.5x.png") 0.5x, url("sprite.ring.png") 1x, '
+        'url("sprite.ring@2x.png") 2x);\n'
+        f"  background-size: {sheet['width']}px {sheet['height']}px;\n}}\n"
+    )
+    assert ".ring01 {" in css and ".ring02 {" in css
+
+
+def test_manifest_is_named_after_the_sprite(tmp_path, monkeypatch):
+    """
+    Test that the manifest of the sprite sheets per category is named after the sprite.
+
+    """
+    monkeypatch.setattr(images.paths, "OUTPUT", tmp_path)
+    monkeypatch.setattr(SpriteCreator, "FINGERPRINTS", tmp_path / "fingerprints.json")
+
+    graphics = tmp_path / "graphics"
+    for category, name in [("amulet", "amulet01"), ("ring", "ring01")]:
+        (graphics / category).mkdir(parents=True)
+        Image.new("RGBA", (4, 4), "red").save(graphics / category / f"{name}.png")
+
+    SpriteCreator(per_category=True, graphics=graphics, name="sprite.mod")
+
+    assert not (tmp_path / "sprite.mod.ring.json").exists()
+    assert sorted(json.loads((tmp_path / "sprite.mod.json").read_text())) == ["sprite.mod.amulet", "sprite.mod.ring"]
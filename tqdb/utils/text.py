@@ -5,12 +5,12 @@ These text related functions are the strings that are displayed for attributes,
 item names, and all other properties used in Titan Quest.abs
 
 """
-import json
 import logging
 import os
 import re
 
 from tqdb.constants import paths
+from tqdb.session import session_attribute
 
 
 class Texts:
@@ -340,14 +340,10 @@ class Texts:
         # Now merge the replacement strings:
         self.strings.update(replacements)
 
-        # Last but not least, merge the entirety of text resources:
+        # Last but not least, merge the entirety of text resources. The texts
+        # are written by the output writer, so they can be reviewed:
         self.texts = {**self.tags, **self.strings}
 
-        # Output the dictionary so it can be reviewed during parsings:
-        output_name = paths.OUTPUT / f"texts.{self.locale}.json"
-        with open(output_name, "w", encoding="utf8") as texts_file:
-            json.dump(self.texts, texts_file, ensure_ascii=False, sort_keys=True)
-
     def has(self, string):
         """
         Returns a boolean indicating whether or not this string is known.
@@ -408,4 +404,4 @@ class Texts:
 
 
 # Prepare an instance for usage:
-texts = Texts()
+texts = session_attribute("texts")